@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+'''
+Microbenchmarks of the sub-block kernels in `flib`, compared with equivalent numpy gathers.
+
+Each kernel family is timed on sweeps of one parameter around a base point, the winners and
+the crossover points(parameter values where the winner changes) are written to a json file.
+
+Usage:
+    python bench_flib.py [--quick] [--real] [--threads 8] [--families vmps2 dmrg] [-o flib.json]
+'''
+
+from numpy import *
+import scipy.sparse as sps
+import os,sys,json,time,argparse,pdb
+BENCH_DIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.join(BENCH_DIR,'..'))
+
+import flib
+from flib import fget_subblock2a,fget_subblock2b,fget_subblock1,fget_subblock_dmrg
+from flib import pyflib
+
+#the maximum dimension of a dense intermediate matrix in numpy baselines, larger ones are skipped.
+MAX_DENSE=4096
+
+def _crand(*shape):
+    '''Random complex array.'''
+    return random.random(shape)-0.5+1j*(random.random(shape)-0.5)
+
+def _indices(shape,ndim):
+    '''Random sorted indices of `ndim` states in the product space, as a (ndim, len(shape)) int32 array.'''
+    ntot=prod(shape)
+    flat=sort(random.choice(ntot,min(ndim,ntot),replace=False))
+    return asarray(transpose(unravel_index(flat,shape)),dtype='int32',order='F'),flat
+
+def setup_vmps2(nl,nr,nh,hndim,ndim):
+    '''Operands of the 2-site VMPS sub-block.'''
+    fl,fr=_crand(nl,nh,nl),_crand(nr,nh,nr)
+    o1,o2=_crand(nh,hndim,hndim,nh),_crand(nh,hndim,hndim,nh)
+    indices,flat=_indices((nl,hndim,hndim,nr),ndim)
+    return dict(fl=fl,o1=o1,o2=o2,fr=fr,indices=indices,flat=flat,shape=(nl,hndim,hndim,nr))
+
+def setup_vmps1(nl,nr,nh,hndim,ndim):
+    '''Operands of the 1-site VMPS sub-block.'''
+    fl,fr=_crand(nl,nh,nl),_crand(nr,nh,nr)
+    o1=_crand(nh,hndim,hndim,nh)
+    indices,flat=_indices((nl,hndim,nr),ndim)
+    return dict(fl=fl,o1=o1,fr=fr,indices=indices,flat=flat,shape=(nl,hndim,nr))
+
+def setup_dmrg(nl,nr,ndim,is_identity=0):
+    '''Operands of the DMRG sub-block of kron(hl, hr).'''
+    hl,hr=_crand(nl,nl),_crand(nr,nr)
+    if is_identity==1: hl=identity(nl,dtype='complex128')
+    if is_identity==2: hr=identity(nr,dtype='complex128')
+    indices,flat=_indices((nl,nr),ndim)
+    return dict(hl=asfortranarray(hl),hr=asfortranarray(hr),indices=indices,flat=flat,is_identity=is_identity,shape=(nl,nr))
+
+def vmps2_einsum_dense(fl,o1,o2,fr,flat,shape,**kwargs):
+    '''Contract the whole operator, then take the sub-block.'''
+    D=prod(shape)
+    if D>MAX_DENSE: return None
+    full=einsum('iaj,akmb,bpqc,rcs->ikprjmqs',fl,o1,o2,fr,optimize=True).reshape([D,D])
+    return full[ix_(flat,flat)]
+
+def vmps2_einsum_gather(fl,o1,o2,fr,indices,flat,shape,**kwargs):
+    '''Gather the columns, contract them at once, then gather the rows(numpy analog of `fget_subblock2b`).'''
+    j1,j2,j3,j4=indices.T
+    cols=einsum('iaj,akjb,bpjc,rcj->ikprj',fl[:,:,j1],o1[:,:,j2,:],o2[:,:,j3,:],fr[:,:,j4],optimize=True)
+    return cols.reshape([-1,len(flat)])[flat]
+
+def vmps1_einsum_dense(fl,o1,fr,flat,shape,**kwargs):
+    '''Contract the whole operator, then take the sub-block.'''
+    D=prod(shape)
+    if D>MAX_DENSE: return None
+    full=einsum('iaj,akmb,rbs->ikrjms',fl,o1,fr,optimize=True).reshape([D,D])
+    return full[ix_(flat,flat)]
+
+def vmps1_einsum_gather(fl,o1,fr,indices,flat,shape,**kwargs):
+    '''Gather the columns, contract them at once, then gather the rows(numpy analog of `fget_subblock1`).'''
+    j1,j2,j3=indices.T
+    cols=einsum('iaj,akjb,rbj->ikrj',fl[:,:,j1],o1[:,:,j2,:],fr[:,:,j3],optimize=True)
+    return cols.reshape([-1,len(flat)])[flat]
+
+def dmrg_fancy(hl,hr,indices,is_identity,**kwargs):
+    '''Fancy indexing of the two factors.'''
+    il,ir=indices.T
+    if is_identity==1:
+        return (il[:,newaxis]==il)*hr[ix_(ir,ir)]
+    elif is_identity==2:
+        return hl[ix_(il,il)]*(ir[:,newaxis]==ir)
+    return hl[ix_(il,il)]*hr[ix_(ir,ir)]
+
+def dmrg_kron_slice(hl,hr,flat,**kwargs):
+    '''Sparse kronecker product, then slicing(as `_gen_hamiltonian_block0` in `dmrg`).'''
+    H=sps.kron(sps.csr_matrix(hl),sps.csr_matrix(hr),format='csr')
+    return H[flat][:,flat].toarray()
+
+#family -> (setup, {kernel name: function}, base parameters, sweeps, quick sweeps)
+FAMILIES={
+        'vmps2':(setup_vmps2,{
+            'fget_subblock2a':lambda fl,o1,o2,fr,indices,**kwargs:fget_subblock2a(fl,o1,o2,fr,indices),
+            'fget_subblock2b':lambda fl,o1,o2,fr,indices,**kwargs:fget_subblock2b(fl,o1,o2,fr,indices),
+            'einsum_dense':vmps2_einsum_dense,
+            'einsum_gather':vmps2_einsum_gather,
+            'pyflib':lambda fl,o1,o2,fr,indices,**kwargs:pyflib.fget_subblock2b(fl,o1,o2,fr,indices) if iscomplexobj(fl)
+                else pyflib.fget_subblock2b_real(fl,o1,o2,fr,indices),
+            },
+            dict(nl=16,nr=16,nh=5,hndim=2,ndim=256),
+            dict(ndim=[16,64,256,1024,2048],nl=[4,8,16,32,64],nh=[2,3,5,8,12],hndim=[2,3,4]),
+            dict(ndim=[16,256],nh=[3,8])),
+        'vmps1':(setup_vmps1,{
+            'fget_subblock1':lambda fl,o1,fr,indices,**kwargs:fget_subblock1(fl,o1,fr,indices),
+            'einsum_dense':vmps1_einsum_dense,
+            'einsum_gather':vmps1_einsum_gather,
+            'pyflib':lambda fl,o1,fr,indices,**kwargs:pyflib.fget_subblock1(fl,o1,fr,indices) if iscomplexobj(fl)
+                else pyflib.fget_subblock1_real(fl,o1,fr,indices),
+            },
+            dict(nl=32,nr=32,nh=5,hndim=2,ndim=512),
+            dict(ndim=[16,64,256,1024,2048],nl=[8,16,32,64,128],nh=[2,3,5,8,12],hndim=[2,3,4]),
+            dict(ndim=[16,512],nh=[3,8])),
+        'dmrg':(setup_dmrg,{
+            'fget_subblock_dmrg':lambda hl,hr,indices,is_identity,**kwargs:fget_subblock_dmrg(hl,hr,indices,is_identity),
+            'fancy':dmrg_fancy,
+            'kron_slice':dmrg_kron_slice,
+            'pyflib':lambda hl,hr,indices,is_identity,**kwargs:pyflib.fget_subblock_dmrg(hl,hr,indices,is_identity) if iscomplexobj(hl)
+                else pyflib.fget_subblock_dmrg_real(hl,hr,indices,is_identity),
+            },
+            dict(nl=64,nr=64,ndim=512,is_identity=0),
+            dict(ndim=[16,64,256,1024,4096],nl=[16,32,64,128,256],is_identity=[0,1,2]),
+            dict(ndim=[64,1024],is_identity=[0,1])),
+        }
+
+def timeit(func,kwargs,min_time=0.05,repeat=3):
+    '''
+    Time a function.
+
+    Parameters:
+        :func: function, the kernel.
+        :kwargs: dict, the operands.
+        :min_time: float, the number of calls in a run is doubled until a run takes longer than it.
+        :repeat: int, the number of runs.
+
+    Return:
+        tuple of (best time per call in seconds, result of the first call).
+    '''
+    t0=time.time()
+    res=func(**kwargs)
+    if res is None: return None,None
+    t=time.time()-t0
+    number=1
+    while t<min_time:
+        number*=2
+        t0=time.time()
+        for i in xrange(number):
+            func(**kwargs)
+        t=time.time()-t0
+    best=t/number
+    for i in xrange(repeat-1):
+        t0=time.time()
+        for i in xrange(number):
+            func(**kwargs)
+        best=min(best,(time.time()-t0)/number)
+    return best,res
+
+def bench_family(family,quick=False,seed=2,stream=None,real=False):
+    '''
+    Benchmark a kernel family on its parameter sweeps.
+
+    Parameters:
+        :family: str, the name of family in `FAMILIES`.
+        :quick: bool, use the quick sweeps.
+        :seed: int, the random seed.
+        :stream: file/None, the stream to print the progress.
+        :real: bool, use real operands(the real*8 kernels).
+
+    Return:
+        dict, with keys 'points'(timings at each parameter point) and 'crossovers'.
+    '''
+    setup,kernels,base,sweeps,quick_sweeps=FAMILIES[family]
+    stream=stream or sys.stdout
+    points,crossovers={},{}
+    for pname,values in sorted((quick_sweeps if quick else sweeps).items()):
+        points[pname]=[]
+        for value in values:
+            random.seed(seed)
+            params=dict(base)
+            params[pname]=value
+            if pname=='nl' and 'nr' in params: params['nr']=value
+            operands=setup(**params)
+            if real:
+                operands=dict([(key,asfortranarray(val.real) if iscomplexobj(val) else val) for key,val in operands.items()])
+            timings,ref,maxdiff={},None,0.
+            for kname,func in sorted(kernels.items()):
+                t,res=timeit(func,operands)
+                timings[kname]=t
+                if res is None: continue
+                if ref is None:
+                    ref=res
+                else:
+                    maxdiff=max(maxdiff,abs(res-ref).max())
+            valid=[(t,kname) for kname,t in timings.items() if t is not None]
+            winner=min(valid)[1]
+            params['ndim']=len(operands['flat'])
+            points[pname].append({'params':params,'timings':timings,'winner':winner,'maxdiff':maxdiff})
+            stream.write('%-6s %-12s %-60s winner %-18s %s\n'%(family,'%s=%s'%(pname,value),
+                ', '.join(['%s:%.2e'%(k,t) for k,t in sorted(timings.items()) if t is not None]),winner,
+                'OK' if maxdiff<1e-8 else 'MISMATCH %.2e'%maxdiff))
+        crossovers[pname]=[{'at':cur['params'][pname],'from':pre['winner'],'to':cur['winner']}
+                for pre,cur in zip(points[pname][:-1],points[pname][1:]) if pre['winner']!=cur['winner']]
+    return {'base':base,'points':points,'crossovers':crossovers}
+
+def main():
+    parser=argparse.ArgumentParser(description='Microbenchmarks of flib kernels.')
+    parser.add_argument('--families',nargs='*',default=None,help='the kernel families %s, default is all.'%sorted(FAMILIES.keys()))
+    parser.add_argument('--quick',action='store_true',help='run the quick sweeps only.')
+    parser.add_argument('--real',action='store_true',help='use real operands.')
+    parser.add_argument('--threads',type=int,default=None,help='the number of threads of the threaded build.')
+    parser.add_argument('-o','--output',default=None,help='the output json file.')
+    args=parser.parse_args()
+
+    from run_benchmarks import get_meta
+    from telemetry import _tojson
+    output=args.output or os.path.join(BENCH_DIR,'results-flib-%s.json'%time.strftime('%Y%m%d-%H%M%S'))
+    if args.threads is not None: flib.set_num_threads(args.threads)
+    data={'meta':get_meta(),'families':{},'threaded':flib.THREADED,'num_threads':flib.get_num_threads()}
+    for family in (args.families or sorted(FAMILIES.keys())):
+        data['families'][family]=bench_family(family,quick=args.quick,real=args.real)
+        with open(output,'w') as f:
+            json.dump(_tojson(data),f,indent=1,sort_keys=True)
+    for family,res in sorted(data['families'].items()):
+        for pname,cross in sorted(res['crossovers'].items()):
+            for c in cross:
+                print 'crossover %-6s %s = %s: %s -> %s'%(family,pname,c['at'],c['from'],c['to'])
+    print 'Results are written to %s.'%output
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+'''
+Headless benchmark suite of DMRG, VMPS and iTEBD engines.
+
+Every case runs in a fresh process, so that the peak memory is measured per case.
+The results are written to a json file, which can be compared with that of another commit.
+
+Usage:
+    python run_benchmarks.py [--quick] [--profile] [--workloads heisenberg_s12 itebd_ising] [-o results.json]
+    python run_benchmarks.py --compare old.json new.json
+'''
+
+import os,sys,json,time,platform,argparse,subprocess,tempfile,pdb
+
+BENCH_DIR=os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR=os.path.dirname(BENCH_DIR)
+
+def get_meta():
+    '''Get the information of the environment and the commit.'''
+    import numpy,scipy
+    meta={'time':time.strftime('%Y-%m-%d %H:%M:%S'),
+            'host':platform.node(),
+            'platform':platform.platform(),
+            'python':platform.python_version(),
+            'numpy':numpy.__version__,
+            'scipy':scipy.__version__,
+            'argv':sys.argv[1:],
+            }
+    try:
+        meta['commit']=subprocess.check_output(['git','rev-parse','HEAD'],cwd=ROOT_DIR).strip()
+        meta['dirty']=len(subprocess.check_output(['git','status','--porcelain','--untracked-files=no'],cwd=ROOT_DIR).strip())>0
+    except (OSError,subprocess.CalledProcessError):
+        meta['commit']=None
+    return meta
+
+def run_subprocess(name,params,profile=False,timeout=None):
+    '''
+    Run a case in a fresh python process.
+
+    Parameters:
+        :name: str, the name of workload.
+        :params: dict, the parameters.
+        :profile: bool, collect kernel counters.
+        :timeout: float/None, kill the case after `timeout` seconds(requires the `timeout` command).
+
+    Return:
+        dict, the result, with 'status' 'ok' or 'failed'.
+    '''
+    fd,filename=tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    cmd=[sys.executable,os.path.abspath(__file__),'--case',name,'--params',json.dumps(params),'-o',filename]
+    if profile: cmd.append('--profile')
+    if timeout is not None: cmd=['timeout',str(timeout)]+cmd
+    with open(os.devnull,'w') as devnull:
+        retcode=subprocess.call(cmd,stdout=devnull)
+    try:
+        with open(filename) as f:
+            res=json.load(f)
+        res['status']='ok'
+    except ValueError:
+        res={'workload':name,'params':params,'status':'failed','returncode':retcode}
+    os.remove(filename)
+    return res
+
+def case_key(res):
+    '''The key to match cases in two result files.'''
+    return res['workload'],json.dumps(res['params'],sort_keys=True)
+
+def compare(old,new,etol=1e-8,stream=None):
+    '''
+    Compare two result files.
+
+    Parameters:
+        :old,new: str, the result files.
+        :etol: float, energy changes larger than it are marked.
+        :stream: file/None, the output stream.
+    '''
+    stream=stream or sys.stdout
+    results=[]
+    for filename in [old,new]:
+        with open(filename) as f:
+            data=json.load(f)
+        stream.write('%s: commit %s, %s\n'%(filename,data['meta'].get('commit'),data['meta']['time']))
+        results.append(dict([(case_key(r),r) for r in data['results']]))
+    def ratio(r1,r2,key):
+        v1,v2=r1.get(key),r2.get(key)
+        return '%8.3f'%(v2/v1) if v1 and v2 else '%8s'%'-'
+    stream.write('%-18s %-36s %8s %8s %8s %8s %14s\n'%('workload','params','elapse','t/sweep','t/step','rss','dE'))
+    for key in sorted(set(results[0])&set(results[1])):
+        r1,r2=results[0][key],results[1][key]
+        if r1['status']!='ok' or r2['status']!='ok':
+            stream.write('%-18s %-36s %s -> %s\n'%(key[0],key[1],r1['status'],r2['status']))
+            continue
+        dE=r2['energy']-r1['energy']
+        stream.write('%-18s %-36s %s %s %s %s %14.4e%s\n'%(key[0],key[1],ratio(r1,r2,'elapse'),ratio(r1,r2,'time_per_sweep'),
+            ratio(r1,r2,'time_per_step'),ratio(r1,r2,'peak_rss'),dE,' *' if abs(dE)>etol else ''))
+
+def main():
+    parser=argparse.ArgumentParser(description='Benchmarks of DMRG, VMPS and iTEBD engines.')
+    parser.add_argument('--workloads',nargs='*',default=None,help='the workloads to run, default is all.')
+    parser.add_argument('--quick',action='store_true',help='run the quick grids only.')
+    parser.add_argument('--profile',action='store_true',help='collect kernel counters.')
+    parser.add_argument('--timeout',type=float,default=None,help='the time limit of each case in seconds.')
+    parser.add_argument('-o','--output',default=None,help='the output json file.')
+    parser.add_argument('--compare',nargs=2,default=None,metavar=('OLD','NEW'),help='compare two result files.')
+    parser.add_argument('--case',default=None,help=argparse.SUPPRESS)
+    parser.add_argument('--params',default=None,help=argparse.SUPPRESS)
+    args=parser.parse_args()
+
+    if args.compare is not None:
+        compare(*args.compare)
+        return
+
+    sys.path.insert(0,BENCH_DIR)
+    from workloads import get_cases,run_case
+    if args.case is not None:
+        #child process, run a single case.
+        res=run_case(args.case,json.loads(args.params),profile=args.profile)
+        from telemetry import _tojson
+        with open(args.output,'w') as f:
+            json.dump(_tojson(res),f)
+        return
+
+    output=args.output or os.path.join(BENCH_DIR,'results-%s.json'%time.strftime('%Y%m%d-%H%M%S'))
+    data={'meta':get_meta(),'results':[]}
+    for name,params in get_cases(args.workloads,quick=args.quick):
+        res=run_subprocess(name,params,profile=args.profile,timeout=args.timeout)
+        data['results'].append(res)
+        if res['status']=='ok':
+            print '%-18s %-36s E = %.10f, error = %s, elapse = %.2f s, peak rss = %.1f MB'%(name,json.dumps(params,sort_keys=True),
+                    res['energy'],res['error'],res['elapse'],(res['peak_rss'] or 0)/1024.**2)
+        else:
+            print '%-18s %-36s FAILED'%(name,json.dumps(params,sort_keys=True))
+        #write after each case, so that partial results survive an interruption.
+        with open(output,'w') as f:
+            json.dump(data,f,indent=1,sort_keys=True)
+    print 'Results are written to %s.'%output
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,248 @@
+'''
+Benchmark workloads of DMRG, VMPS and iTEBD engines.
+
+Each workload is a function taking keyword parameters and returning the energy with the telemetry sink
+(or the time of imaginary time evolution for iTEBD), `run_case` turns it into a dict of results.
+The grids of parameters are defined in `WORKLOADS`.
+'''
+
+from numpy import *
+from scipy import integrate
+from scipy.linalg import eigvalsh
+import os,sys,time,pdb
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from telemetry import ListSink
+from profiler import profiling
+
+__all__=['WORKLOADS','REFERENCES','get_cases','run_case']
+
+#reference ground state energies from exact diagonalization(total Sz=0 sector),
+#keys are (workload, nsite) for open chains.
+REFERENCES={
+        ('heisenberg_s12',10):-4.258035207282884,
+        ('heisenberg_s12',16):-6.911737145575102,
+        ('heisenberg_s1',8):-10.124637222358903,
+        ('heisenberg_s1',10):-12.894560132210943,
+        ('heisenberg2d_4x4',16):-11.228483208428848,   #periodic boundary condition.
+        }
+
+#ground state energy per site of the spin-1 Heisenberg chain in the thermodynamic limit.
+E_HALDANE=-1.401484038971
+
+def _summarize(sink):
+    '''
+    Summarize the telemetry records of a run.
+
+    Parameters:
+        :sink: <ListSink>, the sink attached to the engine.
+
+    Return:
+        dict, with keys 'sweeps', 'time_per_sweep', 'time_per_step', 'phases', 'peak_rss_phases' and 'nstep'.
+    '''
+    sweeps=[{'isweep':r.isweep,'elapse':r.elapse,'nstep':r.nstep,'energy':r.energy,'trunc_error':r.trunc_error} for r in sink.sweeps()]
+    steps=sink.steps()
+    phases,peak_rss={},{}
+    for r in steps:
+        for phase,t in (r.timings or {}).items():
+            phases[phase]=phases.get(phase,0.)+t
+        for phase,rss in (r.peak_rss or {}).items():
+            if rss is not None: peak_rss[phase]=max(peak_rss.get(phase,0),rss)
+    phases=dict([(phase,{'total':t,'per_step':t/len(steps)}) for phase,t in phases.items()])
+    elapses=[r.elapse for r in steps if r.elapse is not None]
+    return {'sweeps':sweeps,
+            'time_per_sweep':mean([s['elapse'] for s in sweeps]) if len(sweeps)>0 else None,
+            'time_per_step':sum(elapses)/len(elapses) if len(elapses)>0 else None,
+            'phases':phases,
+            'peak_rss_phases':peak_rss,
+            'nstep':len(steps),
+            }
+
+def _dmrg_heisenberg(nspin,nsite,maxN,nsweep):
+    '''DMRG for the Heisenberg chain.'''
+    from rglib.hexpand import ExpandGenerator
+    from dmrg import DMRGEngine
+    from toymodel import HeisenbergModel
+    model=HeisenbergModel(J=1.,Jz=1.,h=0,nsite=nsite,nspin=nspin)
+    hgen=ExpandGenerator(spaceconfig=model.spaceconfig,H=model.H_serial,evolutor_type='masked')
+    egn=DMRGEngine(hgen=hgen,tol=0,reflect=True,iprint=0)
+    egn.use_U1_symmetry('M',target_block=zeros(1))
+    sink=egn.telemetry.add_sink(ListSink())
+    EG,mps=egn.run_finite(endpoint=(nsweep,'<-',0),maxN=[maxN]*nsweep,tol=0)
+    return float(real(ravel(EG)[0])),sink
+
+def heisenberg_s12(nsite,maxN,nsweep=4):
+    '''Spin-1/2 Heisenberg chain with open boundary condition, solved by finite DMRG.'''
+    return _dmrg_heisenberg(2,nsite,maxN,nsweep)
+
+def heisenberg_s1(nsite,maxN,nsweep=4):
+    '''Spin-1 Heisenberg chain with open boundary condition, solved by finite DMRG.'''
+    return _dmrg_heisenberg(3,nsite,maxN,nsweep)
+
+def heisenberg2d_4x4(maxN,nsweep=4,nsite=16):
+    '''Spin-1/2 Heisenberg model on 4 x 4 periodic lattice, solved by VMPS.'''
+    from blockmatrix import SimpleBMG
+    from pymps import product_state
+    from vmps import VMPSEngine
+    from toymodel import HeisenbergModel2D
+    model=HeisenbergModel2D(J=1.,Jz=1.,h=0,N1=4,N2=4,nspin=2)
+    bmg=SimpleBMG(spaceconfig=model.spaceconfig,qstring='M')
+    k0=product_state(config=repeat([0,1],nsite/2),hndim=model.spaceconfig.hndim,bmg=bmg)
+    vegn=VMPSEngine(H=model.H.use_bm(bmg),k0=k0,eigen_solver='LC')
+    vegn.warmup(10)
+    sink=vegn.telemetry.add_sink(ListSink())
+    vegn.run(nsweep,maxN=maxN,which='SA')
+    return float(vegn.energy),sink
+
+def hubbard_chain(nsite,maxN,U,nsweep=4):
+    '''
+    Hubbard chain at half filling(t = 1, mu = 0), solved by finite DMRG with the fermionic z-string.
+    For U = 0, the reference is the sum of the lowest `nsite` single particle levels.
+    '''
+    from tba.hgen import SpaceConfig,SuperSpaceConfig
+    from rglib.mps import op2collection
+    from rglib.hexpand import ExpandGenerator
+    from dmrg import DMRGEngine
+    from toymodel import ChainN,chorder
+    #the same axis order as `tests/testfermi.py`, safe since each case runs in its own process.
+    SpaceConfig.SPACE_TOKENS=['nambu','atom','spin','orbit']
+    model=ChainN(t=1.,U=U,mu=0.,occ=True,nsite=nsite)
+    spaceconfig=SuperSpaceConfig(chorder([1,2,1]))
+    H_serial=op2collection(op=model.hgen.get_opH())
+    hgen=ExpandGenerator(spaceconfig=spaceconfig,H=H_serial,evolutor_type='masked',use_zstring=True)
+    egn=DMRGEngine(hgen=hgen,tol=0,reflect=False,iprint=0)
+    egn.use_U1_symmetry('QM',target_block=(0,0))
+    sink=egn.telemetry.add_sink(ListSink())
+    EG,mps=egn.run_finite(endpoint=(nsweep,'<-',0),maxN=[maxN]*nsweep,tol=0)
+    return float(real(ravel(EG)[0])),sink
+
+def _hubbard_reference(nsite,U):
+    '''The exact energy of the non-interacting chain.'''
+    if U!=0: return None
+    from toymodel import ChainN
+    levels=eigvalsh(ChainN(t=1.,U=0,mu=0.,occ=False,nsite=nsite).hgen.H())
+    return float(sum(sort(levels)[:nsite]))
+
+def _itebd(hb,hndim,config,maxN,dt,Nt):
+    '''iTEBD on a two-site unit cell, return the energy per site and the elapse.'''
+    from rglib.mps import Tensor,Link,IVMPS,get_expect_ivmps
+    from tebd import ITEBDEngine
+    GL=[]
+    for i in xrange(2):
+        Gi=Tensor(0.5-0.01*ones([hndim,1,1]),labels=['s%s'%i,'a%s'%i,'b%s'%i])
+        Gi[config[i],0,0]=1
+        GL.append(Gi)
+    GL[1].labels[1:]=GL[1].labels[1:][::-1]
+    LL=[Link(['b0','b1'],ones([1])),Link(['a1','a0'],ones([1]))]
+    egn=ITEBDEngine(hs=[hb]*2,tol=1e-10)
+    t0=time.time()
+    mps=egn.run(ivmps=IVMPS(tensors=GL,LL=LL),maxN=maxN,dt=dt,Nt=Nt)
+    elapse=time.time()-t0
+    E=mean([get_expect_ivmps(op=hb,ket=mps),get_expect_ivmps(op=hb,ket=mps.roll(1))])
+    return float(real(E)),elapse
+
+def itebd_ising(h,maxN,dt=0.01,Nt=800):
+    '''Transverse field Ising chain -sum sigma^z sigma^z + h sigma^x, solved by iTEBD.'''
+    from tba.hgen import SpinSpaceConfig
+    from rglib.mps import opunit_Sz,opunit_Sx
+    Sz=opunit_Sz(spaceconfig=SpinSpaceConfig([1,2]))
+    Sx=opunit_Sx(spaceconfig=SpinSpaceConfig([1,2]))
+    hb=-4*Sz.as_site(0)*Sz.as_site(1)+2*h*Sx.as_site(0)
+    return _itebd(hb,2,[0,0],maxN,dt,Nt)
+
+def itebd_haldane(maxN,D=0.,dt=0.01,Nt=800):
+    '''Spin-1 Heisenberg chain with single ion anisotropy D, solved by iTEBD.'''
+    from tba.hgen import SpinSpaceConfig
+    from rglib.mps import opunit_Sz,opunit_Sx,opunit_Sy
+    scfg=SpinSpaceConfig([1,3])
+    Sx,Sy,Sz=opunit_Sx(spaceconfig=scfg),opunit_Sy(spaceconfig=scfg),opunit_Sz(spaceconfig=scfg)
+    hb=Sz.as_site(0)*Sz.as_site(1)+Sx.as_site(0)*Sx.as_site(1)+Sy.as_site(0)*Sy.as_site(1)+D*Sz.as_site(0)*Sz.as_site(0)
+    return _itebd(hb,3,[0,2],maxN,dt,Nt)
+
+def _ising_reference(h):
+    '''The exact energy per site of the transverse field Ising chain.'''
+    f=lambda k,h:-2*sqrt(1+h**2-2*h*cos(k))/pi/2.
+    return integrate.quad(f,0,pi,args=(h,))[0]
+
+#name -> (function, reference function, full grid, quick grid), grids are lists of parameter dicts.
+WORKLOADS={
+        'heisenberg_s12':(heisenberg_s12,lambda p:REFERENCES.get(('heisenberg_s12',p['nsite'])),
+            [{'nsite':n,'maxN':m} for n in [10,16,40,80] for m in [20,40,80]],
+            [{'nsite':16,'maxN':40}]),
+        'heisenberg_s1':(heisenberg_s1,lambda p:REFERENCES.get(('heisenberg_s1',p['nsite'])),
+            [{'nsite':n,'maxN':m} for n in [8,10,40] for m in [20,40,80]],
+            [{'nsite':10,'maxN':40}]),
+        'heisenberg2d_4x4':(heisenberg2d_4x4,lambda p:REFERENCES[('heisenberg2d_4x4',16)],
+            [{'maxN':m} for m in [20,40,80,160]],
+            [{'maxN':40}]),
+        'hubbard_chain':(hubbard_chain,lambda p:_hubbard_reference(p['nsite'],p['U']),
+            [{'nsite':n,'maxN':m,'U':U} for n in [8,20,40] for m in [40,100] for U in [0.,2.]],
+            [{'nsite':8,'maxN':40,'U':0.}]),
+        'itebd_ising':(itebd_ising,lambda p:_ising_reference(p['h']),
+            [{'h':h,'maxN':m} for h in [0.5,1.] for m in [5,10,20]],
+            [{'h':0.5,'maxN':10}]),
+        'itebd_haldane':(itebd_haldane,lambda p:E_HALDANE if p.get('D',0)==0 else None,
+            [{'maxN':m} for m in [10,20,40]],
+            [{'maxN':20}]),
+        }
+
+def get_cases(names=None,quick=False):
+    '''
+    Get the benchmark cases.
+
+    Parameters:
+        :names: list/None, the names of workloads, None for all.
+        :quick: bool, use the quick grids.
+
+    Return:
+        list of (name, params).
+    '''
+    if names is None: names=sorted(WORKLOADS.keys())
+    cases=[]
+    for name in names:
+        if name not in WORKLOADS:
+            raise KeyError('Unknown workload %s, available ones are %s.'%(name,sorted(WORKLOADS.keys())))
+        grid=WORKLOADS[name][3 if quick else 2]
+        cases.extend([(name,params) for params in grid])
+    return cases
+
+def run_case(name,params,profile=False,seed=2):
+    '''
+    Run a single benchmark case in current process.
+
+    Parameters:
+        :name: str, the name of workload.
+        :params: dict, the parameters.
+        :profile: bool, collect kernel counters with `profiling`.
+        :seed: int, the random seed.
+
+    Return:
+        dict, the result.
+    '''
+    from dmrg import _peak_rss
+    func,get_reference,_,_=WORKLOADS[name]
+    random.seed(seed)
+    res={'workload':name,'params':params}
+    t0=time.time()
+    if profile:
+        with profiling() as prof:
+            out=func(**params)
+    else:
+        out=func(**params)
+    res['elapse']=time.time()-t0
+    if name.startswith('itebd'):
+        #energy per site, time per imaginary time slice.
+        energy,res['elapse_evolve']=out
+        res['time_per_step']=res['elapse_evolve']/params.get('Nt',800)
+    else:
+        energy,sink=out
+        res.update(_summarize(sink))
+    reference=get_reference(params)
+    res['energy']=energy
+    res['reference']=reference
+    res['error']=None if reference is None else energy-reference
+    res['peak_rss']=_peak_rss()
+    if profile:
+        res['kernels']=dict([(kname,{'ncall':c[0],'wall':c[1],'cpu':c[2]}) for kname,c in prof.counters.items()])
+        res['kernel_sweeps']=[{'label':label,'wall':dict([(kname,c[1]) for kname,c in delta.items()])} for label,delta in prof.sweeps]
+    return res
@@ -0,0 +1,276 @@
+'''
+Out-of-core storage of blocks.
+'''
+
+from numpy import *
+import scipy.sparse as sps
+import os,shutil,tempfile,threading,itertools,cPickle,pdb
+from collections import OrderedDict
+
+__all__=['BlockStorage','get_nbytes']
+
+def get_nbytes(obj,memo=None):
+    '''
+    Estimate the memory occupied by arrays and sparse matrices in an object.
+
+    Parameters:
+        :obj: object, the target object, lists, tuples, dicts and attributes are searched recursively.
+        :memo: set/None, ids of objects already counted.
+
+    Return:
+        int, the size in bytes.
+    '''
+    if memo is None: memo=set()
+    if id(obj) in memo:
+        return 0
+    memo.add(id(obj))
+    if isinstance(obj,ndarray):
+        return obj.nbytes if obj.dtype!=object else sum([get_nbytes(o,memo) for o in obj.flat])
+    elif sps.issparse(obj):
+        return sum([get_nbytes(getattr(obj,attr),memo) for attr in ['data','indices','indptr','row','col','offsets'] if hasattr(obj,attr)])
+    elif isinstance(obj,(list,tuple,set)):
+        return sum([get_nbytes(o,memo) for o in obj])
+    elif isinstance(obj,dict):
+        return sum([get_nbytes(o,memo) for o in obj.values()])
+    elif hasattr(obj,'__dict__'):
+        return get_nbytes(obj.__dict__,memo)
+    return 0
+
+def _link(source,target):
+    '''Hard-link a file, copy it if linking is not possible(e.g. on another device).'''
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source,target)
+    except (OSError,AttributeError):
+        shutil.copy2(source,target)
+
+class BlockStorage(object):
+    '''
+    Dict-like storage of blocks(<ExpandGenerator>) keyed by block length.
+
+    When the memory budget is exceeded, the least recently used blocks are spilled to disk,
+    large arrays are stored in .npy files and loaded back as (copy-on-write) memory-mapped arrays.
+    Blocks can be prefetched in a background thread.
+
+    Construct:
+        BlockStorage(data=None,budget=None,directory=None,nactive=2)
+
+    Attributes:
+        :budget: int/None, the memory budget in bytes, None for unlimited.
+        :directory: str, the directory for spilled blocks.
+        :nactive: int, the number of most recently used blocks that are never spilled.
+        :min_mmap_size: int, arrays smaller than this size(in bytes) are pickled directly instead of memory-mapped.
+
+    Note:
+        Spilled blocks are pickled separately, objects shared between different blocks are not shared after loading.
+        The .npy files are referred by their names in the pickle file, so the files of a block can be moved together.
+    '''
+    def __init__(self,data=None,budget=None,directory=None,nactive=2):
+        self.budget=budget
+        self.nactive=nactive
+        self.min_mmap_size=65536
+        if directory is None:
+            self.directory=tempfile.mkdtemp(prefix='dmrg_blocks_')
+            self._own_directory=True
+        else:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.directory=directory
+            self._own_directory=False
+        self._memory=OrderedDict()  #key -> (block, size), in LRU order.
+        self._spilled={}            #key -> (pickle file, npy files)
+        self._prefetching={}        #key -> thread
+        self._prefetched={}         #key -> block
+        self._lock=threading.RLock()
+        self._counter=itertools.count()
+        if data is not None:
+            for key,value in data.items():
+                self[key]=value
+
+    def __del__(self):
+        if getattr(self,'_own_directory',False):
+            shutil.rmtree(self.directory,ignore_errors=True)
+
+    def __reduce__(self):
+        #pickled as a plain dict, e.g. in checkpoints.
+        return (dict,(self.items(),))
+
+    def __str__(self):
+        return '<BlockStorage> %s blocks in memory(%.1f MB), %s spilled.'%(len(self._memory),self.nbytes/1024.**2,len(self._spilled))
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self,key):
+        return key in self._memory or key in self._spilled or key in self._prefetched
+
+    def __getitem__(self,key):
+        with self._lock:
+            if key in self._memory:
+                item=self._memory.pop(key)
+                self._memory[key]=item
+                return item[0]
+            thread=self._prefetching.get(key)
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            if key in self._prefetched:
+                block=self._prefetched.pop(key)
+            elif key in self._spilled:
+                block=self._load(key)
+            else:
+                raise KeyError(key)
+            self._remove_files(key)
+            self._insert(key,block)
+            return block
+
+    def __setitem__(self,key,block):
+        with self._lock:
+            self._prefetched.pop(key,None)
+            self._remove_files(key)
+            self._memory.pop(key,None)
+            self._insert(key,block)
+
+    def keys(self):
+        '''The keys of stored blocks.'''
+        with self._lock:
+            return list(set(self._memory.keys())|set(self._spilled.keys())|set(self._prefetched.keys()))
+
+    def values(self):
+        '''The stored blocks, spilled blocks are loaded without entering the memory.'''
+        return [value for key,value in self.items()]
+
+    def items(self):
+        '''The (key, block) pairs, spilled blocks are loaded without entering the memory.'''
+        res=[]
+        for key in self.keys():
+            with self._lock:
+                if key in self._memory:
+                    res.append((key,self._memory[key][0]))
+                elif key in self._prefetched:
+                    res.append((key,self._prefetched[key]))
+                else:
+                    res.append((key,self._load(key)))
+        return res
+
+    def link_spilled(self,directory):
+        '''
+        Link(or copy) the files of spilled blocks into a directory without loading them, e.g. for checkpoints.
+
+        Parameters:
+            :directory: str, the target directory.
+
+        Return:
+            tuple of (blocks, files), dict of key -> block in memory and dict of key -> (pickle file, npy files) of spilled blocks,
+            the file names are relative to `directory`.
+        '''
+        with self._lock:
+            blocks=dict([(key,item[0]) for key,item in self._memory.items()])
+            files={}
+            for key,(filename,npyfiles) in self._spilled.items():
+                for fname in [filename]+npyfiles:
+                    _link(fname,os.path.join(directory,os.path.basename(fname)))
+                files[key]=(os.path.basename(filename),[os.path.basename(fname) for fname in npyfiles])
+        return blocks,files
+
+    def add_spilled(self,directory,files):
+        '''
+        Add spilled blocks from files, the files are linked(or copied) into the storage directory.
+
+        Parameters:
+            :directory: str, the directory of files.
+            :files: dict, key -> (pickle file, npy files) relative to `directory`, see `link_spilled`.
+        '''
+        with self._lock:
+            for key,(filename,npyfiles) in files.items():
+                self._prefetched.pop(key,None)
+                self._remove_files(key)
+                self._memory.pop(key,None)
+                targets=[os.path.join(self.directory,fname) for fname in [filename]+npyfiles]
+                for fname,target in zip([filename]+npyfiles,targets):
+                    _link(os.path.join(directory,fname),target)
+                self._spilled[key]=(targets[0],targets[1:])
+
+    @property
+    def nbytes(self):
+        '''The estimated size of blocks in memory.'''
+        return sum([size for block,size in self._memory.values()])
+
+    def prefetch(self,key):
+        '''
+        Load a spilled block in a background thread.
+
+        Parameters:
+            :key: int, the block length.
+        '''
+        with self._lock:
+            if key not in self._spilled or key in self._prefetching:
+                return
+            thread=threading.Thread(target=self._prefetch_worker,args=(key,))
+            thread.daemon=True
+            self._prefetching[key]=thread
+            thread.start()
+
+    def _prefetch_worker(self,key):
+        try:
+            with self._lock:
+                if key not in self._spilled:
+                    return
+                files=self._spilled[key]
+            block=self._load(key,files)
+            with self._lock:
+                if self._spilled.get(key) is files:
+                    self._prefetched[key]=block
+        finally:
+            with self._lock:
+                self._prefetching.pop(key,None)
+
+    def _insert(self,key,block):
+        '''Insert a block into memory and enforce the budget.'''
+        size=get_nbytes(block) if self.budget is not None else 0
+        self._memory[key]=(block,size)
+        if self.budget is None:
+            return
+        keys=self._memory.keys()
+        for k in keys[:max(0,len(keys)-self.nactive)]:
+            if self.nbytes<=self.budget:
+                break
+            self._spill(k)
+
+    def _spill(self,key):
+        '''Spill a block to disk.'''
+        block,size=self._memory.pop(key)
+        token='%s_%s'%(key,next(self._counter))
+        npyfiles=[]
+        def persistent_id(obj):
+            if isinstance(obj,ndarray) and obj.dtype!=object and obj.nbytes>=self.min_mmap_size:
+                filename=os.path.join(self.directory,'%s_%s.npy'%(token,len(npyfiles)))
+                save(filename,obj)
+                npyfiles.append(filename)
+                return os.path.basename(filename)
+            return None
+        filename=os.path.join(self.directory,'%s.pkl'%token)
+        with open(filename,'wb') as f:
+            pickler=cPickle.Pickler(f,cPickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id=persistent_id
+            pickler.dump(block)
+        self._spilled[key]=(filename,npyfiles)
+
+    def _load(self,key,files=None):
+        '''Load a spilled block from disk.'''
+        filename,npyfiles=files or self._spilled[key]
+        directory=os.path.dirname(filename)
+        with open(filename,'rb') as f:
+            unpickler=cPickle.Unpickler(f)
+            unpickler.persistent_load=lambda pid:load(os.path.join(directory,os.path.basename(pid)),mmap_mode='c')
+            return unpickler.load()
+
+    def _remove_files(self,key):
+        '''Remove the spilled files of a block.'''
+        files=self._spilled.pop(key,None)
+        if files is not None:
+            filename,npyfiles=files
+            for fname in [filename]+npyfiles:
+                if os.path.exists(fname):
+                    os.remove(fname)
@@ -7,6 +7,7 @@ import pdb,cPickle
 
 from pymps import Tensor
 from tba.hgen import quicksave,quickload
+from profiler import profiled
 
 __all__=['Contractor']
 
@@ -66,6 +67,7 @@ class Contractor(object):
             self.ket<<1
             self.rupdate_env(size)
 
+    @profiled('Contractor.lupdate_env')
     def lupdate_env(self,i):
         '''
         Update LPARTs.
@@ -87,6 +89,7 @@ class Contractor(object):
             self.LPART[i]=FL
             self.LPART=self.LPART[:i+1]
 
+    @profiled('Contractor.rupdate_env')
     def rupdate_env(self,i):
         '''
         Update RPARTs.
@@ -3,13 +3,19 @@ DMRG Engine.
 '''
 
 from numpy import *
-from scipy.sparse.linalg import eigsh
+from scipy.sparse.linalg import eigsh,aslinearoperator,LinearOperator,ArpackNoConvergence
 from scipy.linalg import eigh,svd,eigvalsh
 from numpy.linalg import norm
 from numpy import kron as dkron
 from matplotlib.pyplot import *
 import scipy.sparse as sps
-import copy,time,pdb,warnings,numbers
+import copy,time,pdb,warnings,numbers,os,sys,tempfile,cPickle,json,shutil
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+try:
+    import resource
+except ImportError:
+    resource=None
 
 from blockmatrix.blocklib import eigbsh,eigbh,get_blockmarker,svdb
 from tba.hgen import SpinSpaceConfig,ind2c,Z4scfg
@@ -18,13 +24,40 @@ from rglib.hexpand import NullEvolutor,MaskedEvolutor
 from tba.hgen import kron_csr as kron
 from blockmatrix import SimpleBMG,sign4bm,show_bm,trunc_bm
 from disc_symm import SymmetryHandler
-from superblock import SuperBlock,site_image,joint_extract_block
+from blockstorage import BlockStorage
+from scheduler import SweepScheduler
+from eigsolver import block_davidson,real_if_close,cast_precision
+from telemetry import Telemetry,StepRecord,SweepRecord
+from superblock import SuperBlock,SuperBlockOperator,site_image,joint_extract_block,get_subblock_lookup,get_subblock_csr,\
+        OP_CACHE,mark_truncated,reserve_trunc_versions
 from pydavidson import JDh
-from flib.flib import fget_subblock_dmrg
+from profiler import PROFILER,profiled
 
-__all__=['site_image','SuperBlock','DMRGEngine','fix_tail']
+__all__=['site_image','SuperBlock','DMRGEngine','fix_tail','estimate_memory','estimate_build_cost','calibrate_hbuilder']
 
 ZERO_REF=1e-12
+HBUILDERS=['block','block0','matfree','auto']
+MODES=['2site','1site']
+SVD_BACKENDS=['full','thin','randomized']
+#the randomized svd is used for blocks with both dimensions at least RSVD_RATIO*maxN, see `use_svd_backend`.
+RSVD_RATIO=4
+#the number of extra random vectors in randomized svd.
+RSVD_OVERSAMPLE=10
+CALIBRATION_ENV='DMRG_CALIBRATION'
+#whether `HBUILDER_COSTS` has been calibrated in this process.
+_CALIBRATED=[False]
+#seconds per unit of work of hamiltonian builders, see `estimate_build_cost`, updated by `calibrate_hbuilder`.
+#the defaults are `calibrate_hbuilder()` measurements(sizes 10 and 200) on one core of an Intel Xeon server
+#with the serial flib kernels, rounded up to one significant digit.
+HBUILDER_COSTS={'kron':6e-8,'kron_term':1e-3,'lookup':7e-9,'subblock':2e-8,'subblock_term':5e-4,
+        'matvec':1e-9,'matfree':1e-9,'matfree_term':3e-5}
+CHECKPOINT_FILE='dmrg.ckpt'
+#prefix of the checkpoint sub-directories for the files of spilled blocks.
+CHECKPOINT_BLOCKS='blocks_'
+
+#hot kernels counted by the profiler.
+kron=profiled('kron_csr')(kron)
+svd,svdb,eigbh=profiled('svd')(svd),profiled('svdb')(svdb),profiled('eigbh')(eigbh)
 
 def _eliminate_zeros(A,zero_ref):
     '''eliminate zeros from a sparse matrix.'''
@@ -32,57 +65,339 @@ def _eliminate_zeros(A,zero_ref):
     A.data[abs(A.data)<zero_ref]=0; A.eliminate_zeros()
     return A
 
-def _gen_hamiltonian_full(HL0,HR0,hgen_l,hgen_r,interop):
-    '''Get the full hamiltonian.'''
+def _get_kpmask(spec,maxN,tol=0):
+    '''
+    Get the mask of kept states.
+
+    Parameters:
+        :spec: 1D array, the spectrum of density matrix.
+        :maxN: int, the maximum number of kept states.
+        :tol: float, the tolerence of discarded weight(relative to the total weight).
+
+    Return:
+        1D array of bool, states with the largest weights are kept,
+        at most `maxN` states are kept(degenerate states at the cut are kept together),
+        and as few as possible to keep the discarded weight within `tol`.
+    '''
+    spec_sorted=sort(spec)
+    spec_cut=spec_sorted[max(0,len(spec)-maxN)]
+    if tol>0 and len(spec)>0:
+        #the number of states that can be discarded, keep at least one state.
+        ndiscard=searchsorted(cumsum(spec_sorted),tol*sum(spec_sorted),side='right')
+        spec_cut=max(spec_cut,spec_sorted[min(ndiscard,len(spec)-1)])
+    return (spec>=spec_cut)&(spec>ZERO_REF)
+
+def _join_blockinfo(blockinfo,ndimr):
+    '''Get the block marker and permutation of the combined block, cached in `blockinfo`.'''
+    if 'bm_tot' not in blockinfo:
+        bm_tot,pm=blockinfo['bmg'].join_bms([blockinfo['bml'],blockinfo['bmr']]).compact_form()
+        blockinfo['pm']=((blockinfo['pml']*ndimr)[:,newaxis]+blockinfo['pmr']).ravel()[pm]
+        blockinfo['bm_tot']=bm_tot
+    return blockinfo['bm_tot'],blockinfo['pm']
+
+def _target_ndim(ndiml,ndimr,blockinfo):
+    '''The dimension of the target block.'''
+    if blockinfo is None:
+        return ndiml*ndimr
+    bm_tot,pm=_join_blockinfo(blockinfo,ndimr)
+    return len(pm[bm_tot.get_slice(blockinfo['target_block'],uselabel=True)])
+
+def _peak_rss():
+    '''Get the peak resident set size of this process in bytes, None if not available.'''
+    if resource is None:
+        return None
+    maxrss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform=='darwin' else maxrss*1024
+
+def estimate_memory(ndiml,ndimr,ndim,nnz_row,itemsize=16,nvec=20,hbuilder='block',svd_backend='full',maxN=None):
+    '''
+    Estimate the peak memory of a DMRG step.
+
+    Parameters:
+        :ndiml,ndimr: int, the dimensions of the expanded left and right blocks.
+        :ndim: int, the dimension of the target block.
+        :nnz_row: float, the estimated number of non-zero elements per row of the target hamiltonian.
+        :itemsize: int, the size of an element in bytes.
+        :nvec: int, the number of vectors kept by the eigensolver.
+        :hbuilder: 'block'/'block0'/'matfree', the hamiltonian builder.
+        :svd_backend: str, the svd backend of truncation, see `DMRGEngine.use_svd_backend`.
+        :maxN: int/None, the maximum number of kept states, used by the 'randomized' backend(None for 'thin').
+
+    Return:
+        dict, the estimated memory in bytes of phases 'hamiltonian', 'eigen' and 'svd', and the 'total',
+        the hamiltonian is alive during the other two phases.
+    '''
+    nfull=float(ndiml)*ndimr
+    if hbuilder=='matfree':
+        #the intermediate arrays in operator application.
+        mem_h=0.
+        mem_eigen=nvec*ndim*itemsize+3*nfull*itemsize
+    elif hbuilder=='block0':
+        #the csr matrices in the whole space before slicing.
+        mem_h=2*(itemsize+4)*nnz_row*nfull
+        mem_eigen=nvec*ndim*itemsize
+    else:
+        #csr matrix(data, indices) and the temporary in summation, and the lookup table.
+        mem_h=2*(itemsize+4)*nnz_row*ndim+4*nfull
+        mem_eigen=nvec*ndim*itemsize
+    #the dense state, and U and V(full, thin or of the kept rank with oversampling).
+    rank=min(ndiml,ndimr)
+    if svd_backend=='randomized' and maxN is not None:
+        rank=min(rank,maxN+RSVD_OVERSAMPLE)
+    if svd_backend=='full':
+        mem_uv=float(ndiml)**2+float(ndimr)**2
+    else:
+        mem_uv=float(rank)*(ndiml+ndimr)
+    mem_svd=(2*nfull+mem_uv)*itemsize
+    return {'hamiltonian':mem_h,'eigen':mem_eigen,'svd':mem_svd,'total':mem_h+max(mem_eigen,mem_svd)}
+
+def estimate_build_cost(ndiml,ndimr,ndim,nnz_l,nnz_r,interop_nnz,nmatvec=30,costs=None):
+    '''
+    Estimate the time of hamiltonian builders, including the matrix-vector products in the eigensolver.
+
+    The non-zero elements in the target block are assumed to be proportional to its dimension,
+    each term(HL*I, I*HR and interaction terms) also costs a fixed overhead, which dominates for small blocks.
+
+    Parameters:
+        :ndiml,ndimr: int, the dimensions of the expanded left and right blocks.
+        :ndim: int, the dimension of the target block.
+        :nnz_l,nnz_r: int, the number of non-zero elements of HL0 and HR0.
+        :interop_nnz: list of tuple, the number of non-zero elements of (A_k, B_k) for interaction terms A_k*B_k.
+        :nmatvec: int, the estimated number of matrix-vector products.
+        :costs: dict/None, seconds per unit of work and per term, default is `HBUILDER_COSTS`.
+
+    Return:
+        dict, the estimated time in seconds of 'block', 'block0' and 'matfree'.
+    '''
+    c=costs or HBUILDER_COSTS
+    nterm=2+len(interop_nnz)
+    nfull=float(ndiml)*ndimr
+    nnz_full=float(nnz_l)*ndimr+float(ndiml)*nnz_r+sum([float(na)*nb for na,nb in interop_nnz])
+    nnz_target=nnz_full*ndim/nfull
+    work_matfree=float(nnz_l)*ndimr+float(ndiml)*nnz_r+sum([float(na)*ndimr+float(ndiml)*nb for na,nb in interop_nnz])+nterm*nfull
+    t_matvec=c['matvec']*nnz_target*nmatvec
+    return {'block0':c['kron']*nnz_full+c['kron_term']*nterm+t_matvec,
+            'block':c['lookup']*nfull+c['subblock']*nnz_target+c['subblock_term']*nterm+t_matvec,
+            'matfree':(c['matfree']*work_matfree+c['matfree_term']*nterm)*nmatvec}
+
+def _time_hbuilders(n,density=0.03,nrepeat=10):
+    '''
+    Time the kernels of hamiltonian builders with random blocks of dimension `n` and one interaction term.
+
+    Return:
+        dict, builder -> (work, time) with the work in units of `estimate_build_cost`.
+    '''
+    rng=random.RandomState(0)
+    HL,HR,A,B=[sps.random(n,n,density,random_state=rng,format='csr') for i in xrange(4)]
+    HL,HR=HL+HL.T,HR+HR.T
+    indices=sort(rng.choice(n*n,max(1,n*n/4),replace=False))
+    nfull=n*n
+    nnz_full=HL.nnz*n+n*HR.nnz+A.nnz*B.nnz
+    nnz_target=1.*nnz_full*len(indices)/nfull
+    I=sps.identity(n)
+
+    t0=time.time()
+    for i in xrange(nrepeat):
+        H0=(kron(HL,I)+kron(I,HR)+kron(A,B)).tocsr()[indices][:,indices]
+    t1=time.time()
+    for i in xrange(nrepeat):
+        cinds=ind2c(indices,N=[n,n])
+        lookup=get_subblock_lookup(cinds,(n,n))
+    t2=time.time()
+    for i in xrange(nrepeat):
+        Hc=sps.csr_matrix(get_subblock_csr(hl=HL,hr=I,indices=cinds,lookup=lookup,is_identity=2)+\
+                get_subblock_csr(hl=I,hr=HR,indices=cinds,lookup=lookup,is_identity=1)+\
+                get_subblock_csr(hl=A,hr=B,indices=cinds,lookup=lookup))
+    t3=time.time()
+    v=rng.random_sample(len(indices))
+    for i in xrange(nrepeat):
+        Hc.dot(v)
+    t4=time.time()
+    op=SuperBlockOperator(HL,HR,[(A,B)],indices=indices)
+    for i in xrange(nrepeat):
+        op.matvec(v)
+    t5=time.time()
+    return {'kron':(nnz_full,(t1-t0)/nrepeat),'lookup':(nfull,(t2-t1)/nrepeat),'subblock':(nnz_target,(t3-t2)/nrepeat),
+            'matvec':(nnz_target,(t4-t3)/nrepeat),'matfree':((HL.nnz+A.nnz)*n+n*(HR.nnz+B.nnz)+3*nfull,(t5-t4)/nrepeat)}
+
+def _calibration_file(filename=None):
+    '''The cache file of calibration, None for no cache.'''
+    return filename or os.environ.get(CALIBRATION_ENV) or None
+
+def calibrate_hbuilder(filename=None,force=False,sizes=(10,200)):
+    '''
+    Calibrate the cost model of hamiltonian builders on this machine, the result can be cached in a json file.
+
+    Parameters:
+        :filename: str/None, the cache file, default is the environment variable `DMRG_CALIBRATION`, no cache if neither is set.
+        :force: bool, measure again even if the cache file exists.
+        :sizes: tuple, the small and large block dimensions, the small one determines the overhead per term.
+
+    Return:
+        dict, the calibrated `HBUILDER_COSTS`.
+    '''
+    filename=_calibration_file(filename)
+    if not force and filename is not None and os.path.isfile(filename):
+        with open(filename) as f:
+            costs=json.load(f)
+    else:
+        small,large=[_time_hbuilders(n) for n in sizes]
+        costs={}
+        for key in small:
+            (w1,t1),(w2,t2)=small[key],large[key]
+            costs[key]=max((t2-t1)/(w2-w1),0.)
+            if key+'_term' in HBUILDER_COSTS:
+                #3 terms are used in `_time_hbuilders`.
+                costs[key+'_term']=max(t1-costs[key]*w1,0.)/3
+        if filename is not None:
+            try:
+                with open(filename,'w') as f:
+                    json.dump(costs,f)
+            except IOError:
+                warnings.warn('Can not write the calibration cache %s.'%filename)
+    HBUILDER_COSTS.update(costs)
+    _CALIBRATED[0]=True
+    return HBUILDER_COSTS
+
+def _fsync_dir(directory):
+    '''Flush the entries of a directory(e.g. after renaming) to disk, it does nothing if not supported.'''
+    try:
+        fd=os.open(directory,os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _thread_map(func,items,nworker=1):
+    '''
+    Apply `func` to items, in a thread pool if `nworker`>1.
+
+    Parameters:
+        :func: function, takes an item.
+        :items: list, the items, e.g. operators or blocks.
+        :nworker: int, the number of threads.
+
+    Return:
+        list, the results in the order of `items`.
+    '''
+    items=list(items)
+    if nworker>1 and len(items)>1:
+        pool=ThreadPool(min(nworker,len(items)))
+        try:
+            return pool.map(func,items)
+        finally:
+            pool.close()
+            pool.join()
+    return map(func,items)
+
+def _randomized_svd(A,k,oversample=RSVD_OVERSAMPLE,niter=2):
+    '''
+    The leading singular triplets of a matrix by randomized svd(Halko, Martinsson and Tropp, 2011).
+
+    Parameters:
+        :A: 2D array, the matrix.
+        :k: int, the number of singular triplets.
+        :oversample: int, the number of extra random vectors.
+        :niter: int, the number of power iterations, which improves the accuracy for slowly decaying spectra.
+
+    Return:
+        tuple of (U, S, V) as `svd(A,full_matrices=False)`, with `k` singular values.
+    '''
+    m,n=A.shape
+    l=min(k+oversample,m,n)
+    Q=linalg.qr(A.dot(random.standard_normal([n,l])))[0]
+    for i in xrange(niter):
+        Q=linalg.qr(A.T.conj().dot(Q))[0]
+        Q=linalg.qr(A.dot(Q))[0]
+    Ub,S,V=svd(Q.T.conj().dot(A),full_matrices=False)
+    return Q.dot(Ub[:,:k]),S[:k],V[:k]
+
+def _sum_sparse(mats,shape):
+    '''
+    Sum sparse matrices in one pass, the COO entries are concatenated and converted to CSR once(duplicates are summed).
+
+    Parameters:
+        :mats: list of sparse matrices.
+        :shape: tuple, the shape of matrices.
+
+    Return:
+        <csr_matrix>,
+    '''
+    mats=[sps.coo_matrix(m) for m in mats]
+    if len(mats)==0:
+        return sps.csr_matrix(shape)
+    data=concatenate([m.data for m in mats])
+    row=concatenate([m.row for m in mats])
+    col=concatenate([m.col for m in mats])
+    return sps.csr_matrix((data,(row,col)),shape=shape)
+
+def _gen_hamiltonian_full(HL0,HR0,hgen_l,hgen_r,interop,nworker=1):
+    '''Get the full hamiltonian, interop terms are built by `nworker` threads.'''
     ndiml,ndimr=HL0.shape[0],HR0.shape[0]
     H1,H2=kron(HL0,sps.identity(ndimr)),kron(sps.identity(ndiml),HR0)
-    H=H1+H2
     #get the link hamiltonians
     sb=SuperBlock(hgen_l,hgen_r)
-    Hin=[]
-    for op in interop:
-        Hin.append(sb.get_op(op))
-    H=H+sum(Hin)
+    Hin=_thread_map(sb.get_op,interop,nworker)
+    H=_sum_sparse([H1,H2]+Hin,shape=(ndiml*ndimr,ndiml*ndimr))
     H=_eliminate_zeros(H,ZERO_REF)
     return H
 
-def _gen_hamiltonian_block0(HL0,HR0,hgen_l,hgen_r,interop,blockinfo):
-    '''Get the combined hamiltonian for specific block.'''
+def _gen_hamiltonian_block0(HL0,HR0,hgen_l,hgen_r,interop,blockinfo,nworker=1):
+    '''Get the combined hamiltonian for specific block, interop terms are built by `nworker` threads.'''
     ndiml,ndimr=HL0.shape[0],HR0.shape[0]
     bml,bmr,pml,pmr,bmg,target_block=blockinfo['bml'],blockinfo['bmr'],blockinfo['pml'],blockinfo['pmr'],blockinfo['bmg'],blockinfo['target_block']
-    bm_tot,pm=bmg.join_bms([bml,bmr]).compact_form()
-    pm=((pml*len(pmr))[:,newaxis]+pmr).ravel()[pm]
-    t0=time.time()
+    bm_tot,pm=_join_blockinfo(blockinfo,ndimr)
     H1,H2=kron(HL0,sps.identity(ndimr)),kron(sps.identity(ndiml),HR0)
-    t1=time.time()
     indices=pm[bm_tot.get_slice(target_block,uselabel=True)]
     H1,H2=H1.tocsr()[indices][:,indices],H2.tocsr()[indices][:,indices]
-    Hc=H1+H2
     sb=SuperBlock(hgen_l,hgen_r)
-    for op in interop:
-        Hc=Hc+(sb.get_op(op)).tocsr()[indices][:,indices]
-    t2=time.time()
-    print 'Generate Hamiltonian %s, %s'%(t1-t0,t2-t1)
+    Hin=_thread_map(lambda op:sb.get_op(op).tocsr()[indices][:,indices],interop,nworker)
+    Hc=_sum_sparse([H1,H2]+Hin,shape=(len(indices),len(indices)))
     return Hc,bm_tot,pm
 
-def _gen_hamiltonian_block(HL0,HR0,hgen_l,hgen_r,interop,blockinfo):
-    '''Get the combined hamiltonian for specific block.'''
+def _gen_hamiltonian_block(HL0,HR0,hgen_l,hgen_r,interop,blockinfo,nworker=1):
+    '''Get the combined hamiltonian for specific block, interop terms are built by `nworker` threads.'''
     ndiml,ndimr=HL0.shape[0],HR0.shape[0]
-    bm_tot,pm=blockinfo['bmg'].join_bms([blockinfo['bml'],blockinfo['bmr']]).compact_form()
-    pm=((blockinfo['pml']*ndimr)[:,newaxis]+blockinfo['pmr']).ravel()[pm]
+    bm_tot,pm=_join_blockinfo(blockinfo,ndimr)
     indices=pm[bm_tot.get_slice(blockinfo['target_block'],uselabel=True)]
     cinds=ind2c(indices,N=[ndiml,ndimr])
-    t0=time.time()
-    H1=fget_subblock_dmrg(hl=HL0.toarray(),hr=identity(ndimr),indices=cinds,is_identity=2)
-    H2=fget_subblock_dmrg(hl=identity(ndiml),hr=HR0.toarray(),indices=cinds,is_identity=1)
-    Hc=H1+H2
-    t1=time.time()
+    lookup=get_subblock_lookup(cinds,(ndiml,ndimr))
+    H1=get_subblock_csr(hl=HL0,hr=sps.identity(ndimr),indices=cinds,lookup=lookup,is_identity=2)
+    H2=get_subblock_csr(hl=sps.identity(ndiml),hr=HR0,indices=cinds,lookup=lookup,is_identity=1)
     sb=SuperBlock(hgen_l,hgen_r)
-    for op in interop:
-        Hc=Hc+sb.get_op(op,indices=cinds)
-    t2=time.time()
-    print 'Generate Hamiltonian %s, %s'%(t1-t0,t2-t1)
-    return sps.csr_matrix(Hc),bm_tot,pm
+    Hin=_thread_map(lambda op:sb.get_op(op,indices=cinds,lookup=lookup),interop,nworker)
+    Hc=_sum_sparse([H1,H2]+Hin,shape=(len(indices),len(indices)))
+    return Hc,bm_tot,pm
+
+def _gen_hamiltonian_pairs(HL0,HR0,pairs,blockinfo,nworker=1):
+    '''Get the combined hamiltonian for specific block, with interop terms in factorized form(mA, mB).'''
+    ndiml,ndimr=HL0.shape[0],HR0.shape[0]
+    bm_tot,pm=_join_blockinfo(blockinfo,ndimr)
+    indices=pm[bm_tot.get_slice(blockinfo['target_block'],uselabel=True)]
+    cinds=ind2c(indices,N=[ndiml,ndimr])
+    lookup=get_subblock_lookup(cinds,(ndiml,ndimr))
+    H1=get_subblock_csr(hl=HL0,hr=sps.identity(ndimr),indices=cinds,lookup=lookup,is_identity=2)
+    H2=get_subblock_csr(hl=sps.identity(ndiml),hr=HR0,indices=cinds,lookup=lookup,is_identity=1)
+    Hin=_thread_map(lambda pair:get_subblock_csr(hl=pair[0],hr=pair[1],indices=cinds,lookup=lookup,is_identity=0),pairs,nworker)
+    Hc=_sum_sparse([H1,H2]+Hin,shape=(len(indices),len(indices)))
+    return Hc,bm_tot,pm
+
+def _gen_hamiltonian_matfree(HL0,HR0,hgen_l,hgen_r,interop,blockinfo):
+    '''Get the combined hamiltonian for specific block as a matrix-free <SuperBlockOperator>.'''
+    ndiml,ndimr=HL0.shape[0],HR0.shape[0]
+    sb=SuperBlock(hgen_l,hgen_r)
+    pairs=[sb.get_op_pair(op) for op in interop]
+    if blockinfo is None:
+        bm_tot,pm,indices=None,None,None
+    else:
+        bm_tot,pm=_join_blockinfo(blockinfo,ndimr)
+        indices=pm[bm_tot.get_slice(blockinfo['target_block'],uselabel=True)]
+    Hc=SuperBlockOperator(HL0,HR0,pairs,indices=indices)
+    return Hc,bm_tot,pm
 
 def _get_mps(hgen_l,hgen_r,phi,direction,labels):
     '''Combining hgen_l and hgen_r to get the matrix product state.'''
@@ -123,22 +438,45 @@ class DMRGEngine(object):
     Attributes:
         :hgen: <ExpandGenerator>, hamiltonian Generator.
         :bmg: <BlockMarkerGenerator>, the block marker generator.
-        :tol: float, the tolerence, when maxN and tol are both set, we keep the lower dimension.
+        :tol: float, the tolerence of discarded weight in truncation, when maxN and tol are both set, we keep the lower dimension.
         :reflect: bool, True if left<->right reflect, can be used to shortcut the run time.
         :eigen_solver: str,
             
             * 'JD', Jacobi-Davidson iteration.
+            * 'BD', block Davidson iteration, which is also used by 'LC' in multi-level calculation if `block_levels` is set.
             * 'LC', Lanczos, algorithm.
         :iprint: int, the redundency level of output information, 0 for None, 10 for debug.
+        :hbuilder: str, the builder for the hamiltonian of target block,
+
+            * 'block', construct the sparse matrix of target block explicitly.
+            * 'block0', construct the sparse matrix of the whole space, then slice out the target block.
+            * 'matfree', use a matrix-free <SuperBlockOperator>, the Kronecker products are never formed.
+            * 'auto', choose one of above for each step by the cost model `estimate_build_cost`,
+              which is calibrated lazily by `calibrate_hbuilder` if the cache file `DMRG_CALIBRATION` is set.
 
         :symm_handler: <SymmetryHandler>, the discrete symmetry handler.
-        :LPART/RPART: dict, the left/right sweep of hamiltonian generators.
+        :LPART/RPART: dict/<BlockStorage>, the left/right sweep of hamiltonian generators.
+        :storage: dict/None, the setting of out-of-core storage for LPART/RPART, see `use_out_of_core`.
+        :nrecycle: int, the number of extra Ritz vectors recycled between steps, see `use_recycling`.
+        :block_levels: bool, solve multi-level steps of 'LC' with the block Davidson solver, see `use_block_levels`.
+        :eigen_info: dict, the information of the last eigensolve(solver, niter, nmatvec, subspace).
+        :telemetry: <Telemetry>, one <StepRecord> per step and one <SweepRecord> per sweep are emitted to its sinks.
+        :step_record: <StepRecord>, the record of the last step.
+        :memory_budget: int/None, the memory budget of a step in bytes, see `use_memory_budget`.
+        :sector_weights: 1D array/None, the weights of target blocks in the mixed density matrix, None for equal weights.
+        :nworker: int/None, the number of threads to diagonalize target blocks, None for one per block.
+        :term_nworker: int, the number of threads to build interop terms of the hamiltonian, see `use_concurrent_terms`.
+        :svd_backend: str, the svd backend of truncation, see `use_svd_backend`.
+        :svd_nworker: int, the number of threads to decompose blocks in truncation.
         :_tails(private): list, the last item of A matrices, which is used to construct the <MPS>.
     '''
-    def __init__(self,hgen,tol=0,reflect=False,eigen_solver='LC',iprint=1):
+    def __init__(self,hgen,tol=0,reflect=False,eigen_solver='LC',iprint=1,hbuilder='block'):
         self.tol=tol
         self.hgen=hgen
         self.eigen_solver=eigen_solver
+        if hbuilder not in HBUILDERS:
+            raise ValueError('Unknown hamiltonian builder %s.'%hbuilder)
+        self.hbuilder=hbuilder
 
         #the symmetries
         self.reflect=reflect
@@ -150,29 +488,68 @@ class DMRGEngine(object):
         self._tails=None
         self.LPART=None
         self.RPART=None
+        self.storage=None
+        self.nrecycle=0
+        self.block_levels=False
+        self.eigen_info={}
+        self._subspace=[]
+        self.telemetry=Telemetry()
+        self.step_record=None
+        self.memory_budget=None
+        self.sector_weights=None
+        self.nworker=None
+        self.term_nworker=1
+        self.svd_backend='full'
+        self.svd_nworker=1
 
         self.iprint=iprint
         #status
         self.status={'isweep':0,'direction':'->','pos':0}
 
+    @profiled('DMRGEngine._eigsh')
     def _eigsh(self,H,v0,projector=None,tol=1e-10,sigma=None,lc_search_space=1,k=1):
         '''
         solve eigenvalue problem.
+
+        The information of iteration is kept in `self.eigen_info`,
+        and if recycling is used, the extra Ritz vectors are kept in `self.eigen_info['subspace']`.
         '''
         maxiter=5000
         N=H.shape[0]
         if self.iprint==10 and projector is not None and check_commute:
             assert(is_commute(H,projector))
-        if self.eigen_solver=='LC':
+        use_block=projector is None and (self.eigen_solver=='BD' or (self.block_levels and self.eigen_solver=='LC' and k>1 and N>=100))
+        if self.nrecycle>0 and not use_block:
+            warnings.warn('The recycled subspace is dropped, it requires the block Davidson solver without projector.')
+        if v0 is not None and ndim(v0)==2 and not use_block:
+            #only the block solver accept a block of starting vectors, extra columns are recycled Ritz vectors.
+            v0=v0[:,:k].sum(axis=1)
+        self.eigen_info={'solver':'BD' if use_block else self.eigen_solver,'niter':None,'nmatvec':None,'subspace':None}
+        if use_block:
+            e,v,info=block_davidson(H,v0=v0,k=max(lc_search_space,k),tol=tol,maxiter=maxiter,nextra=self.nrecycle,return_info=True)
+            self.eigen_info.update(info)
+            if v0 is not None and ndim(v0)==2:
+                v0=v0[:,0]   #used in filtering states below.
+        elif self.eigen_solver=='LC':
             k=max(lc_search_space,k)
             if H.shape[0]<100:
                 e,v=eigh(H.toarray())
                 e,v=e[:k],v[:,:k]
             else:
+                counter=[0]
+                def matvec(x):
+                    counter[0]+=1
+                    return H.dot(x)
+                Hop=LinearOperator(H.shape,matvec=matvec,dtype=H.dtype)
                 try:
-                    e,v=eigsh(H,k=k,which='SA',maxiter=maxiter,tol=tol,v0=v0)
-                except:
-                    e,v=eigsh(H,k=k+1,which='SA',maxiter=maxiter,tol=tol,v0=v0)
+                    e,v=eigsh(Hop,k=k,which='SA',maxiter=maxiter,tol=tol,v0=v0)
+                except ArpackNoConvergence as exc:
+                    if len(exc.eigenvalues)>=k:
+                        e,v=exc.eigenvalues,exc.eigenvectors
+                    else:
+                        warnings.warn('Arpack does not converge with %s converged pairs, retry with k = %s.'%(len(exc.eigenvalues),k+1))
+                        e,v=eigsh(Hop,k=k+1,which='SA',maxiter=maxiter,tol=tol,v0=v0)
+                self.eigen_info['nmatvec']=counter[0]
             order=argsort(e)
             e,v=e[order],v[:,order]
         else:
@@ -259,6 +636,184 @@ class DMRGEngine(object):
         else:
             self.RPART[hgen.N]=hgen
 
+    def use_out_of_core(self,budget,directory=None):
+        '''
+        Store LPART/RPART in <BlockStorage>, inactive blocks are spilled to memory-mapped files.
+
+        Parameters:
+            :budget: int, the memory budget for LPART and RPART(each) in bytes.
+            :directory: str/None, the directory for spilled blocks, None for a temporary directory.
+        '''
+        self.storage={'budget':budget,'directory':directory}
+
+    def use_recycling(self,nextra=4):
+        '''
+        Recycle the Ritz subspace between steps, the block Davidson solver is used.
+
+        The `nextra` Ritz vectors above the targeted levels are kept after each step,
+        mapped by state prediction like the states, and seed the search space of next step.
+        Other solvers only take a single starting vector, so `eigen_solver` is switched to 'BD' with a warning.
+
+        Parameters:
+            :nextra: int, the number of extra Ritz vectors, 0 to disable.
+        '''
+        if nextra>0 and self.eigen_solver!='BD':
+            warnings.warn('Recycling requires the block Davidson solver, eigen_solver is switched from %s to BD.'%self.eigen_solver)
+            self.eigen_solver='BD'
+        self.nrecycle=nextra
+
+    def use_block_levels(self,enable=True):
+        '''
+        Solve multi-level steps(nlevel>1) of the Lanczos solver('LC') with the block Davidson solver,
+        so that the predicted states of all levels are kept as a starting block, small blocks(<100) are still diagonalized directly.
+
+        Parameters:
+            :enable: bool, False to use the Lanczos solver for all steps.
+        '''
+        self.block_levels=enable
+
+    def use_concurrent_terms(self,nworker=None):
+        '''
+        Build the interop terms of the hamiltonian concurrently in a thread pool.
+
+        It pays off for models with many inter-block terms, e.g. 2D models mapped to chains,
+        the terms are summed in one pass in either case.
+
+        Parameters:
+            :nworker: int/None, the number of threads, None for the number of cpus, 1 to build terms serially.
+        '''
+        self.term_nworker=cpu_count() if nworker is None else nworker
+
+    def use_svd_backend(self,backend='thin',nworker=1):
+        '''
+        Set the svd backend of truncation.
+
+        Parameters:
+            :backend: str, one of `SVD_BACKENDS`,
+                * 'full', the full unitaries are computed(default).
+                * 'thin', the thin svd of each quantum number block, only the possibly kept singular vectors are computed.
+                * 'randomized', the leading maxN singular triplets of large blocks(both dimensions at least `RSVD_RATIO`*maxN)
+                    by randomized svd, and the thin svd for other blocks.
+                The unitaries are padded with zero columns to square for `hgen.trunc`, which are never kept.
+            :nworker: int, the number of threads to decompose blocks.
+        '''
+        if backend not in SVD_BACKENDS:
+            raise ValueError('Unknown svd backend %s.'%backend)
+        self.svd_backend=backend
+        self.svd_nworker=nworker
+
+    def use_memory_budget(self,budget,cache_fraction=0.1):
+        '''
+        Set the memory budget of a DMRG step.
+
+        Before building the hamiltonian, the memory of the step is estimated(see `estimate_memory`),
+        if it exceeds the budget, the matrix-free hamiltonian is used instead,
+        and maxN is capped so that the next step fits the budget.
+        If the step does not fit even with the matrix-free hamiltonian, a MemoryError is raised before allocation.
+        The operator cache(`OP_CACHE`) is a part of the budget.
+
+        Parameters:
+            :budget: int/None, the budget in bytes, None to disable.
+            :cache_fraction: float, the operator cache is limited to this fraction of the budget.
+        '''
+        self.memory_budget=budget
+        if budget is not None:
+            OP_CACHE.resize(min(OP_CACHE.maxsize,int(cache_fraction*budget)))
+
+    def _select_hbuilder(self,HL0,HR0,hgen_l,hgen_r,interop,blockinfo):
+        '''
+        Choose the hamiltonian builder with the lowest estimated cost, see `estimate_build_cost`.
+
+        Parameters:
+            :HL0,HR0: matrix, the hamiltonians of the expanded left and right blocks.
+            :hgen_l,hgen_r: <ExpandGenerator>, the hamiltonian generator for left and right blocks.
+            :interop: list, the operators connecting two blocks.
+            :blockinfo: dict/None, the block informations.
+
+        Return:
+            str, 'block', 'block0' or 'matfree'.
+        '''
+        if not _CALIBRATED[0] and _calibration_file() is not None:
+            #load the cached calibration, or measure and cache it, once per process.
+            calibrate_hbuilder()
+        ndiml,ndimr=HL0.shape[0],HR0.shape[0]
+        sb=SuperBlock(hgen_l,hgen_r)
+        interop_nnz=[(sps.csr_matrix(A).nnz,sps.csr_matrix(B).nnz) for A,B in [sb.get_op_pair(op) for op in interop]]
+        costs=estimate_build_cost(ndiml,ndimr,_target_ndim(ndiml,ndimr,blockinfo),HL0.nnz,HR0.nnz,interop_nnz,
+                nmatvec=self.eigen_info.get('nmatvec') or 30)
+        if blockinfo is None:
+            #both explicit builders construct the whole space.
+            costs['block']=costs.pop('block0')
+        return min(costs,key=costs.get)
+
+    def _fit_memory_budget(self,HL0,HR0,interop,blockinfo,maxN,hndim,nlevel,hbuilder):
+        '''
+        Fit a step into the memory budget.
+
+        Parameters:
+            :HL0,HR0: matrix, the hamiltonians of the expanded left and right blocks.
+            :interop: list, the operators connecting two blocks.
+            :blockinfo: dict/None, the block informations.
+            :maxN: int, the maximum number of kept states.
+            :hndim: int, the dimension of a site.
+            :nlevel: int, the number of desired energy levels.
+            :hbuilder: str, the hamiltonian builder.
+
+        Return:
+            tuple of (hamiltonian builder, maxN, the estimated memory in bytes).
+        '''
+        #the operator cache is charged by its size now, and by its maximum size for the next step.
+        budget=self.memory_budget-OP_CACHE.nbytes
+        budget_next=self.memory_budget-OP_CACHE.maxsize
+        ndiml,ndimr=HL0.shape[0],HR0.shape[0]
+        ndim=_target_ndim(ndiml,ndimr,blockinfo)
+        nnz_row=1.*HL0.nnz/ndiml+1.*HR0.nnz/ndimr+len(interop)
+        itemsize=max(HL0.dtype.itemsize,HR0.dtype.itemsize)
+        nvec=max(20,4*nlevel+self.nrecycle)
+        def estimate(nl,nr,nd,hbuilder,maxN=maxN):
+            return estimate_memory(nl,nr,nd,nnz_row=nnz_row,itemsize=itemsize,nvec=nvec,hbuilder=hbuilder,
+                    svd_backend=self.svd_backend,maxN=maxN)['total']
+
+        mem=estimate(ndiml,ndimr,ndim,hbuilder)
+        if mem>budget and hbuilder!='matfree':
+            warnings.warn('Estimated memory %.1f MB exceeds the budget %.1f MB, switch to the matrix-free hamiltonian.'%(mem/1024.**2,budget/1024.**2))
+            hbuilder='matfree'
+            mem=estimate(ndiml,ndimr,ndim,hbuilder)
+        if mem>budget:
+            raise MemoryError('Estimated memory %.1f MB exceeds the budget %.1f MB.'%(mem/1024.**2,budget/1024.**2))
+        mem+=OP_CACHE.nbytes
+
+        #cap maxN so that the next step fits, assuming the same fraction of target block.
+        ratio=1.*ndim/(ndiml*ndimr)
+        def fits(D):
+            nb=D*hndim
+            nd=max(1,int(ratio*nb**2))
+            return min(estimate(nb,nb,nd,'block',D),estimate(nb,nb,nd,'matfree',D))<=budget_next
+        if not fits(maxN):
+            lo,hi=1,maxN
+            while lo<hi:
+                mid=(lo+hi+1)/2
+                if fits(mid): lo=mid
+                else: hi=mid-1
+            warnings.warn('maxN is capped from %s to %s to fit the memory budget.'%(maxN,lo))
+            maxN=lo
+        return hbuilder,maxN,mem
+
+    def _new_part(self,which,data):
+        '''Create the storage for LPART(which=`l`)/RPART(which=`r`).'''
+        if self.storage is None:
+            return dict(data)
+        directory=self.storage['directory']
+        if directory is not None:
+            directory=os.path.join(directory,which)
+        return BlockStorage(data,budget=self.storage['budget'],directory=directory)
+
+    def _prefetch(self,which,length):
+        '''Prefetch the hamiltonian generator of specific part.'''
+        part=self.LPART if which=='l' or self.reflect else self.RPART
+        if isinstance(part,BlockStorage):
+            part.prefetch(length)
+
     def reset(self):
         '''Restore this engine to initial status.'''
         #we insert Zs into operator collections to cope with fermionic sign problem.
@@ -266,13 +821,15 @@ class DMRGEngine(object):
         hgen_l=copy.deepcopy(self.hgen)
         if not isinstance(hgen_l.spaceconfig,SpinSpaceConfig):
             insert_Zs(hgen_l.evolutees['H'].opc,spaceconfig=hgen_l.spaceconfig)
-        self.LPART={0:hgen_l}
+        mark_truncated(hgen_l)
+        self.LPART=self._new_part('l',{0:hgen_l})
         if not self.reflect:
             hgen_r=copy.deepcopy(self.hgen)
             hgen_r.evolutees['H'].opc=site_image(hgen_r.evolutees['H'].opc,NL=0,NR=hgen_r.nsite,care_sign=True)
             if not isinstance(hgen_l.spaceconfig,SpinSpaceConfig):
                 insert_Zs(hgen_r.evolutees['H'].opc,spaceconfig=hgen_r.spaceconfig)
-            self.RPART={0:hgen_r}
+            mark_truncated(hgen_r)
+            self.RPART=self._new_part('r',{0:hgen_r})
 
     def use_disc_symmetry(self,target_sector,detect_scope=2):
         '''
@@ -293,25 +850,126 @@ class DMRGEngine(object):
             self.hgen.register_evolutee('J',opc=prod([handler.J(i) for i in xrange(self.hgen.nsite)]),initial_data=sps.identity(1))
         self.symm_handler=symm_handler
 
-    def use_U1_symmetry(self,qnumber,target_block):
+    def use_U1_symmetry(self,qnumber,target_block,weights=None,nworker=None):
         '''
         Use specific U1 symmetry.
+
+        Parameters:
+            :qnumber: str, the quantum numbers, e.g. 'M' or 'QM'.
+            :target_block: 1D array/2D array/function, the target block, or a list of target blocks(rows of 2D array),
+                a function takes `nsite` and returns one of them.
+                For multiple target blocks, the lowest state of each block is solved in each step,
+                the truncation is done with the weighted mixture of their density matrices,
+                the energies of all blocks are returned and the <MPS> is that of the first block.
+            :weights: 1D array/None, the weights of target blocks in the mixed density matrix, None for equal weights.
+            :nworker: int/None, the number of threads to diagonalize target blocks concurrently, None for one per block.
         '''
         self.bmg=SimpleBMG(spaceconfig=self.hgen.spaceconfig,qstring=qnumber)
         self._target_block=target_block
+        self.sector_weights=None if weights is None else asarray(weights,dtype='float64')
+        self.nworker=nworker
 
     @property
-    def target_block(self):
-        '''Get the target block.'''
+    def target_blocks(self):
+        '''Get the list of target blocks, [None] if no block is targeted.'''
         target_block=self._target_block
         if hasattr(target_block,'__call__'):
             n,pos=self.status['isweep'],self.status['pos']
             nsite=self.nsite
             if n==0 and pos<nsite/2: nsite=pos*2
             target_block=target_block(nsite=nsite)
-        return target_block
+        if target_block is None:
+            return [None]
+        if ndim(target_block)==2:
+            return list(asarray(target_block))
+        return [target_block]
 
-    def run_finite(self,endpoint=None,tol=0,maxN=20,nlevel=1,call_before=None,call_after=None):
+    @property
+    def target_block(self):
+        '''Get the target block, the first one if multiple blocks are targeted.'''
+        return self.target_blocks[0]
+
+    def save_checkpoint(self,directory,runtime):
+        '''
+        Save the engine state to a checkpoint file atomically.
+
+        Spilled blocks of <BlockStorage> are not loaded, their files are hard-linked(or copied) into a sub-directory.
+
+        Parameters:
+            :directory: str, the directory of checkpoint.
+            :runtime: dict, the run-time variables of the sweep.
+        '''
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        blockdir=tempfile.mkdtemp(prefix=CHECKPOINT_BLOCKS,dir=directory)
+        fd,tmpfile=tempfile.mkstemp(prefix='.'+CHECKPOINT_FILE,dir=directory)
+        try:
+            data={'status':self.status,'runtime':runtime,'subspace':self._subspace,'spilled':{},
+                    'blockdir':os.path.basename(blockdir),'trunc_version':reserve_trunc_versions()}
+            for which,part in [('LPART',self.LPART),('RPART',self.RPART)]:
+                if isinstance(part,BlockStorage):
+                    data[which],data['spilled'][which]=part.link_spilled(blockdir)
+                else:
+                    data[which]=part
+            _fsync_dir(blockdir)
+            with os.fdopen(fd,'wb') as f:
+                cPickle.dump(data,f,cPickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmpfile,os.path.join(directory,CHECKPOINT_FILE))
+            _fsync_dir(directory)
+        except Exception:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+            shutil.rmtree(blockdir,ignore_errors=True)
+            raise
+        #the blocks of older checkpoints.
+        for fname in os.listdir(directory):
+            if fname.startswith(CHECKPOINT_BLOCKS) and fname!=data['blockdir']:
+                shutil.rmtree(os.path.join(directory,fname),ignore_errors=True)
+
+    def load_checkpoint(self,directory):
+        '''
+        Load the engine state from a checkpoint file.
+
+        Parameters:
+            :directory: str, the directory of checkpoint.
+
+        Return:
+            dict/None, the run-time variables of the sweep, None if no checkpoint is found.
+        '''
+        filename=os.path.join(directory,CHECKPOINT_FILE)
+        if not os.path.exists(filename):
+            return None
+        with open(filename,'rb') as f:
+            data=cPickle.load(f)
+        #truncation versions are only unique within a process, spilled blocks keep theirs.
+        reserve_trunc_versions(data.get('trunc_version',0))
+        for part in [data['LPART'],data['RPART']]:
+            if part is not None:
+                for hgen in part.values():
+                    mark_truncated(hgen)
+        spilled=data.get('spilled',{})
+        blockdir=os.path.join(directory,data.get('blockdir',''))
+        for which in ['LPART','RPART']:
+            if data[which] is None:
+                setattr(self,which,None)
+                continue
+            part=self._new_part(which[0].lower(),data[which])
+            if len(spilled.get(which,{}))>0:
+                if isinstance(part,BlockStorage):
+                    part.add_spilled(blockdir,spilled[which])
+                else:
+                    storage=BlockStorage()
+                    storage.add_spilled(blockdir,spilled[which])
+                    part.update(storage.items())
+            setattr(self,which,part)
+        self._subspace=data.get('subspace',[])
+        self.status.update(data['status'])
+        return data['runtime']
+
+    def run_finite(self,endpoint=None,tol=0,maxN=20,nlevel=1,call_before=None,call_after=None,checkpoint=None,checkpoint_interval=600.,resume=False,scheduler=None,precision='double',
+            mode='2site',alpha=1e-4):
         '''
         Run the application.
 
@@ -321,6 +979,16 @@ class DMRGEngine(object):
             :maxN: int, maximum number of kept states and the tolerence for truncation weight.
             :nlevel: int, the number of desired energy levels.
             :call_before/call_after: function/None, the function to call back before/after each iteration, using `DMRGEngine` as an parameter.
+            :checkpoint: str/None, the directory to store checkpoints, None for no checkpoint.
+            :checkpoint_interval: float, the minimum time interval between two checkpoints in seconds.
+            :resume: bool, resume from the checkpoint in `checkpoint` directory if it exists.
+            :scheduler: <SweepScheduler>/None, the scheduler of sweeps, which overrides `tol`, `maxN` and `precision`.
+                None for a scheduler stopping when the energy change at the midpoint is smaller than `tol`.
+            :precision: str/list, the precision('single' or 'double') of each sweep, single precision sweeps are promoted
+                to double precision once the energy stalls, see <SweepScheduler>.
+            :mode: '2site'/'1site', the update of a step, see `dmrg_step`,
+                '1site' steps start from the second sweep, the first sweep grows the blocks by two-site steps.
+            :alpha: float, the mixing factor of the density matrix perturbation in '1site' steps.
 
         Return:
             tuple, the ground state energy and the ground state(in <MPS> form).
@@ -329,28 +997,54 @@ class DMRGEngine(object):
         #check the validity of datas.
         if isinstance(self.hgen.evolutor,NullEvolutor):
             raise ValueError('The evolutor must not be null!')
+        if mode not in MODES:
+            raise ValueError('Unknown mode %s.'%mode)
+        if mode=='1site' and (self.bmg is None or not self.symm_handler==None or nlevel!=1):
+            raise NotImplementedError('Single-site steps require U1 symmetry, a single level and no symmetry handler!')
         if not self.symm_handler==None and nlevel!=1:
             raise NotImplementedError('The symmetric Handler can not be used in multi-level calculation!')
         if not self.symm_handler==None and self.bmg is None:
             raise NotImplementedError('The symmetric Handler can not without Block marker generator!')
         self.reset()
+        self._subspace=[]
+        runtime=self.load_checkpoint(checkpoint) if (resume and checkpoint is not None) else None
+        t_checkpoint=time.time()
+        istep=-1
 
         nsite=self.hgen.nsite
         if endpoint is None: endpoint=(4,'<-',0)
         maxsweep,end_direction,end_site=endpoint
-        if ndim(maxN)==0:
-            maxN=[maxN]*maxsweep
-        assert(len(maxN)>=maxsweep and end_site<=(nsite-2 if not self.reflect else nsite/2-2))
+        if scheduler is None:
+            if ndim(maxN)==0:
+                maxN=[maxN]*maxsweep
+            scheduler=SweepScheduler(maxN,etol=tol,precision=precision)
+        assert(scheduler.nsweep>=maxsweep and end_site<=(nsite-2 if not self.reflect else nsite/2-2))
+        if runtime is not None and 'scheduler' in runtime:
+            #resume the precision schedule, the promoted sweeps are not run in single precision again.
+            scheduler.set_state(runtime['scheduler'])
         EG_PRE=Inf
         initial_state=None
+        if runtime is not None:
+            EL,EG_PRE,EG,initial_state=runtime['EL'],runtime['EG_PRE'],runtime['EG'],runtime['initial_state']
+            if self.iprint>1: print 'Resume from %s-th sweep, direction %s, iteration %s.'%(runtime['isweep']+1,runtime['direction'],runtime['pos'])
         if self.reflect:
             iterators={'->':xrange(nsite/2),'<-':xrange(nsite/2-2,-1,-1)}
         else:
             iterators={'->':xrange(nsite-1),'<-':xrange(nsite-2,-1,-1)}
-        for n,m in enumerate(maxN):
+        for n in xrange(scheduler.nsweep):
+            m,eigen_tol=scheduler.get_maxN(n),scheduler.get_eigen_tol(n)
+            precision=scheduler.get_precision(n)
+            terr=0   #the maximum truncation error in this sweep.
+            t_sweep,nstep=time.time(),0
+            if runtime is not None and n==runtime['isweep']:
+                terr=runtime.get('terr',0)
             for direction in ['->','<-']:
                 for i in iterators[direction]:
-                    print 'Running %s-th sweep, iteration %s'%(n+1,i)
+                    istep+=1
+                    if runtime is not None and istep<=runtime['istep']:
+                        continue
+                    position=(n,direction,i)
+                    if self.iprint>1: print 'Running %s-th sweep, iteration %s'%(n+1,i)
                     t0=time.time()
                     self.status.update({'isweep':n,'pos':i+1,'direction':direction})
                     if call_before is not None: call_before(self)
@@ -363,7 +1057,7 @@ class DMRGEngine(object):
                         hgen_r=hgen_l
                     else:
                         hgen_r=self.query('r',nsite-i-2)
-                    print 'A'*hgen_l.N+'..'+'B'*hgen_r.N
+                    if self.iprint>1: print 'A'*hgen_l.N+'..'+'B'*hgen_r.N
                     nsite_true=hgen_l.N+hgen_r.N+2
 
                     #run a step
@@ -371,21 +1065,35 @@ class DMRGEngine(object):
                         e_estimate=None
                     else:
                         e_estimate=EG[0]
-                    EG,err,phil=self.dmrg_step(hgen_l,hgen_r,tol=tol,maxN=m,
-                            initial_state=initial_state,e_estimate=e_estimate,nlevel=nlevel)
+                    try:
+                        EG,err,phil=self.dmrg_step(hgen_l,hgen_r,tol=tol,maxN=m,eigen_tol=eigen_tol,
+                                initial_state=initial_state,e_estimate=e_estimate,nlevel=nlevel,precision=precision,
+                                mode=mode if n>0 else '2site',alpha=alpha)
+                    except MemoryError:
+                        #save the state before this step, so that we can resume with a larger budget.
+                        if checkpoint is not None and len(EL)>0:
+                            self.save_checkpoint(checkpoint,{'istep':istep-1,'isweep':position[0],'direction':position[1],'pos':position[2],
+                                'EL':EL,'EG_PRE':EG_PRE,'EG':EG,'initial_state':initial_state,'terr':terr,
+                                'scheduler':scheduler.get_state()})
+                        raise
+                    terr=max(terr,err)
                     #update LPART and RPART
-                    print 'setting %s-site of left and %s-site of right.'%(hgen_l.N,hgen_r.N)
                     self.set('l',hgen_l,hgen_l.N)
-                    print 'set L = %s, size %s'%(hgen_l.N,hgen_l.ndim)
+                    if self.iprint>1: print 'set L = %s, size %s'%(hgen_l.N,hgen_l.ndim)
                     if hgen_l is not hgen_r or (not self.reflect and n==0 and i<nsite/2):
                         #Note: Condition for setting up the right block,
                         #1. when the left and right part are not the same one.
                         #2. when the block has not been expanded to full length and not reflecting.
                         self.set('r',hgen_r,hgen_r.N)
-                        print 'set R = %s, size %s'%(hgen_r.N,hgen_r.ndim)
+                        if self.iprint>1: print 'set R = %s, size %s'%(hgen_r.N,hgen_r.ndim)
                     if call_after is not None: call_after(self)
+                    #prefetch the block for the next iteration.
+                    if direction=='->':
+                        self._prefetch('r',nsite-i-3)
+                    else:
+                        self._prefetch('l',i-1)
 
-                    #do state prediction
+                    #do state prediction, recycled Ritz vectors are predicted as well.
                     initial_state=None   #restore initial state.
                     phi=phil[0]
                     if nsite==nsite_true:
@@ -395,34 +1103,48 @@ class DMRGEngine(object):
                             #and use the reflection symmetry.
                             #for the right block is instantly replaced by another hamiltonian generator,
                             #which is not directly connected to the current hamiltonian generator.
-                            initial_state=sum([self.state_prediction(phi,l=i+1,direction=direction) for phi in phil],axis=0).ravel()
+                            initial_state=array([self.state_prediction(phi,l=i+1,direction=direction).ravel() for phi in phil+self._subspace]).T
                         elif direction=='->' and i==nsite-2:  #for the case without reflection.
-                            initial_state=phil[0].ravel()
+                            initial_state=array([phi.ravel() for phi in phil+self._subspace]).T
                         elif direction=='<-' and i==0:
-                            initial_state=phil[0].ravel()
+                            initial_state=array([phi.ravel() for phi in phil+self._subspace]).T
                         else:
                             if self.reflect and direction=='->' and i==nsite/2-1:
                                 direction='<-'  #the turning point of where reflection used.
-                            initial_state=sum([self.state_prediction(phi,l=i+1,direction=direction) for phi in phil],axis=0)
-                            initial_state=initial_state.ravel()
+                            initial_state=array([self.state_prediction(phi,l=i+1,direction=direction).ravel() for phi in phil+self._subspace]).T
 
                     if len(EL)>0:
                         diff=EG-EL[-1]
                     else:
                         diff=Inf
                     t1=time.time()
-                    print 'EG = %s, dE = %s, Elapse -> %.2f, TruncError -> %s'%(EG,diff,t1-t0,err)
+                    nstep+=1
+                    self.step_record.update(energy=EG,dE=diff,elapse=t1-t0)
+                    self.telemetry.emit(self.step_record)
                     EL.append(EG)
                     if i==end_site and direction==end_direction:
                         diff=EG-EG_PRE
-                        print 'MidPoint -> EG = %s, dE = %s'%(EG,diff)
+                        if scheduler.check_stall(n,diff) and self.iprint>1:
+                            print 'Energy stalls in single precision, the remaining sweeps are promoted to double precision.'
+                        converged=scheduler.check_convergence(n,diff,terr)
+                        PROFILER.mark_sweep(n)
+                        self.telemetry.emit(SweepRecord(engine='dmrg',isweep=n,energy=EG,dE=diff,trunc_error=terr,
+                            elapse=t1-t_sweep,nstep=nstep,converged=converged))
                         if n==maxsweep-1:
-                            print 'Breaking due to maximum sweep reached!'
+                            if self.iprint>1: print 'Breaking due to maximum sweep reached!'
+                            return EG,self.get_mps(phi=phil[0],l=i+1,direction=direction)
+                        elif converged:
+                            if self.iprint>1: print 'Breaking due to convergence!'
                             return EG,self.get_mps(phi=phil[0],l=i+1,direction=direction)
                         else:
                             EG_PRE=EG
+                    if checkpoint is not None and t1-t_checkpoint>=checkpoint_interval:
+                        self.save_checkpoint(checkpoint,{'istep':istep,'isweep':position[0],'direction':position[1],'pos':position[2],
+                            'EL':EL,'EG_PRE':EG_PRE,'EG':EG,'initial_state':initial_state,'terr':terr,
+                            'scheduler':scheduler.get_state()})
+                        t_checkpoint=time.time()
 
-    def run_infinite(self,maxiter=50,tol=0,maxN=20,nlevel=1):
+    def run_infinite(self,maxiter=50,tol=0,maxN=20,nlevel=1,predict=True):
         '''
         Run the application.
 
@@ -430,6 +1152,7 @@ class DMRGEngine(object):
             :maxiter: int, the maximum iteration times.
             :tol: float, the rolerence of energy.
             :maxN: int/list, maximum number of kept states and the tolerence for truncation weight.
+            :predict: bool, start each iteration from the McCulloch prediction of the last state, see `idmrg_prediction`.
 
         Return:
             tuple of EG,MPS.
@@ -448,24 +1171,29 @@ class DMRGEngine(object):
             raise ValueError('The evolutor must not be null!')
         if maxiter>self.hgen.nsite:
             warnings.warn('Max iteration exceeded the chain length!')
+        initial_state,lam=None,None
         for i in xrange(maxiter):
-            print 'Running iteration %s'%i
+            if self.iprint>1: print 'Running iteration %s'%i
             t0=time.time()
-            EG,err,phil=self.dmrg_step(hgen,hgen,tol=tol,nlevel=nlevel)
+            EG,err,phil=self.dmrg_step(hgen,hgen,tol=tol,nlevel=nlevel,initial_state=initial_state)
+            if predict:
+                initial_state,lam=self.idmrg_prediction(hgen,phil,lam)
             EG=EG/(2.*(i+1))
             if len(EL)>0:
                 diff=EG-EL[-1]
             else:
                 diff=Inf
             t1=time.time()
-            print 'EG = %.5f, dE = %.2e, Elapse -> %.2f(D=%s), TruncError -> %.2e'%(EG,diff,t1-t0,hgen.ndim,err)
+            self.step_record.update(isweep=i,energy=EG,dE=diff,elapse=t1-t0)
+            self.telemetry.emit(self.step_record)
             EL.append(EG)
             if abs(diff)<tol:
-                print 'Breaking!'
+                if self.iprint>1: print 'Breaking!'
                 break
         return EG,_get_mps(hgen,hgen,phi=phil[0],direction='->',labels=['s','a'])
 
-    def dmrg_step(self,hgen_l,hgen_r,tol=0,maxN=20,e_estimate=None,nlevel=1,initial_state=None):
+    def dmrg_step(self,hgen_l,hgen_r,tol=0,maxN=20,e_estimate=None,nlevel=1,initial_state=None,eigen_tol=1e-10,precision='double',
+            mode='2site',alpha=1e-4):
         '''
         Run a single step of DMRG iteration.
 
@@ -473,13 +1201,21 @@ class DMRGEngine(object):
             :hgen_l,hgen_r: <ExpandGenerator>, the hamiltonian generator for left and right blocks.
             :tol: float, the rolerence.
             :maxN: int, maximum number of kept states and the tolerence for truncation weight.
-            :initial_state: 1D array/None, the initial state(prediction), None for random.
+            :initial_state: 1D array/2D array/None, the initial state(prediction), columns of 2D array are the predictions for different levels, None for random.
+            :eigen_tol: float, the tolerance of eigensolver.
+            :precision: str, 'single' to diagonalize and truncate in float32/complex64,
+                symmetry projected hamiltonians stay in double precision.
+            :mode: '2site'/'1site', '1site' to diagonalize in the basis of the left expanded block and the kept right states of `initial_state`,
+                two-site steps are used if `initial_state` is None or the two blocks are identical.
+            :alpha: float, the mixing factor of the density matrix perturbation in '1site' steps.
 
         Return:
             tuple of (ground state energy(float), unitary matrix(2D array), kpmask(1D array of bool), truncation error(float))
         '''
         direction=self.status['direction']
         target_block=self.target_block
+        record=StepRecord(engine='dmrg',isweep=self.status['isweep'],direction=direction,pos=self.status['pos'])
+        self.step_record=record
 
         t0=time.time()
         intraop_l,intraop_r,interop=[],[],[]
@@ -513,15 +1249,31 @@ class DMRGEngine(object):
             bml,pml=None,None #get_blockmarker(HL0)
             bmr,pmr=None,None #get_blockmarker(HR0)
 
-        if target_block is None:
-            Hc,bm_tot=_gen_hamiltonian_full(HL0,HR0,hgen_l,hgen_r,interop=interop),None
+        blockinfo=None if target_block is None else dict(bml=bml,bmr=bmr,pml=pml,pmr=pmr,bmg=self.bmg,target_block=target_block)
+        target_blocks=self.target_blocks
+        if len(target_blocks)>1:
+            if not self.symm_handler==None or nlevel!=1 or mode!='2site':
+                raise NotImplementedError('Multiple target blocks can not be used with symmetry handler, multi-level calculation or single-site steps!')
+            return self._dmrg_step_sectors(hgen_l,hgen_r,HL0,HR0,interop,blockinfo,target_blocks,maxN=maxN,
+                    initial_state=initial_state,eigen_tol=eigen_tol,precision=precision,t0=t0)
+        if mode=='1site' and initial_state is not None and hgen_l is not hgen_r:
+            return self._dmrg_step_1site(hgen_l,hgen_r,HL0,HR0,interop,blockinfo,maxN=maxN,
+                    initial_state=initial_state,eigen_tol=eigen_tol,precision=precision,alpha=alpha,t0=t0)
+        hbuilder=self.hbuilder
+        if hbuilder=='auto':
+            hbuilder=self._select_hbuilder(HL0,HR0,hgen_l,hgen_r,interop,blockinfo)
+        if self.memory_budget is not None:
+            hbuilder,maxN,record.memory_estimate=self._fit_memory_budget(HL0,HR0,interop,blockinfo,maxN=maxN,hndim=hndim,nlevel=nlevel,hbuilder=hbuilder)
+        record.hbuilder=hbuilder
+        if hbuilder=='matfree':
+            Hc,bm_tot,pm_tot=_gen_hamiltonian_matfree(HL0,HR0,hgen_l=hgen_l,hgen_r=hgen_r,interop=interop,blockinfo=blockinfo)
+        elif target_block is None:
+            Hc,bm_tot=_gen_hamiltonian_full(HL0,HR0,hgen_l,hgen_r,interop=interop,nworker=self.term_nworker),None
+        elif hbuilder=='block0':
+            Hc,bm_tot,pm_tot=_gen_hamiltonian_block0(HL0,HR0,hgen_l=hgen_l,hgen_r=hgen_r,blockinfo=blockinfo,interop=interop,nworker=self.term_nworker)
         else:
-            if False:    #efficiency cross over
-                Hc,bm_tot,pm_tot=_gen_hamiltonian_block0(HL0,HR0,hgen_l=hgen_l,hgen_r=hgen_r,\
-                        blockinfo=dict(bml=bml,bmr=bmr,pml=pml,pmr=pmr,bmg=self.bmg,target_block=target_block),interop=interop)
-            else:
-                Hc,bm_tot,pm_tot=_gen_hamiltonian_block(HL0,HR0,hgen_l=hgen_l,hgen_r=hgen_r,\
-                        blockinfo=dict(bml=bml,bmr=bmr,pml=pml,pmr=pmr,bmg=self.bmg,target_block=target_block),interop=interop)
+            Hc,bm_tot,pm_tot=_gen_hamiltonian_block(HL0,HR0,hgen_l=hgen_l,hgen_r=hgen_r,blockinfo=blockinfo,interop=interop,nworker=self.term_nworker)
+        rss_h=_peak_rss()
 
         #get the starting eigen state v00!
         if initial_state is None:
@@ -535,6 +1287,8 @@ class DMRGEngine(object):
             else:
                 nl=(int32(1-sign4bm(bml,self.bmg,diag_only=True))/2)[argsort(pml)]
                 self.symm_handler.update_handlers(OPL=OPL,OPR=OPR,n=nl,useC=True)
+            if ndim(initial_state)==2:
+                initial_state=initial_state[:,0]
             v00=self.symm_handler.project_state(phi=initial_state)
             if self.iprint==10:assert(self.symm_handler.check_op(H))
         else:
@@ -557,19 +1311,36 @@ class DMRGEngine(object):
         if norm(v0)==0:
             warnings.warn('Empty v0')
             v0=None
-        print 'The density of Hamiltonian -> %s'%(1.*len(Hc.data)/Hc.shape[0]**2)
+        if projector is None or not iscomplexobj(projector):
+            #keep real hamiltonians real, the states and truncation follow.
+            Hc,v0=real_if_close(Hc,v0,tol=ZERO_REF)
+        if precision=='single' and projector is None:
+            Hc,v0=cast_precision(Hc,v0,precision)
+        record.precision='single' if Hc.dtype in (float32,complex64) else 'double'
+        record.update(ndim=Hc.shape[0],nnz=Hc.nnz if sps.issparse(Hc) else None)
+        if sps.issparse(Hc) and self.telemetry.wants('density'):
+            record.density=1.*Hc.nnz/Hc.shape[0]**2
         e,v=self._eigsh(Hc,v0,sigma=e_estimate,projector=projector,
-                lc_search_space=self.symm_handler.detect_scope if detect_C2 else 1,k=nlevel,tol=1e-10)
-        if v0 is not None:
-            print 'The goodness of estimate -> %s'%(v0.conj()/norm(v0)).dot(v[:,0])
+                lc_search_space=self.symm_handler.detect_scope if detect_C2 else 1,k=nlevel,tol=eigen_tol)
+        if v0 is not None and self.telemetry.wants('overlap'):
+            v0_=v0 if ndim(v0)==1 else v0[:,0]
+            record.overlap=abs((v0_.conj()/norm(v0_)).dot(v[:,0]))
+        record.update(niter=self.eigen_info['niter'],nmatvec=self.eigen_info['nmatvec'])
         t2=time.time()
+        rss_eigen=_peak_rss()
         ##3. permute back eigen-vectors into original representation al,sl+1,sl+2,al+2
+        subspace=self.eigen_info['subspace']
+        if subspace is None: subspace=zeros([v.shape[0],0],dtype=v.dtype)
         if bm_tot is not None:
             indices=pm_tot[bm_tot.get_slice(target_block,uselabel=True)]
             vl=zeros([bm_tot.N,v.shape[1]],dtype=v.dtype)
             vl[indices]=v; vl=vl.T
+            vs=zeros([bm_tot.N,subspace.shape[1]],dtype=subspace.dtype)
+            vs[indices]=subspace; vs=vs.T
         else:
             vl=v.T
+            vs=subspace.T
+        self._subspace=[phi.reshape([ndiml0,hndim,ndimr0,hndim]) for phi in vs]
 
         #Do-wavefunction analysis, preliminary truncation is performed(up to ZERO_REF).
         for v in vl:
@@ -577,16 +1348,245 @@ class DMRGEngine(object):
         #spec1,U1,kpmask1,trunc_error=self.rdm_analysis(phis=vl,bml=bml,bmr=bmr,side='l',maxN=maxN)
         U1,specs,U2,(kpmask1,kpmask2),trunc_error=self.svd_analysis(phis=vl,bml=HL0.shape[0] if bml is None else bml,\
                 bmr=HR0.shape[0] if bmr is None else bmr,pml=pml,pmr=pmr,maxN=maxN)
-        print '%s states kept.'%sum(kpmask1)
+        record.update(bond_dim=sum(kpmask1),trunc_error=trunc_error)
+        if self.telemetry.wants('entropy'):
+            spec=specs[0][specs[0]>ZERO_REF]
+            spec=spec/sum(spec)
+            record.entropy=-sum(spec*log(spec))
         hgen_l.trunc(U=U1,kpmask=kpmask1)  #kpmask is also important for setting up the sign
+        mark_truncated(hgen_l)
         if hgen_l is not hgen_r:
             #spec2,U2,kpmask2,trunc_error=self.rdm_analysis(phis=vl,bml=bml,bmr=bmr,side='r',maxN=maxN)
             hgen_r.trunc(U=U2,kpmask=kpmask2)
+            mark_truncated(hgen_r)
+        phil=[phi.reshape([ndiml0,hndim,ndimr0,hndim]) for phi in vl]
+        t3=time.time()
+        record.timings={'hamiltonian':t1-t0,'eigen':t2-t1,'trunc':t3-t2}
+        record.peak_rss={'hamiltonian':rss_h,'eigen':rss_eigen,'trunc':_peak_rss()}
+        if self.iprint>1: print 'Operator cache -> %s'%OP_CACHE
+        return e,trunc_error,phil
+
+    def _dmrg_step_sectors(self,hgen_l,hgen_r,HL0,HR0,interop,blockinfo,target_blocks,maxN,initial_state,eigen_tol,precision,t0):
+        '''
+        The part of `dmrg_step` for multiple target blocks, after the blocks are expanded.
+
+        The hamiltonian of each target block is built from the same HL0, HR0 and block markers,
+        the lowest states of target blocks are solved concurrently in a thread pool,
+        and the truncation is done with the weighted mixture of their density matrices.
+
+        Return:
+            tuple of (energies of target blocks(1D array), truncation error(float), states of target blocks(list))
+        '''
+        record=self.step_record
+        hndim=hgen_l.hndim
+        ndiml0,ndimr0=hgen_l.ndim,hgen_r.ndim
+        bm_tot,pm_tot=_join_blockinfo(blockinfo,HR0.shape[0])
+        Hcs,indl,hbuilders=[],[],[]
+        memory_estimate=0
+        for target_block in target_blocks:
+            #the cached `bm_tot` and `pm` are shared by target blocks.
+            info=dict(blockinfo,target_block=target_block)
+            hbuilder=self.hbuilder
+            if hbuilder=='auto':
+                hbuilder=self._select_hbuilder(HL0,HR0,hgen_l,hgen_r,interop,info)
+            if self.memory_budget is not None:
+                hbuilder,maxN,mem=self._fit_memory_budget(HL0,HR0,interop,info,maxN=maxN,hndim=hndim,nlevel=1,hbuilder=hbuilder)
+                memory_estimate+=mem
+            if hbuilder=='matfree':
+                Hc=_gen_hamiltonian_matfree(HL0,HR0,hgen_l=hgen_l,hgen_r=hgen_r,interop=interop,blockinfo=info)[0]
+            elif hbuilder=='block0':
+                Hc=_gen_hamiltonian_block0(HL0,HR0,hgen_l=hgen_l,hgen_r=hgen_r,blockinfo=info,interop=interop,nworker=self.term_nworker)[0]
+            else:
+                Hc=_gen_hamiltonian_block(HL0,HR0,hgen_l=hgen_l,hgen_r=hgen_r,blockinfo=info,interop=interop,nworker=self.term_nworker)[0]
+            Hcs.append(Hc)
+            indl.append(pm_tot[bm_tot.get_slice(target_block,uselabel=True)])
+            hbuilders.append(hbuilder)
+        record.hbuilder=hbuilders[0] if len(set(hbuilders))==1 else ','.join(hbuilders)
+        if self.memory_budget is not None: record.memory_estimate=memory_estimate
+        rss_h=_peak_rss()
+
+        #the starting states, columns of predictions live in different target blocks.
+        if initial_state is None:
+            initial_state=random.random(bm_tot.N)
+        v00=initial_state if ndim(initial_state)==1 else initial_state.sum(axis=1)
+        tasks=[]
+        for Hc,indices in zip(Hcs,indl):
+            v0=v00[indices]
+            v0=None if norm(v0)==0 else v0/norm(v0)
+            Hc,v0=real_if_close(Hc,v0,tol=ZERO_REF)
+            if precision=='single':
+                Hc,v0=cast_precision(Hc,v0,precision)
+            tasks.append((Hc,v0))
+        record.precision='single' if all([Hc.dtype in (float32,complex64) for Hc,v0 in tasks]) else 'double'
+        record.update(ndim=sum([Hc.shape[0] for Hc,v0 in tasks]),nnz=sum([Hc.nnz for Hc,v0 in tasks]) if all([sps.issparse(Hc) for Hc,v0 in tasks]) else None)
+
+        def solve(task):
+            #a shallow copy keeps `eigen_info` of each thread apart.
+            engine=copy.copy(self)
+            e,v=engine._eigsh(task[0],task[1],k=1,tol=eigen_tol)
+            return e,v,engine.eigen_info
+        t1=time.time()
+        results=_thread_map(solve,tasks,self.nworker or len(tasks))
+        infos=[info for e,v,info in results]
+        self.eigen_info={'solver':infos[0]['solver'],'niter':sum([info['niter'] or 0 for info in infos]),
+                'nmatvec':sum([info['nmatvec'] or 0 for info in infos]),'subspace':None}
+        record.update(niter=self.eigen_info['niter'],nmatvec=self.eigen_info['nmatvec'])
+        t2=time.time()
+        rss_eigen=_peak_rss()
+
+        #permute back states into original representation al,sl+1,sl+2,al+2
+        E,vl=[],[]
+        for (e,v,info),indices in zip(results,indl):
+            phi=zeros(bm_tot.N,dtype=v.dtype)
+            phi[indices]=v[:,0]
+            phi[abs(phi)<ZERO_REF]=0
+            E.append(e[0])
+            vl.append(phi)
+        self._subspace=[]
+        U1,specs,U2,(kpmask1,kpmask2),trunc_error=self.mixed_rdm_analysis(phis=vl,weights=self.sector_weights,
+                bml=blockinfo['bml'],bmr=blockinfo['bmr'],pml=blockinfo['pml'],pmr=blockinfo['pmr'],maxN=maxN)
+        record.update(bond_dim=sum(kpmask1),trunc_error=trunc_error)
+        if self.telemetry.wants('entropy'):
+            spec=specs[0][specs[0]>ZERO_REF]
+            spec=spec/sum(spec)
+            record.entropy=-sum(spec*log(spec))
+        hgen_l.trunc(U=U1,kpmask=kpmask1)
+        mark_truncated(hgen_l)
+        if hgen_l is not hgen_r:
+            hgen_r.trunc(U=U2,kpmask=kpmask2)
+            mark_truncated(hgen_r)
         phil=[phi.reshape([ndiml0,hndim,ndimr0,hndim]) for phi in vl]
         t3=time.time()
-        print 'Elapse -> prepair:%.2f, eigen:%.2f, trunc: %.2f'%(t1-t0,t2-t1,t3-t2)
+        record.timings={'hamiltonian':t1-t0,'eigen':t2-t1,'trunc':t3-t2}
+        record.peak_rss={'hamiltonian':rss_h,'eigen':rss_eigen,'trunc':_peak_rss()}
+        return array(E),trunc_error,phil
+
+    def _dmrg_step_1site(self,hgen_l,hgen_r,HL0,HR0,interop,blockinfo,maxN,initial_state,eigen_tol,precision,alpha,t0):
+        '''
+        The part of `dmrg_step` for a single-site step, after the blocks are expanded.
+
+        The state is solved in the basis of the left expanded block and the kept right states(the right expanded block
+        projected to the support of `initial_state`), which is smaller than the two-site basis by a factor of hndim.
+        The truncation uses the density matrix perturbation(S. R. White, PRB 72, 180403, 2005),
+        interop terms applied to the state are mixed into the density matrix with weight `alpha`, so that bonds can grow.
+        For fermionic models, the kept right states have definite parity,
+        so that the Z-string of the right link in projected interop terms stays diagonal.
+
+        Return:
+            tuple of (energies(1D array), truncation error(float), states in two-site basis(list))
+        '''
+        record=self.step_record
+        record.hbuilder='1site'
+        hndim=hgen_l.hndim
+        ndiml0,ndimr0=hgen_l.ndim,hgen_r.ndim
+        bml,bmr,pml,pmr=blockinfo['bml'],blockinfo['bmr'],blockinfo['pml'],blockinfo['pmr']
+        ndiml,ndimr=bml.N,bmr.N
+
+        #the kept right states, the eigen states of right density matrix of the predicted state, in block order.
+        phi0=(initial_state if ndim(initial_state)==1 else initial_state[:,0]).reshape([ndiml,ndimr])
+        phi0_=sps.csr_matrix(phi0[pml][:,pmr])
+        rho_r=phi0_.T.conj().dot(phi0_).tocoo()
+        if hgen_r.use_zstring:  #cope with the sign problem, drop the mixing of parities.
+            n1=(1-Z4scfg(hgen_r.spaceconfig).diagonal())/2
+            nr=(1-hgen_r.zstring(hgen_r.N-1).diagonal())/2
+            parity=int32((nr[:,newaxis]+n1).ravel()%2)[pmr]
+            kept=parity[rho_r.row]==parity[rho_r.col]
+            rho_r=sps.coo_matrix((rho_r.data[kept],(rho_r.row[kept],rho_r.col[kept])),shape=rho_r.shape)
+        spec_r,V=eigbh(rho_r.tocsr(),bm=bmr)
+        kpmask_r=asarray(spec_r).real>ZERO_REF
+        V=sps.csr_matrix(V)[argsort(pmr)].tocsc()[:,kpmask_r].tocsr()
+        Vh=V.T.conj().tocsr()
+        bmr1=trunc_bm(bmr,kpmask_r)
+        info=dict(bml=bml,bmr=bmr1,pml=pml,pmr=arange(bmr1.N),bmg=self.bmg,target_block=blockinfo['target_block'])
+
+        #project the right expanded block.
+        sb=SuperBlock(hgen_l,hgen_r)
+        pairs=[sb.get_op_pair(op) for op in interop]
+        HR1=Vh.dot(sps.csr_matrix(HR0)).dot(V)
+        pairs1=[(mA,Vh.dot(sps.csr_matrix(mB)).dot(V)) for mA,mB in pairs]
+        Hc,bm_tot,pm_tot=_gen_hamiltonian_pairs(HL0,HR1,pairs1,info,nworker=self.term_nworker)
+        rss_h=_peak_rss()
+        indices=pm_tot[bm_tot.get_slice(info['target_block'],uselabel=True)]
+        v0=asarray(Vh.dot(phi0.T)).T.ravel()[indices]
+        v0=None if norm(v0)==0 else v0/norm(v0)
+        Hc,v0=real_if_close(Hc,v0,tol=ZERO_REF)
+        if precision=='single':
+            Hc,v0=cast_precision(Hc,v0,precision)
+        record.precision='single' if Hc.dtype in (float32,complex64) else 'double'
+        record.update(ndim=Hc.shape[0],nnz=Hc.nnz)
+
+        t1=time.time()
+        e,v=self._eigsh(Hc,v0,k=1,tol=eigen_tol)
+        record.update(niter=self.eigen_info['niter'],nmatvec=self.eigen_info['nmatvec'])
+        t2=time.time()
+        rss_eigen=_peak_rss()
+
+        #back to the two-site basis al,sl+1,sl+2,al+2
+        psi=zeros(ndiml*bmr1.N,dtype=v.dtype)
+        psi[indices]=v[:,0]
+        phi=asarray(V.dot(psi.reshape([ndiml,bmr1.N]).T)).T
+        phi[abs(phi)<ZERO_REF]=0
+        self._subspace=[]
+        phis,weights=[phi],[1.]
+        if alpha>0:
+            perts=[asarray(mB.dot(asarray(mA.dot(phi)).T)).T for mA,mB in pairs]
+            perts=[pert for pert in perts if norm(pert)>ZERO_REF]
+            phis.extend(perts)
+            weights.extend([alpha/len(perts)]*len(perts))
+        U1,specs,U2,(kpmask1,kpmask2),trunc_error=self.mixed_rdm_analysis(phis=phis,weights=weights,
+                bml=bml,bmr=bmr,pml=pml,pmr=pmr,maxN=maxN)
+        record.update(bond_dim=sum(kpmask1),trunc_error=trunc_error)
+        if self.telemetry.wants('entropy'):
+            spec=specs[0][specs[0]>ZERO_REF]
+            spec=spec/sum(spec)
+            record.entropy=-sum(spec*log(spec))
+        hgen_l.trunc(U=U1,kpmask=kpmask1)
+        mark_truncated(hgen_l)
+        hgen_r.trunc(U=U2,kpmask=kpmask2)
+        mark_truncated(hgen_r)
+        phil=[phi.reshape([ndiml0,hndim,ndimr0,hndim])]
+        t3=time.time()
+        record.timings={'hamiltonian':t1-t0,'eigen':t2-t1,'trunc':t3-t2}
+        record.peak_rss={'hamiltonian':rss_h,'eigen':rss_eigen,'trunc':_peak_rss()}
         return e,trunc_error,phil
 
+    def mixed_rdm_analysis(self,phis,weights,bml,bmr,pml,pmr,maxN):
+        '''
+        The analysis of the weighted mixture of reduced density matrices, for states in different target blocks.
+
+        Parameters:
+            :phis: list of 1D array, the states.
+            :weights: 1D array/None, the weights of states, None for equal weights.
+            :bml/bmr: <BlockMarker>, the block marker for left and right blocks.
+            :pml/pmr: 1D array, the permutation of left and right blocks.
+            :maxN: int, the maximum kept values, the discarded weight is also limited by `self.tol`.
+
+        Return:
+            tuple of (U, (spec_l, spec_r), U2, (kpmask_l, kpmask_r), truncation error), the same as `svd_analysis`.
+        '''
+        ndiml,ndimr=bml.N,bmr.N
+        if weights is None:
+            weights=ones(len(phis))
+        weights=asarray(weights,dtype='float64')/sum(weights)
+        rho_l,rho_r=0,0
+        for w,phi in zip(weights,phis):
+            phi=phi.reshape([ndiml,ndimr])/norm(phi)
+            phi=sps.csr_matrix(phi[pml][:,pmr])
+            rho_l=rho_l+w*phi.dot(phi.T.conj())
+            #the conjugate convention of `svd_analysis`, where U2 = V^dagger for phi = U*S*V.
+            rho_r=rho_r+w*phi.T.conj().dot(phi)
+        spec_l,U=eigbh(rho_l,bm=bml)
+        spec_r,V=eigbh(rho_r,bm=bmr)
+        U,U2=sps.csr_matrix(U)[argsort(pml)],sps.csr_matrix(V)[argsort(pmr)]
+        spec_l,spec_r=asarray(spec_l).real,asarray(spec_r).real
+        kpmasks=[]
+        for spec in [spec_l,spec_r]:
+            kpmask=_get_kpmask(spec,maxN,self.tol)
+            trunc_error=sum(spec[~kpmask])
+            kpmasks.append(kpmask)
+        U,U2=_eliminate_zeros(U,ZERO_REF),_eliminate_zeros(U2,ZERO_REF)
+        return U,(spec_l,spec_r),U2,kpmasks,trunc_error
+
     def svd_analysis(self,phis,bml,bmr,pml,pmr,maxN):
         '''
         The direct analysis of state(svd).
@@ -594,7 +1594,7 @@ class DMRGEngine(object):
         Parameters:
             :phis: list of 1D array, the kept eigen states of current iteration.
             :bml/bmr: <BlockMarker>/int, the block marker for left and right blocks/or the dimensions.
-            :maxN: int, the maximum kept values.
+            :maxN: int, the maximum kept values, the discarded weight is also limited by `self.tol`.
 
         Return:
             tuple of (spec, U), the spectrum and Unitary matrix from the density matrix.
@@ -613,6 +1613,28 @@ class DMRGEngine(object):
             def mapping_rule(bli):
                 res=self.bmg.bcast_sub([self.target_block],[bli])[0]
                 return tuple(res)
+        if self.svd_backend!='full':
+            if use_bm:
+                blocks=[]
+                for i in xrange(bml.nblock):
+                    j=bmr.index_bl(mapping_rule(bml.labels[i]))
+                    if j is not None:
+                        blocks.append((bml.get_slice(i),bmr.get_slice(j)))
+            else:
+                blocks=[(slice(0,ndiml),slice(0,ndimr))]
+            U,spec_l,U2,spec_r=self._svd_blocks(phi,blocks,maxN)
+            if use_bm:
+                U,U2=U[argsort(pml)],U2[argsort(pmr)]
+            #the discarded weight is counted from the norm, since the randomized svd gives a partial spectrum.
+            weight=norm(phi)**2
+            kpmasks=[]
+            for spec in [spec_l,spec_r]:
+                kpmask=_get_kpmask(spec,maxN,self.tol)
+                trunc_error=max(weight-sum(spec[kpmask]),0.)
+                kpmasks.append(kpmask)
+            U,U2=_eliminate_zeros(U,ZERO_REF),_eliminate_zeros(U2,ZERO_REF)
+            return U,(spec_l,spec_r),U2,kpmasks,trunc_error
+        if use_bm:
             U,S,V,S2=svdb(phi,bm=bml,bm2=bmr,mapping_rule=mapping_rule,full_matrices=True)
         else:
             U,S,V=svd(phi,full_matrices=True);U2=V.T.conj()
@@ -637,15 +1659,50 @@ class DMRGEngine(object):
             U2=V.T.conj()
         kpmasks=[]
         for Ui,spec in zip([U,U2],[spec_l,spec_r]):
-            kpmask=zeros(Ui.shape[1],dtype='bool')
-            spec_cut=sort(spec)[max(0,Ui.shape[0]-maxN)]
-            kpmask[(spec>=spec_cut)&(spec>ZERO_REF)]=True
+            kpmask=_get_kpmask(spec,maxN,self.tol)
             trunc_error=sum(spec[~kpmask])
             kpmasks.append(kpmask)
         U,U2=_eliminate_zeros(U,ZERO_REF),_eliminate_zeros(U2,ZERO_REF)
 
         return U,(spec_l,spec_r),U2,kpmasks,trunc_error
 
+    def _svd_blocks(self,phi,blocks,maxN):
+        '''
+        The thin(or randomized) svd of blocks, decomposed by `svd_nworker` threads.
+
+        Parameters:
+            :phi: 2D array, the wave function, with rows and columns in block order.
+            :blocks: list of tuple, the (row, column) slices of non-zero blocks, rows and columns of blocks do not overlap.
+            :maxN: int, the maximum kept values.
+
+        Return:
+            tuple of (U, spec_l, U2, spec_r), U and U2 are square <csr_matrix>s with singular vectors in the columns of their blocks,
+            and zero columns for the rest(with zero spectrum).
+        '''
+        ndiml,ndimr=phi.shape
+        def decompose(block):
+            sl,sr=block
+            A=phi[sl,sr]
+            if A.size==0:
+                return zeros([A.shape[0],0]),zeros(0),zeros([0,A.shape[1]])
+            if self.svd_backend=='randomized' and min(A.shape)>=RSVD_RATIO*maxN:
+                return _randomized_svd(A,maxN)
+            return svd(A,full_matrices=False)
+        res=_thread_map(decompose,blocks,self.svd_nworker)
+        spec_l,spec_r=zeros(ndiml),zeros(ndimr)
+        rows,cols,datas=[[],[]],[[],[]],[[],[]]
+        for (sl,sr),(Ui,Si,Vi) in zip(blocks,res):
+            k=len(Si)
+            spec_l[sl.start:sl.start+k]=spec_r[sr.start:sr.start+k]=Si**2
+            #the columns of U2 are right singular vectors, as V^dagger in `svd_analysis`.
+            for side,(s,X) in enumerate([(sl,Ui),(sr,Vi.T.conj())]):
+                rows[side].append(repeat(arange(s.start,s.stop),k))
+                cols[side].append(tile(arange(s.start,s.start+k),X.shape[0]))
+                datas[side].append(X.ravel())
+        U,U2=[sps.csr_matrix((concatenate(datas[side]),(concatenate(rows[side]),concatenate(cols[side]))),shape=(n,n))\
+                for side,n in enumerate([ndiml,ndimr])]
+        return U,spec_l,U2,spec_r
+
     def rdm_analysis(self,phis,bml,bmr,side,maxN):
         '''
         The analysis of reduced density matrix.
@@ -654,7 +1711,7 @@ class DMRGEngine(object):
             :phis: list of 1D array, the kept eigen states of current iteration.
             :bml/bmr: <BlockMarker>/int, the block marker for left and right blocks/or the dimensions.
             :side: 'l'/'r', view the left or right side as the system.
-            :maxN: the maximum kept values.
+            :maxN: the maximum kept values, the discarded weight is also limited by `self.tol`.
 
         Return:
             tuple of (spec, U), the spectrum and Unitary matrix from the density matrix.
@@ -687,11 +1744,9 @@ class DMRGEngine(object):
         1. make sure your are using additive good quantum numbers.
         2. avoid ground state degeneracy.''')
         spec,U=eigbh(rho,bm=bm)
-        kpmask=zeros(U.shape[1],dtype='bool')
-        spec_cut=sort(spec)[max(0,U.shape[0]-maxN)]
-        kpmask[(spec>=spec_cut)&(spec>ZERO_REF)]=True
+        kpmask=_get_kpmask(spec,maxN,self.tol)
         trunc_error=sum(spec[~kpmask])
-        print 'With %s(%s) blocks.'%(bm.nblock,bm.nblock)
+        if self.iprint>1: print 'With %s(%s) blocks.'%(bm.nblock,bm.nblock)
         return spec,U,kpmask,trunc_error
 
     def state_prediction(self,phi,l,direction):
@@ -741,6 +1796,58 @@ class DMRGEngine(object):
                 phi=phi*(1-2*(n_tot%2))
         return phi
 
+    def idmrg_prediction(self,hgen,phil,lam_pre=None):
+        '''
+        Predict the state for the next iteration of infinite DMRG.
+
+        With phi = U*L = R*U^T(the right block is the image of the left block),
+        the new state is L*inv(lam_pre)*R, where the old right site becomes the new left site and vice versa,
+        lam_pre is the singular values of the last iteration, padded with zeros(or trimmed) if the bond has changed.
+
+        Parameters:
+            :hgen: <ExpandGenerator>, the hamiltonian generator truncated in this iteration.
+            :phil: list of ndarray, the states of this iteration, [llink, site1, rlink, site2].
+            :lam_pre: 1D array/None, the singular values of the last iteration, None for no prediction.
+
+        Return:
+            tuple of (prediction(2D array, columns for levels)/None, singular values of this iteration(1D array)).
+
+            reference -> arXiv:0804.2509
+        '''
+        A=hgen.evolutor.A(hgen.N-1,dense=True)   #get A[sNL](NL-1,NL)
+        hndim,nc,na=A.shape
+        U=A.transpose([1,0,2]).reshape([nc*hndim,na])
+        #only the kept states of a masked evolutor span the next block.
+        kpmask=hgen.evolutor.kpmask(hgen.N-1) if na!=hgen.ndim else ones(na,dtype='bool')
+        U=U[:,kpmask]
+        na=U.shape[1]
+        phis=[phi.reshape([nc*hndim,nc*hndim]) for phi in phil]
+        lam=norm(U.T.conj().dot(phis[0]),axis=1)
+        if lam_pre is None:
+            return None,lam
+        #the pseudo inverse of the last singular values, vanishing ones come from masked states or a grown bond.
+        lam_pre=concatenate([lam_pre[:nc],zeros(max(nc-len(lam_pre),0))])
+        lam_inv=zeros(nc)
+        lam_inv[lam_pre>ZERO_REF]=1./lam_pre[lam_pre>ZERO_REF]
+        if hgen.use_zstring:  #cope with the sign problem
+            #the new left site moves over the old right link, the new right site moves over the new right link.
+            n1=(1-Z4scfg(hgen.spaceconfig).diagonal())/2
+            nc_=(1-hgen.zstring(hgen.N-1).diagonal())/2
+            na_=((1-hgen.zstring(hgen.N).diagonal())/2)[kpmask]
+            sgn_l=1-2*((nc_[:,newaxis]*n1)%2)
+            sgn_r=1-2*((na_[:,newaxis]*n1)%2)
+        initial_state=[]
+        for phi in phis:
+            L=U.T.conj().dot(phi).reshape([na,nc,hndim])
+            R=phi.dot(U.conj()).reshape([nc,hndim,na])
+            if hgen.use_zstring:
+                L=L*sgn_l
+                psi=einsum('acs,c,ctb->asbt',L,lam_inv,R)*sgn_r
+            else:
+                psi=einsum('acs,c,ctb->asbt',L,lam_inv,R)
+            initial_state.append(psi.ravel())
+        return array(initial_state).T,lam
+
     def _state_prediction_hard(self,phi):
         '''
         The hardest prediction for reflection point for phi(al,sl+1,sl+2,al+2) -> phi(al-1,sl,sl+1,al+1')
@@ -0,0 +1,182 @@
+'''
+Block Davidson eigensolver for the lowest few eigen pairs of hermitian matrices, and helpers of eigensolvers.
+'''
+
+from numpy import *
+from numpy.linalg import norm
+from scipy.linalg import eigh,qr
+import scipy.sparse as sps
+import warnings,pdb
+
+from scheduler import PRECISIONS
+
+__all__=['block_davidson','real_if_close','cast_precision']
+
+def real_if_close(H,v0=None,tol=1e-12):
+    '''
+    Drop the imaginary part of a hermitian matrix if it vanishes(e.g. Sx*Sx+Sy*Sy), so that the eigensolver works in real arithmetic.
+
+    Parameters:
+        :H: matrix, the hermitian matrix, other operators are converted by their `to_real` method(e.g. <SuperBlockOperator>),
+            or left unchanged if they do not have one.
+        :v0: 1D/2D array/None, the starting vector(s), the larger one of its real and imaginary parts is used if H becomes real.
+        :tol: float, the tolerance of imaginary parts.
+
+    Return:
+        tuple of (H, v0).
+    '''
+    if not iscomplexobj(H):
+        return H,v0
+    if sps.issparse(H) or isinstance(H,ndarray):
+        data=H.data if sps.issparse(H) else H
+        if data.size!=0 and abs(data.imag).max()>=tol:
+            return H,v0
+        H=H.real
+    elif hasattr(H,'to_real'):
+        H_real=H.to_real(tol)
+        if H_real is None:
+            return H,v0
+        H=H_real
+    else:
+        return H,v0
+    if v0 is not None and iscomplexobj(v0):
+        v0=v0.real if norm(v0.real)>=norm(v0.imag) else v0.imag
+    return H,v0
+
+def cast_precision(H,v0=None,precision='double'):
+    '''
+    Cast a matrix and the starting vector(s) to the given precision.
+
+    Parameters:
+        :H: matrix, the matrix, other operators are cast by their `astype` method(e.g. <SuperBlockOperator>),
+            or left unchanged if they do not have one.
+        :v0: 1D/2D array/None, the starting vector(s).
+        :precision: str, 'single'(float32/complex64) or 'double'(float64/complex128).
+
+    Return:
+        tuple of (H, v0).
+    '''
+    rtype,ctype=PRECISIONS[precision]
+    if not hasattr(H,'astype'):
+        return H,v0
+    H=H.astype(ctype if issubdtype(H.dtype,complexfloating) else rtype)
+    if v0 is not None:
+        v0=asarray(v0).astype(ctype if iscomplexobj(v0) else rtype)
+    return H,v0
+
+def _orthonormalize(V,Q=None,zero_ref=1e-8):
+    '''
+    Orthonormalize columns of V against the orthonormal columns of Q and among themselves,
+    linearly dependent columns are dropped.
+
+    Parameters:
+        :V: 2D array, the vectors.
+        :Q: 2D array/None, the orthonormal basis.
+        :zero_ref: float, columns with relative norm smaller than it are dropped.
+
+    Return:
+        2D array, the orthonormalized vectors.
+    '''
+    nrm0=norm(V,axis=0)
+    nrm0[nrm0==0]=1
+    V=V/nrm0
+    for i in xrange(2):   #twice is enough.
+        if Q is not None and Q.shape[1]>0:
+            V=V-Q.dot(Q.T.conj().dot(V))
+    V,R=qr(V,mode='economic')
+    mask=abs(R.diagonal())>zero_ref
+    return V[:,mask]
+
+def block_davidson(A,v0=None,k=1,tol=1e-10,maxiter=500,max_subspace=None,precon=None,iprint=0,nextra=0,return_info=False):
+    '''
+    Block Davidson method for the lowest `k` eigen pairs of a hermitian matrix, converged pairs are locked.
+
+    Parameters:
+        :A: matrix/<LinearOperator>, the hermitian matrix, `A.dot` is applied on a block of vectors at a time.
+        :v0: 1D/2D array/None, the starting vector(s), columns of 2D array are used as the starting block,
+            which is padded with random vectors if less than `k`, extra columns enlarge the starting search space.
+        :k: int, the number of desired eigen pairs.
+        :tol: float, the tolerence of residual norm(relative to the eigenvalue if its magnitude is larger than 1).
+        :maxiter: int, the maximum number of iterations.
+        :max_subspace: int/None, the maximum dimension of search space, default is max(4*k,k+20).
+        :precon: 1D array/None, the diagonal part of `A` used in the preconditioner, default is taken from `A.diagonal()` if exists.
+        :iprint: int, the redundency level of output information.
+        :nextra: int, the number of extra(unconverged) Ritz vectors above the `k` levels to return, which can be used to restart the next solve.
+        :return_info: bool, return the information of iteration if True.
+
+    Return:
+        tuple of (e, v), eigenvalues(1D array) and eigenvectors(columns of 2D array),
+        (e, v, info) if `return_info`, info is a dict with keys 'niter', 'nmatvec' and 'subspace'(the extra Ritz vectors).
+    '''
+    N=A.shape[0]
+    k=min(k,N)
+    if max_subspace is None: max_subspace=max(4*k,k+20)
+    max_subspace=min(max_subspace,N)
+    if precon is None and hasattr(A,'diagonal'):
+        precon=asarray(A.diagonal())
+    #single precision operators stay in single precision.
+    dtype=result_type(A.dtype,float32) if v0 is None else result_type(A.dtype,v0.dtype,float32)
+
+    #the starting block.
+    if v0 is None:
+        V=zeros([N,0],dtype=dtype)
+    else:
+        V=asarray(v0,dtype=dtype).reshape([N,-1])
+    if V.shape[1]<k:
+        V=concatenate([V,(random.random([N,k-V.shape[1]])-0.5).astype(dtype)],axis=1)
+    V=_orthonormalize(V)
+    AV=A.dot(V)
+    nmatvec=V.shape[1]
+
+    X=zeros([N,0],dtype=dtype)   #locked vectors.
+    EX=zeros(0)
+    for niter in xrange(maxiter):
+        nwant=k-X.shape[1]
+        #Rayleigh-Ritz
+        T=V.T.conj().dot(AV)
+        theta,S=eigh((T+T.T.conj())/2.)
+        Y,AY=V.dot(S),AV.dot(S)
+        R=AY[:,:nwant]-Y[:,:nwant]*theta[:nwant]
+        rnorm=norm(R,axis=0)
+        conv=rnorm<tol*maximum(1,abs(theta[:nwant]))
+        #lock converged pairs from the bottom.
+        nconv=nwant if all(conv) else argmin(conv)
+        if iprint>0:
+            print 'Block Davidson iter %s, search space %s, locked %s, residuals %s'%(niter,V.shape[1],X.shape[1]+nconv,rnorm)
+        if nconv>0:
+            X=concatenate([X,Y[:,:nconv]],axis=1)
+            EX=append(EX,theta[:nconv])
+            if nconv==nwant:
+                Y=Y[:,nconv:]
+                break
+            nwant-=nconv
+            theta,Y,AY,R=theta[nconv:],Y[:,nconv:],AY[:,nconv:],R[:,nconv:]
+        #restart
+        nkeep=Y.shape[1] if Y.shape[1]+nwant<=max_subspace else max(2*nwant,max_subspace/2)
+        V,AV=Y[:,:nkeep],AY[:,:nkeep]
+        #correction vectors with diagonal preconditioner.
+        T=R[:,:nwant]
+        if precon is not None:
+            denorm=theta[:nwant]-precon[:,newaxis]
+            denorm[abs(denorm)<1e-8]=1e-8
+            T=T/denorm
+        T=_orthonormalize(T,concatenate([X,V],axis=1))
+        if T.shape[1]==0:
+            #stagnation, expand with random vectors.
+            T=_orthonormalize(random.random([N,nwant])-0.5,concatenate([X,V],axis=1))
+            if T.shape[1]==0:
+                break
+        V=concatenate([V,T],axis=1)
+        AV=concatenate([AV,A.dot(T)],axis=1)
+        nmatvec+=T.shape[1]
+    else:
+        warnings.warn('Block Davidson does not converge in %s iterations, %s pairs converged.'%(maxiter,X.shape[1]))
+    if X.shape[1]<k:
+        nmore=k-X.shape[1]
+        X=concatenate([X,Y[:,:nmore]],axis=1)
+        EX=append(EX,theta[:nmore])
+        Y=Y[:,nmore:]
+    order=argsort(EX)
+    if return_info:
+        return EX[order],X[:,order],{'niter':niter+1,'nmatvec':nmatvec,'subspace':Y[:,:nextra]}
+    return EX[order],X[:,order]
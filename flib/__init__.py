@@ -0,0 +1,109 @@
+'''
+Fortran kernels for sub-block extraction.
+
+The kernels exported here choose the real*8(`_real` suffix in `flib.flib`) or complex*16 version
+according to the data type of inputs, so that real hamiltonians stay real.
+
+The backend is the OpenMP threaded build(`flibomp`) if it is available, then the serial build(`flib`),
+and the vectorized numpy version(`pyflib`) if neither is compiled.
+The environment variable `FLIB_BACKEND`('flibomp', 'flib' or 'numpy') or `set_backend` forces a backend,
+the number of threads is controlled by `set_num_threads` or the environment variable `FLIB_NUM_THREADS`.
+'''
+
+from numpy import iscomplexobj
+import os,warnings
+
+__all__=['fget_subblock2a','fget_subblock2b','fget_subblock1','fget_subblock_dmrg',
+        'fcount_subblock_dmrg_csr','fget_subblock_dmrg_csr','set_num_threads','get_num_threads','set_backend','BACKEND','THREADED']
+
+BACKENDS=['flibomp','flib','numpy']
+
+def _load_backend(name):
+    '''Import the module of a backend.'''
+    if name=='flibomp':
+        from . import flibomp as module
+    elif name=='flib':
+        from . import flib as module
+    elif name=='numpy':
+        from . import pyflib as module
+    else:
+        raise ValueError('Backend should be one of %s, got %s.'%(BACKENDS,name))
+    return module
+
+if os.environ.get('FLIB_BACKEND'):
+    BACKEND=os.environ['FLIB_BACKEND']
+    _flib=_load_backend(BACKEND)
+else:
+    for BACKEND in BACKENDS:
+        try:
+            _flib=_load_backend(BACKEND)
+            break
+        except ImportError:
+            pass
+    if BACKEND=='numpy':
+        warnings.warn('The compiled flib is not available, use the numpy backend.')
+
+#True if the kernels are the OpenMP threaded build.
+THREADED=BACKEND=='flibomp'
+
+def set_backend(name):
+    '''
+    Switch the backend of sub-block kernels.
+
+    Parameters:
+        :name: str, one of 'flibomp', 'flib' and 'numpy'.
+    '''
+    global _flib,BACKEND,THREADED
+    _flib=_load_backend(name)
+    BACKEND=name
+    THREADED=name=='flibomp'
+
+def set_num_threads(n):
+    '''Set the number of threads of sub-block kernels, it does nothing in the serial build.'''
+    _flib.fset_num_threads(n)
+
+def get_num_threads():
+    '''Get the number of threads of sub-block kernels, 1 in the serial build.'''
+    return int(_flib.fget_num_threads())
+
+if os.environ.get('FLIB_NUM_THREADS'):
+    set_num_threads(int(os.environ['FLIB_NUM_THREADS']))
+
+def _is_real(*arrays):
+    '''True if none of the arrays is complex.'''
+    return not any([iscomplexobj(a) for a in arrays])
+
+def fget_subblock2a(fl,o1,o2,fr,indices):
+    '''Sub-block of the 2-site VMPS hamiltonian, contracted per element.'''
+    if _is_real(fl,o1,o2,fr):
+        return _flib.fget_subblock2a_real(fl,o1,o2,fr,indices)
+    return _flib.fget_subblock2a(fl,o1,o2,fr,indices)
+
+def fget_subblock2b(fl,o1,o2,fr,indices):
+    '''Sub-block of the 2-site VMPS hamiltonian, contracted per column.'''
+    if _is_real(fl,o1,o2,fr):
+        return _flib.fget_subblock2b_real(fl,o1,o2,fr,indices)
+    return _flib.fget_subblock2b(fl,o1,o2,fr,indices)
+
+def fget_subblock1(fl,o1,fr,indices):
+    '''Sub-block of the 1-site VMPS hamiltonian.'''
+    if _is_real(fl,o1,fr):
+        return _flib.fget_subblock1_real(fl,o1,fr,indices)
+    return _flib.fget_subblock1(fl,o1,fr,indices)
+
+def fget_subblock_dmrg(hl,hr,indices,is_identity):
+    '''Dense sub-block of kron(hl,hr).'''
+    if _is_real(hl,hr):
+        return _flib.fget_subblock_dmrg_real(hl,hr,indices,is_identity)
+    return _flib.fget_subblock_dmrg(hl,hr,indices,is_identity)
+
+def fcount_subblock_dmrg_csr(hl_indptr,hl_indices,hr_indptr,hr_indices,indices,lookup,is_identity):
+    '''Row pointer of the sparse sub-block of kron(hl,hr).'''
+    return _flib.fcount_subblock_dmrg_csr(hl_indptr=hl_indptr,hl_indices=hl_indices,hr_indptr=hr_indptr,hr_indices=hr_indices,
+            indices=indices,lookup=lookup,is_identity=is_identity)
+
+def fget_subblock_dmrg_csr(hl_indptr,hl_indices,hl_data,hr_indptr,hr_indices,hr_data,indices,lookup,indptr,is_identity,nnz):
+    '''Sparse sub-block of kron(hl,hr), with indptr from `fcount_subblock_dmrg_csr`.'''
+    func=_flib.fget_subblock_dmrg_csr_real if _is_real(hl_data,hr_data) else _flib.fget_subblock_dmrg_csr
+    return func(hl_indptr=hl_indptr,hl_indices=hl_indices,hl_data=hl_data,hr_indptr=hr_indptr,hr_indices=hr_indices,
+            hr_data=hr_data,indices=indices,lookup=lookup,indptr=indptr,is_identity=is_identity,nnz=nnz)
@@ -5,6 +5,10 @@
 !Data: Oct. 8. 2015
 !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
 
+!The column(row for csr) loops of sub-block kernels are parallelized with OpenMP when compiled with -fopenmp(the `flibomp` module),
+!each column is computed by a single thread in the same order, so results are identical to the serial build.
+!Small sub-blocks(ndim<64) are not worth the threading overhead and run serially.
+
 !Get the specific sub-block in 2-site vmps update
 !
 !Parameters
@@ -31,6 +35,8 @@ subroutine fget_subblock2a(fl,o1,o2,fr,indices,res,nl,nr,nhl,nhc,nhr,hndim,ndim)
     !f2py intent(out) :: res
 
     !prepair datas
+    !$omp parallel do if(ndim>=64) schedule(static) &
+    !$omp private(i,col_temp_fl,col_temp_o1,col_temp_o2,col_temp_fr,temp_fl,temp_o1,temp_o2,temp_fr,temp_c1,temp_c2)
     do j=1,ndim
         !cache datas
         col_temp_fl=fl(:,:,indices(j,1)+1)
@@ -66,6 +72,8 @@ subroutine fget_subblock2b(fl,o1,o2,fr,indices,res,nl,nr,nhl,nhc,nhr,hndim,ndim)
     !f2py intent(out) :: res
 
     !prepair datas
+    !$omp parallel do if(ndim>=64) schedule(static) &
+    !$omp private(i,cind,col_temp_fl,col_temp_o1,col_temp_o2,col_temp_fr,temp_center,temp_left,temp)
     do j=1,ndim
         !cache datas
         col_temp_fl=fl(:,:,indices(j,1)+1)
@@ -99,6 +107,8 @@ subroutine fget_subblock_dmrg(hl,hr,indices,ndim,nl,nr,is_identity,res)
     !f2py intent(out) :: res
 
     if(is_identity==0) then
+        !$omp parallel do if(ndim>=64) schedule(static) &
+        !$omp private(i,il,ir,jl,jr,temp_cl,temp_cr)
         do j=1,ndim
             jl=indices(j,1)+1
             jr=indices(j,2)+1
@@ -111,6 +121,8 @@ subroutine fget_subblock_dmrg(hl,hr,indices,ndim,nl,nr,is_identity,res)
             enddo
         enddo
     else if(is_identity==1) then
+        !$omp parallel do if(ndim>=64) schedule(static) &
+        !$omp private(i,il,ir,jl,jr,temp_cl,temp_cr)
         do j=1,ndim
             jl=indices(j,1)+1
             jr=indices(j,2)+1
@@ -124,6 +136,8 @@ subroutine fget_subblock_dmrg(hl,hr,indices,ndim,nl,nr,is_identity,res)
             enddo
         enddo
     else
+        !$omp parallel do if(ndim>=64) schedule(static) &
+        !$omp private(i,il,ir,jl,jr,temp_cl,temp_cr)
         do j=1,ndim
             jl=indices(j,1)+1
             jr=indices(j,2)+1
@@ -139,6 +153,125 @@ subroutine fget_subblock_dmrg(hl,hr,indices,ndim,nl,nr,is_identity,res)
     endif
 end subroutine fget_subblock_dmrg
 
+!Sparse version of fget_subblock_dmrg, both input and output are in csr format,
+!the cost is proportional to the number of non-zero elements.
+!
+!Parameters
+!-------------------------
+!hl_indptr,hl_indices,hr_indptr,hr_indices: 1d array.
+!    the csr structure of left and right operators.
+!indices: 2d array.
+!    the (left, right) indices of target sub-block.
+!lookup: 1d array.
+!    the position in target sub-block for each index of the (nl*nr) space, -1 if not in target.
+!is_identity: 0 -> no, 1 -> left, 2 -> right
+!
+!Return:
+!--------------------------
+!indptr: 1d array, the row pointer of result.
+subroutine fcount_subblock_dmrg_csr(hl_indptr,hl_indices,hr_indptr,hr_indices,indices,lookup,is_identity,indptr,&
+        ndim,nl,nr,nzl,nzr)
+    implicit none
+    integer,intent(in) :: ndim,nl,nr,nzl,nzr,is_identity
+    integer,intent(in) :: hl_indptr(nl+1),hl_indices(nzl),hr_indptr(nr+1),hr_indices(nzr),indices(ndim,2),lookup(nl*nr)
+    integer,intent(out) :: indptr(ndim+1)
+    integer :: i,il,ir,jl,jr,pl,pr,cnt
+    
+    !f2py intent(in) :: hl_indptr,hl_indices,hr_indptr,hr_indices,indices,lookup,is_identity,ndim,nl,nr,nzl,nzr
+    !f2py intent(out) :: indptr
+
+    !count the rows in parallel, then accumulate the counts serially.
+    indptr(1)=0
+    !$omp parallel do if(ndim>=64) schedule(static) private(i,il,ir,jl,jr,pl,pr,cnt)
+    do i=1,ndim
+        il=indices(i,1)+1
+        ir=indices(i,2)+1
+        cnt=0
+        if(is_identity==1) then
+            do pr=hr_indptr(ir)+1,hr_indptr(ir+1)
+                if(lookup((il-1)*nr+hr_indices(pr)+1)>=0) cnt=cnt+1
+            enddo
+        else if(is_identity==2) then
+            do pl=hl_indptr(il)+1,hl_indptr(il+1)
+                if(lookup(hl_indices(pl)*nr+ir)>=0) cnt=cnt+1
+            enddo
+        else
+            do pl=hl_indptr(il)+1,hl_indptr(il+1)
+                jl=hl_indices(pl)
+                do pr=hr_indptr(ir)+1,hr_indptr(ir+1)
+                    jr=hr_indices(pr)
+                    if(lookup(jl*nr+jr+1)>=0) cnt=cnt+1
+                enddo
+            enddo
+        endif
+        indptr(i+1)=cnt
+    enddo
+    do i=1,ndim
+        indptr(i+1)=indptr(i)+indptr(i+1)
+    enddo
+end subroutine fcount_subblock_dmrg_csr
+
+!Fill the data and column indices of sub-block, with indptr from fcount_subblock_dmrg_csr.
+!
+!Return:
+!--------------------------
+!data,colind: 1d array, the data and column indices of result.
+subroutine fget_subblock_dmrg_csr(hl_indptr,hl_indices,hl_data,hr_indptr,hr_indices,hr_data,indices,lookup,indptr,&
+        is_identity,data,colind,ndim,nl,nr,nzl,nzr,nnz)
+    implicit none
+    integer,intent(in) :: ndim,nl,nr,nzl,nzr,nnz,is_identity
+    integer,intent(in) :: hl_indptr(nl+1),hl_indices(nzl),hr_indptr(nr+1),hr_indices(nzr),indices(ndim,2),&
+        lookup(nl*nr),indptr(ndim+1)
+    complex*16,intent(in) :: hl_data(nzl),hr_data(nzr)
+    complex*16,intent(out) :: data(nnz)
+    integer,intent(out) :: colind(nnz)
+    integer :: i,j,k,il,ir,jl,jr,pl,pr
+    
+    !f2py intent(in) :: hl_indptr,hl_indices,hl_data,hr_indptr,hr_indices,hr_data,indices,lookup,indptr,is_identity
+    !f2py intent(in) :: ndim,nl,nr,nzl,nzr,nnz
+    !f2py intent(out) :: data,colind
+
+    !each row fills its own slice indptr(i)+1..indptr(i+1).
+    !$omp parallel do if(ndim>=64) schedule(static) private(i,j,k,il,ir,jl,jr,pl,pr)
+    do i=1,ndim
+        il=indices(i,1)+1
+        ir=indices(i,2)+1
+        k=indptr(i)
+        if(is_identity==1) then
+            do pr=hr_indptr(ir)+1,hr_indptr(ir+1)
+                j=lookup((il-1)*nr+hr_indices(pr)+1)
+                if(j>=0) then
+                    k=k+1
+                    colind(k)=j
+                    data(k)=hr_data(pr)
+                endif
+            enddo
+        else if(is_identity==2) then
+            do pl=hl_indptr(il)+1,hl_indptr(il+1)
+                j=lookup(hl_indices(pl)*nr+ir)
+                if(j>=0) then
+                    k=k+1
+                    colind(k)=j
+                    data(k)=hl_data(pl)
+                endif
+            enddo
+        else
+            do pl=hl_indptr(il)+1,hl_indptr(il+1)
+                jl=hl_indices(pl)
+                do pr=hr_indptr(ir)+1,hr_indptr(ir+1)
+                    jr=hr_indices(pr)
+                    j=lookup(jl*nr+jr+1)
+                    if(j>=0) then
+                        k=k+1
+                        colind(k)=j
+                        data(k)=hl_data(pl)*hr_data(pr)
+                    endif
+                enddo
+            enddo
+        endif
+    enddo
+end subroutine fget_subblock_dmrg_csr
+
 subroutine fget_subblock1(fl,o1,fr,indices,res,nl,nr,nhl,nhr,hndim,ndim)
     implicit none
     integer,intent(in) :: nl,nr,ndim,nhl,nhr,hndim
@@ -153,6 +286,8 @@ subroutine fget_subblock1(fl,o1,fr,indices,res,nl,nr,nhl,nhr,hndim,ndim)
     !f2py intent(out) :: res
 
     !prepair datas
+    !$omp parallel do if(ndim>=64) schedule(static) &
+    !$omp private(i,cind,col_temp_fl,col_temp_o1,col_temp_fr,temp_left,temp)
     do j=1,ndim
         !cache datas
         col_temp_fl=fl(:,:,indices(j,1)+1)
@@ -170,3 +305,245 @@ subroutine fget_subblock1(fl,o1,fr,indices,res,nl,nr,nhl,nhr,hndim,ndim)
     enddo
 end subroutine fget_subblock1
 
+
+!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+!real*8 variants of above kernels for real hamiltonians,
+!they are the same as the complex*16 ones except the data type.
+!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+
+subroutine fget_subblock2a_real(fl,o1,o2,fr,indices,res,nl,nr,nhl,nhc,nhr,hndim,ndim)
+    implicit none
+    integer,intent(in) :: nl,nr,ndim,nhl,nhr,nhc,hndim
+    integer,intent(in) :: indices(ndim,4)
+    real*8,intent(in) :: fl(nl,nhl,nl),fr(nr,nhr,nr),o1(nhl,hndim,hndim,nhc),o2(nhc,hndim,hndim,nhr)
+    real*8,intent(out) :: res(ndim,ndim)
+    integer :: i,j
+    real*8 :: col_temp_fl(nl,nhl),col_temp_fr(nr,nhr),col_temp_o1(nhl,hndim,nhc),col_temp_o2(nhc,hndim,nhr),&
+        temp_fl(nhl),temp_fr(nhr),temp_o1(nhl,nhc),temp_o2(nhc,nhr),temp_c1(1,nhc),temp_c2(1,nhr)
+    
+    !f2py intent(in) :: fl,o1,o2,fr,indices,nl,nr,nhl,nhc,nhr,hndim,ndim
+    !f2py intent(out) :: res
+
+    !prepair datas
+    !$omp parallel do if(ndim>=64) schedule(static) &
+    !$omp private(i,col_temp_fl,col_temp_o1,col_temp_o2,col_temp_fr,temp_fl,temp_o1,temp_o2,temp_fr,temp_c1,temp_c2)
+    do j=1,ndim
+        !cache datas
+        col_temp_fl=fl(:,:,indices(j,1)+1)
+        col_temp_o1=o1(:,:,indices(j,2)+1,:)
+        col_temp_o2=o2(:,:,indices(j,3)+1,:)
+        col_temp_fr=fr(:,:,indices(j,4)+1)
+        do i=1,ndim
+            !cache datas
+            temp_fl=col_temp_fl(indices(i,1)+1,:)
+            temp_o1=col_temp_o1(:,indices(i,2)+1,:)
+            temp_o2=col_temp_o2(:,indices(i,3)+1,:)
+            temp_fr=col_temp_fr(indices(i,4)+1,:)
+            !do the contraction
+            temp_c1=matmul(reshape(temp_fl,[1,nhl]),temp_o1)
+            temp_c2=matmul(temp_c1,temp_o2)
+            res(i,j)=sum(temp_c2(1,:)*temp_fr)
+        enddo
+    enddo
+end subroutine fget_subblock2a_real
+
+subroutine fget_subblock2b_real(fl,o1,o2,fr,indices,res,nl,nr,nhl,nhc,nhr,hndim,ndim)
+    implicit none
+    integer,intent(in) :: nl,nr,ndim,nhl,nhr,nhc,hndim
+    integer,intent(in) :: indices(ndim,4)
+    real*8,intent(in) :: fl(nl,nhl,nl),fr(nr,nhr,nr),o1(nhl,hndim,hndim,nhc),o2(nhc,hndim,hndim,nhr)
+    real*8,intent(out) :: res(ndim,ndim)
+    integer :: j,cind(4),i
+    real*8 :: col_temp_fl(nl,nhl),col_temp_fr(nr,nhr),col_temp_o1(nhl,hndim,nhc),col_temp_o2(nhc,hndim,nhr),&
+        temp_left(nl*hndim*hndim,nhr),temp_center(nhl*hndim,hndim*nhr),temp(nl,hndim,hndim,nr)
+    
+    !f2py intent(in) :: fl,o1,o2,fr,indices,nl,nr,nhl,nhc,nhr,hndim,ndim
+    !f2py intent(out) :: res
+
+    !prepair datas
+    !$omp parallel do if(ndim>=64) schedule(static) &
+    !$omp private(i,cind,col_temp_fl,col_temp_o1,col_temp_o2,col_temp_fr,temp_center,temp_left,temp)
+    do j=1,ndim
+        !cache datas
+        col_temp_fl=fl(:,:,indices(j,1)+1)
+        col_temp_o1=o1(:,:,indices(j,2)+1,:)
+        col_temp_o2=o2(:,:,indices(j,3)+1,:)
+        col_temp_fr=fr(:,:,indices(j,4)+1)
+
+        !first, contract center blocks.
+        temp_center=matmul(reshape(col_temp_o1,[nhl*hndim,nhc]),reshape(col_temp_o2,[nhc,hndim*nhr]))
+        temp_left=reshape(matmul(col_temp_fl,reshape(temp_center,[nhl,hndim*hndim*nhr])),[nl*hndim*hndim,nhr])
+        !sencond, contract left blocks.
+        temp=reshape(matmul(temp_left,transpose(col_temp_fr)),[nl,hndim,hndim,nr])
+        do i=1,ndim
+            cind=indices(i,:)+1
+            res(i,j)=temp(cind(1),cind(2),cind(3),cind(4))
+        enddo
+    enddo
+end subroutine fget_subblock2b_real
+
+subroutine fget_subblock_dmrg_real(hl,hr,indices,ndim,nl,nr,is_identity,res)
+    implicit none
+    integer,intent(in) :: indices(ndim,2),ndim,nl,nr,is_identity
+    real*8,intent(in) :: hl(nl,nl),hr(nr,nr)
+    real*8,intent(out) :: res(ndim,ndim)
+    integer :: i,j,il,ir,jl,jr
+    real*8 :: temp_cl(nl),temp_cr(nr)
+    
+    !f2py intent(in) :: hl,hr,indices,ndim,nl,nr,is_identity
+    !f2py intent(out) :: res
+
+    if(is_identity==0) then
+        !$omp parallel do if(ndim>=64) schedule(static) &
+        !$omp private(i,il,ir,jl,jr,temp_cl,temp_cr)
+        do j=1,ndim
+            jl=indices(j,1)+1
+            jr=indices(j,2)+1
+            temp_cl=hl(:,jl)
+            temp_cr=hr(:,jr)
+            do i=1,ndim
+                il=indices(i,1)+1
+                ir=indices(i,2)+1
+                res(i,j)=temp_cl(il)*temp_cr(ir)
+            enddo
+        enddo
+    else if(is_identity==1) then
+        !$omp parallel do if(ndim>=64) schedule(static) &
+        !$omp private(i,il,ir,jl,jr,temp_cl,temp_cr)
+        do j=1,ndim
+            jl=indices(j,1)+1
+            jr=indices(j,2)+1
+            temp_cr=hr(:,jr)
+            do i=1,ndim
+                il=indices(i,1)+1
+                ir=indices(i,2)+1
+                if(il==jl) then
+                    res(i,j)=temp_cr(ir)
+                endif
+            enddo
+        enddo
+    else
+        !$omp parallel do if(ndim>=64) schedule(static) &
+        !$omp private(i,il,ir,jl,jr,temp_cl,temp_cr)
+        do j=1,ndim
+            jl=indices(j,1)+1
+            jr=indices(j,2)+1
+            temp_cl=hl(:,jl)
+            do i=1,ndim
+                il=indices(i,1)+1
+                ir=indices(i,2)+1
+                if(ir==jr) then
+                    res(i,j)=temp_cl(il)
+                endif
+            enddo
+        enddo
+    endif
+end subroutine fget_subblock_dmrg_real
+
+subroutine fget_subblock_dmrg_csr_real(hl_indptr,hl_indices,hl_data,hr_indptr,hr_indices,hr_data,indices,lookup,indptr,&
+        is_identity,data,colind,ndim,nl,nr,nzl,nzr,nnz)
+    implicit none
+    integer,intent(in) :: ndim,nl,nr,nzl,nzr,nnz,is_identity
+    integer,intent(in) :: hl_indptr(nl+1),hl_indices(nzl),hr_indptr(nr+1),hr_indices(nzr),indices(ndim,2),&
+        lookup(nl*nr),indptr(ndim+1)
+    real*8,intent(in) :: hl_data(nzl),hr_data(nzr)
+    real*8,intent(out) :: data(nnz)
+    integer,intent(out) :: colind(nnz)
+    integer :: i,j,k,il,ir,jl,jr,pl,pr
+    
+    !f2py intent(in) :: hl_indptr,hl_indices,hl_data,hr_indptr,hr_indices,hr_data,indices,lookup,indptr,is_identity
+    !f2py intent(in) :: ndim,nl,nr,nzl,nzr,nnz
+    !f2py intent(out) :: data,colind
+
+    !each row fills its own slice indptr(i)+1..indptr(i+1).
+    !$omp parallel do if(ndim>=64) schedule(static) private(i,j,k,il,ir,jl,jr,pl,pr)
+    do i=1,ndim
+        il=indices(i,1)+1
+        ir=indices(i,2)+1
+        k=indptr(i)
+        if(is_identity==1) then
+            do pr=hr_indptr(ir)+1,hr_indptr(ir+1)
+                j=lookup((il-1)*nr+hr_indices(pr)+1)
+                if(j>=0) then
+                    k=k+1
+                    colind(k)=j
+                    data(k)=hr_data(pr)
+                endif
+            enddo
+        else if(is_identity==2) then
+            do pl=hl_indptr(il)+1,hl_indptr(il+1)
+                j=lookup(hl_indices(pl)*nr+ir)
+                if(j>=0) then
+                    k=k+1
+                    colind(k)=j
+                    data(k)=hl_data(pl)
+                endif
+            enddo
+        else
+            do pl=hl_indptr(il)+1,hl_indptr(il+1)
+                jl=hl_indices(pl)
+                do pr=hr_indptr(ir)+1,hr_indptr(ir+1)
+                    jr=hr_indices(pr)
+                    j=lookup(jl*nr+jr+1)
+                    if(j>=0) then
+                        k=k+1
+                        colind(k)=j
+                        data(k)=hl_data(pl)*hr_data(pr)
+                    endif
+                enddo
+            enddo
+        endif
+    enddo
+end subroutine fget_subblock_dmrg_csr_real
+
+subroutine fget_subblock1_real(fl,o1,fr,indices,res,nl,nr,nhl,nhr,hndim,ndim)
+    implicit none
+    integer,intent(in) :: nl,nr,ndim,nhl,nhr,hndim
+    integer,intent(in) :: indices(ndim,3)
+    real*8,intent(in) :: fl(nl,nhl,nl),fr(nr,nhr,nr),o1(nhl,hndim,hndim,nhr)
+    real*8,intent(out) :: res(ndim,ndim)
+    integer :: j,cind(3),i
+    real*8 :: col_temp_fl(nl,nhl),col_temp_fr(nr,nhr),col_temp_o1(nhl,hndim,nhr),&
+        temp_left(nl*hndim,nhr),temp(nl,hndim,nr)
+    
+    !f2py intent(in) :: fl,o1,o2,fr,indices,nl,nr,nhl,nhr,hndim,ndim
+    !f2py intent(out) :: res
+
+    !prepair datas
+    !$omp parallel do if(ndim>=64) schedule(static) &
+    !$omp private(i,cind,col_temp_fl,col_temp_o1,col_temp_fr,temp_left,temp)
+    do j=1,ndim
+        !cache datas
+        col_temp_fl=fl(:,:,indices(j,1)+1)
+        col_temp_o1=o1(:,:,indices(j,2)+1,:)
+        col_temp_fr=fr(:,:,indices(j,3)+1)
+
+        !first, contract center blocks.
+        temp_left=reshape(matmul(col_temp_fl,reshape(col_temp_o1,[nhl,hndim*nhr])),[nl*hndim,nhr])
+        !sencond, contract left blocks.
+        temp=reshape(matmul(temp_left,transpose(col_temp_fr)),[nl,hndim,nr])
+        do i=1,ndim
+            cind=indices(i,:)+1
+            res(i,j)=temp(cind(1),cind(2),cind(3))
+        enddo
+    enddo
+end subroutine fget_subblock1_real
+
+!Set the number of OpenMP threads, it does nothing in the serial build.
+subroutine fset_num_threads(n)
+    !$ use omp_lib
+    implicit none
+    integer,intent(in) :: n
+    !f2py intent(in) :: n
+    !$ call omp_set_num_threads(n)
+end subroutine fset_num_threads
+
+!Get the maximum number of OpenMP threads, 1 in the serial build.
+subroutine fget_num_threads(n)
+    !$ use omp_lib
+    implicit none
+    integer,intent(out) :: n
+    !f2py intent(out) :: n
+    n=1
+    !$ n=omp_get_max_threads()
+end subroutine fget_num_threads
@@ -0,0 +1,2 @@
+!The OpenMP threaded build of flib.f90, compiled with -fopenmp into the `flibomp` module.
+include 'flib.f90'
@@ -0,0 +1,180 @@
+'''
+Vectorized numpy version of the Fortran kernels in `flib.f90`, with the same signatures.
+
+It is used when the compiled module is not available,
+the columns of sub-blocks are gathered with fancy indexing and contracted with batched matrix products(chunks of columns at once),
+then the rows are gathered.
+'''
+
+from numpy import *
+import threading
+
+__all__=['fget_subblock2a','fget_subblock2b','fget_subblock1','fget_subblock_dmrg',
+        'fcount_subblock_dmrg_csr','fget_subblock_dmrg_csr','fset_num_threads','fget_num_threads']
+
+#the maximum number of elements of the intermediate columns in a chunk.
+MAX_CHUNK=2**22
+#the inputs and entries of the last sparse sub-block of each thread,
+#`fget_subblock_dmrg_csr` follows `fcount_subblock_dmrg_csr` with the same inputs in the same thread.
+_CSR_CACHE=threading.local()
+
+def _chunks(ndim,colsize):
+    '''Slices of columns, so that a chunk of columns takes at most `MAX_CHUNK` elements.'''
+    step=max(1,MAX_CHUNK//max(colsize,1))
+    return [slice(start,min(start+step,ndim)) for start in xrange(0,ndim,step)]
+
+def _subblock2(fl,o1,o2,fr,indices,dtype):
+    fl,o1,o2,fr=[asarray(a,dtype=dtype) for a in [fl,o1,o2,fr]]
+    indices=asarray(indices)
+    nl,nhl=fl.shape[:2]
+    nr,nhr=fr.shape[:2]
+    hndim,nhc=o1.shape[1],o1.shape[3]
+    ndim=len(indices)
+    #the flat indices of rows in a column of size nl*hndim*hndim*nr.
+    rows=ravel_multi_index(indices.T,(nl,hndim,hndim,nr))
+    #the center blocks only depend on the column indices of two sites, contract them for all hndim**2 pairs.
+    center=einsum('akmb,bpqc->mqakpc',o1,o2,optimize=True).reshape([hndim,hndim,nhl,hndim*hndim*nhr])
+    res=empty([ndim,ndim],dtype=dtype)
+    for sl in _chunks(ndim,nl*hndim*hndim*nr):
+        j1,j2,j3,j4=indices[sl].T
+        T=matmul(fl[:,:,j1].transpose(2,0,1),center[j2,j3]).reshape([-1,nl*hndim*hndim,nhr])   #(m,nl*hndim*hndim,nhr)
+        T=matmul(T,fr[:,:,j4].transpose(2,1,0)).reshape([len(j1),-1])                        #(m,nl*hndim*hndim*nr)
+        res[:,sl]=T[:,rows].T
+    return res
+
+def fget_subblock2a(fl,o1,o2,fr,indices):
+    '''Sub-block of the 2-site VMPS hamiltonian.'''
+    return _subblock2(fl,o1,o2,fr,indices,complex128)
+
+def fget_subblock2a_real(fl,o1,o2,fr,indices):
+    '''Sub-block of the 2-site VMPS hamiltonian.'''
+    return _subblock2(fl,o1,o2,fr,indices,float64)
+
+#the per element and per column contractions are the same in vectorized form.
+fget_subblock2b,fget_subblock2b_real=fget_subblock2a,fget_subblock2a_real
+
+def _subblock1(fl,o1,fr,indices,dtype):
+    fl,o1,fr=[asarray(a,dtype=dtype) for a in [fl,o1,fr]]
+    indices=asarray(indices)
+    nl,nhl=fl.shape[:2]
+    nr,nhr=fr.shape[:2]
+    hndim=o1.shape[1]
+    ndim=len(indices)
+    rows=ravel_multi_index(indices.T,(nl,hndim,nr))
+    center=o1.transpose(2,0,1,3).reshape([hndim,nhl,hndim*nhr])
+    res=empty([ndim,ndim],dtype=dtype)
+    for sl in _chunks(ndim,nl*hndim*nr):
+        j1,j2,j3=indices[sl].T
+        T=matmul(fl[:,:,j1].transpose(2,0,1),center[j2]).reshape([-1,nl*hndim,nhr])   #(m,nl*hndim,nhr)
+        T=matmul(T,fr[:,:,j3].transpose(2,1,0)).reshape([len(j1),-1])                #(m,nl*hndim*nr)
+        res[:,sl]=T[:,rows].T
+    return res
+
+def fget_subblock1(fl,o1,fr,indices):
+    '''Sub-block of the 1-site VMPS hamiltonian.'''
+    return _subblock1(fl,o1,fr,indices,complex128)
+
+def fget_subblock1_real(fl,o1,fr,indices):
+    '''Sub-block of the 1-site VMPS hamiltonian.'''
+    return _subblock1(fl,o1,fr,indices,float64)
+
+def _subblock_dmrg(hl,hr,indices,is_identity,dtype):
+    il,ir=ascontiguousarray(asarray(indices).T)
+    #taking rows then columns is faster than indexing with ix_.
+    if is_identity==1:
+        return (il[:,newaxis]==il)*asarray(hr,dtype=dtype).take(ir,axis=0).take(ir,axis=1)
+    elif is_identity==2:
+        return asarray(hl,dtype=dtype).take(il,axis=0).take(il,axis=1)*(ir[:,newaxis]==ir)
+    res=asarray(hl,dtype=dtype).take(il,axis=0).take(il,axis=1)
+    res*=asarray(hr,dtype=dtype).take(ir,axis=0).take(ir,axis=1)
+    return res
+
+def fget_subblock_dmrg(hl,hr,indices,is_identity):
+    '''Dense sub-block of kron(hl,hr), is_identity: 0 -> no, 1 -> left, 2 -> right.'''
+    return _subblock_dmrg(hl,hr,indices,is_identity,complex128)
+
+def fget_subblock_dmrg_real(hl,hr,indices,is_identity):
+    '''Dense sub-block of kron(hl,hr), is_identity: 0 -> no, 1 -> left, 2 -> right.'''
+    return _subblock_dmrg(hl,hr,indices,is_identity,float64)
+
+def _csr_entries(hl_indptr,hl_indices,hr_indptr,hr_indices,indices,lookup,is_identity):
+    '''
+    Non-zero entries of the sub-block of kron(hl,hr) in the order of the Fortran loops.
+
+    Return:
+        tuple of (rows, column indices, positions in hl data, positions in hr data), positions are None for identities.
+    '''
+    inputs=(hl_indptr,hl_indices,hr_indptr,hr_indices,indices,lookup)
+    cached=getattr(_CSR_CACHE,'item',None)
+    if cached is not None and cached[0][-1]==is_identity and all([a is b for a,b in zip(cached[0][:-1],inputs)]):
+        return cached[1]
+    #int32 as in the Fortran kernels, which halves the memory traffic.
+    il,ir=asarray(indices,dtype='int32').T
+    nr=len(hr_indptr)-1
+    hl_indptr,hr_indptr=asarray(hl_indptr,dtype='int32'),asarray(hr_indptr,dtype='int32')
+    cl=hl_indptr[il+1]-hl_indptr[il] if is_identity!=1 else ones(len(il),dtype='int32')
+    cr=hr_indptr[ir+1]-hr_indptr[ir] if is_identity!=2 else ones(len(ir),dtype='int32')
+    counts=cl*cr
+    ends=cumsum(counts,dtype='int32')
+    ntot=ends[-1] if len(ends)>0 else 0
+    #the row of each candidate(faster than repeat), rows without candidates are skipped by accumulating the marks.
+    rowid=cumsum(bincount(ends[:-1],minlength=ntot+1)[:ntot],dtype='int32')
+    #the position of a candidate among the candidates of its row, the left index runs slower.
+    t=arange(ntot,dtype='int32')
+    t-=(ends-counts)[rowid]
+    pl=pr=None
+    if is_identity==1:
+        pr=t+hr_indptr[ir][rowid]
+        jl,jr=il[rowid],hr_indices[pr]
+    elif is_identity==2:
+        pl=t+hl_indptr[il][rowid]
+        jl,jr=hl_indices[pl],ir[rowid]
+    else:
+        pl,pr=divmod(t,cr[rowid])
+        pl+=hl_indptr[il][rowid]
+        pr+=hr_indptr[ir][rowid]
+        jl,jr=hl_indices[pl],hr_indices[pr]
+    jl*=nr
+    jl+=jr
+    cols=asarray(lookup)[jl]
+    kept=flatnonzero(cols>=0)
+    entries=rowid.take(kept),cols.take(kept),None if pl is None else pl.take(kept),None if pr is None else pr.take(kept)
+    _CSR_CACHE.item=(inputs+(is_identity,),entries)
+    return entries
+
+def fcount_subblock_dmrg_csr(hl_indptr,hl_indices,hr_indptr,hr_indices,indices,lookup,is_identity):
+    '''Row pointer of the sparse sub-block of kron(hl,hr).'''
+    rows=_csr_entries(hl_indptr,hl_indices,hr_indptr,hr_indices,indices,lookup,is_identity)[0]
+    indptr=zeros(len(indices)+1,dtype='int32')
+    indptr[1:]=cumsum(bincount(rows,minlength=len(indices)))
+    return indptr
+
+def _subblock_dmrg_csr(hl_indptr,hl_indices,hl_data,hr_indptr,hr_indices,hr_data,indices,lookup,is_identity,nnz,dtype):
+    rows,cols,pl,pr=_csr_entries(hl_indptr,hl_indices,hr_indptr,hr_indices,indices,lookup,is_identity)
+    #the entries are used once, release them.
+    _CSR_CACHE.item=None
+    if len(cols)!=nnz:
+        raise ValueError('The number of non-zero elements(%s) does not match nnz(%s).'%(len(cols),nnz))
+    if is_identity==1:
+        data=asarray(hr_data,dtype=dtype)[pr]
+    elif is_identity==2:
+        data=asarray(hl_data,dtype=dtype)[pl]
+    else:
+        data=asarray(hl_data,dtype=dtype)[pl]*asarray(hr_data,dtype=dtype)[pr]
+    return data,cols.astype('int32')
+
+def fget_subblock_dmrg_csr(hl_indptr,hl_indices,hl_data,hr_indptr,hr_indices,hr_data,indices,lookup,indptr,is_identity,nnz):
+    '''Data and column indices of the sparse sub-block of kron(hl,hr), with indptr from `fcount_subblock_dmrg_csr`.'''
+    return _subblock_dmrg_csr(hl_indptr,hl_indices,hl_data,hr_indptr,hr_indices,hr_data,indices,lookup,is_identity,nnz,complex128)
+
+def fget_subblock_dmrg_csr_real(hl_indptr,hl_indices,hl_data,hr_indptr,hr_indices,hr_data,indices,lookup,indptr,is_identity,nnz):
+    '''Data and column indices of the sparse sub-block of kron(hl,hr), with indptr from `fcount_subblock_dmrg_csr`.'''
+    return _subblock_dmrg_csr(hl_indptr,hl_indices,hl_data,hr_indptr,hr_indices,hr_data,indices,lookup,is_identity,nnz,float64)
+
+def fset_num_threads(n):
+    '''Set the number of threads, it does nothing in the numpy backend.'''
+    pass
+
+def fget_num_threads():
+    '''Get the number of threads, always 1 in the numpy backend.'''
+    return 1
@@ -2,6 +2,9 @@ def configuration(parent_package='',top_path=None):
     from numpy.distutils.misc_util import Configuration
     config=Configuration('flib',parent_package,top_path)
     config.add_extension('flib',['flib.f90'],libraries=[])
+    #the OpenMP threaded build of the same kernels, a separate source keeps its object file apart from the serial one.
+    config.add_extension('flibomp',['flibomp.f90'],depends=['flib.f90'],libraries=[],
+            extra_f90_compile_args=['-fopenmp'],extra_link_args=['-fopenmp'])
     return config
 
 if __name__ == '__main__':
@@ -0,0 +1,180 @@
+'''
+Low overhead profiling of hot kernels.
+
+Profiling is enabled by setting the environment variable `DMRG_PROFILE`(to anything except '' and '0'),
+or within the `profiling` context manager. Counters are inclusive, e.g. the time of `kron_csr` called by `_eigsh` is counted in both.
+'''
+
+from numpy import *
+import os,sys,time,functools,threading,pdb
+from contextlib import contextmanager
+
+__all__=['Profiler','PROFILER','profiled','profiling','PROFILE_ENV']
+
+PROFILE_ENV='DMRG_PROFILE'
+
+class Profiler(object):
+    '''
+    Cumulative wall/CPU time counters and call counts of kernels.
+
+    Construct:
+        Profiler(enabled=False)
+
+    Attributes:
+        :enabled: bool, counting is performed only when it is True.
+        :counters: dict, name -> [ncall, wall time, cpu time].
+        :sweeps: list, (label, counters) of finished sweeps, the counters are the increments within the sweep.
+    '''
+    def __init__(self,enabled=False):
+        self.enabled=enabled
+        self.counters={}
+        self.sweeps=[]
+        self._snapshot={}
+        self._lock=threading.Lock()
+
+    def __str__(self):
+        return self.report()
+
+    def reset(self):
+        '''Clear all counters and sweep records.'''
+        with self._lock:
+            self.counters={}
+            self.sweeps=[]
+            self._snapshot={}
+
+    def add(self,name,wall,cpu):
+        '''Add one call to the counter of `name`.'''
+        with self._lock:
+            counter=self.counters.get(name)
+            if counter is None:
+                self.counters[name]=[1,wall,cpu]
+            else:
+                counter[0]+=1
+                counter[1]+=wall
+                counter[2]+=cpu
+
+    @contextmanager
+    def timer(self,name):
+        '''
+        Time a code section as a kernel.
+
+        Parameters:
+            :name: str, the name of counter.
+        '''
+        if not self.enabled:
+            yield
+            return
+        t0,c0=time.time(),time.clock()
+        try:
+            yield
+        finally:
+            self.add(name,time.time()-t0,time.clock()-c0)
+
+    def mark_sweep(self,label):
+        '''
+        Close a sweep, the counter increments since last mark are recorded.
+
+        Parameters:
+            :label: str/int, the label of sweep.
+        '''
+        if not self.enabled:
+            return
+        with self._lock:
+            delta={}
+            for name,(ncall,wall,cpu) in self.counters.items():
+                ncall0,wall0,cpu0=self._snapshot.get(name,(0,0.,0.))
+                if ncall>ncall0:
+                    delta[name]=[ncall-ncall0,wall-wall0,cpu-cpu0]
+            self.sweeps.append((label,delta))
+            self._snapshot=dict([(name,tuple(counter)) for name,counter in self.counters.items()])
+
+    def report(self,counters=None):
+        '''
+        Get a table of counters, sorted by wall time.
+
+        Parameters:
+            :counters: dict/None, the counters, default is the cumulative counters.
+
+        Return:
+            str, the table.
+        '''
+        if counters is None: counters=self.counters
+        lines=['%-36s %10s %12s %12s %12s'%('kernel','ncall','wall(s)','cpu(s)','wall/call(ms)')]
+        for name,(ncall,wall,cpu) in sorted(counters.items(),key=lambda item:-item[1][1]):
+            lines.append('%-36s %10d %12.4f %12.4f %12.4f'%(name,ncall,wall,cpu,1e3*wall/ncall))
+        return '\n'.join(lines)
+
+    def sweep_table(self):
+        '''
+        Get the per-sweep breakdown of wall time.
+
+        Return:
+            str, the table with kernels as rows and sweeps as columns.
+        '''
+        names=set()
+        for label,delta in self.sweeps:
+            names.update(delta.keys())
+        names=sorted(names,key=lambda name:-self.counters.get(name,[0,0.])[1])
+        lines=['%-36s'%'kernel'+''.join(['%12s'%('sweep %s'%label) for label,delta in self.sweeps])]
+        for name in names:
+            lines.append('%-36s'%name+''.join(['%12.4f'%delta.get(name,[0,0.,0.])[1] for label,delta in self.sweeps]))
+        return '\n'.join(lines)
+
+    def dump(self,stream=None):
+        '''Write the cumulative and per-sweep tables to a stream(default sys.stdout).'''
+        stream=stream or sys.stdout
+        stream.write(self.report()+'\n')
+        if len(self.sweeps)>0:
+            stream.write(self.sweep_table()+'\n')
+
+PROFILER=Profiler(enabled=os.environ.get(PROFILE_ENV,'') not in ['','0'])
+
+def profiled(name,profiler=None):
+    '''
+    Decorator to count the calls of a function.
+
+    Parameters:
+        :name: str, the name of counter.
+        :profiler: <Profiler>/None, the profiler, default is `PROFILER`.
+
+    Return:
+        function, the decorator.
+    '''
+    def decorator(func):
+        #f2py routines do not have all the attributes of python functions.
+        @functools.wraps(func,assigned=[attr for attr in functools.WRAPPER_ASSIGNMENTS if hasattr(func,attr)])
+        def wrapper(*args,**kwargs):
+            prof=profiler or PROFILER
+            if not prof.enabled:
+                return func(*args,**kwargs)
+            t0,c0=time.time(),time.clock()
+            try:
+                return func(*args,**kwargs)
+            finally:
+                prof.add(name,time.time()-t0,time.clock()-c0)
+        return wrapper
+    return decorator
+
+@contextmanager
+def profiling(reset=True,dump=False,stream=None):
+    '''
+    Enable `PROFILER` within the context.
+
+    Parameters:
+        :reset: bool, clear counters on entering.
+        :dump: bool, dump the tables on exiting.
+        :stream: file/None, the stream to dump.
+
+    Example:
+        with profiling() as prof:
+            engine.run_finite(...)
+        print prof.sweep_table()
+    '''
+    enabled=PROFILER.enabled
+    if reset: PROFILER.reset()
+    PROFILER.enabled=True
+    try:
+        yield PROFILER
+    finally:
+        PROFILER.enabled=enabled
+        if dump: PROFILER.dump(stream)
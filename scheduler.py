@@ -0,0 +1,144 @@
+'''
+Sweep scheduler for finite DMRG.
+'''
+
+from numpy import *
+
+__all__=['SweepScheduler','PRECISIONS','SINGLE_EIGEN_TOL']
+
+#the precision -> (real, complex) data types.
+PRECISIONS={'single':(float32,complex64),'double':(float64,complex128)}
+#the lower bound of eigensolver tolerance in single precision sweeps.
+SINGLE_EIGEN_TOL=1e-5
+
+class SweepScheduler(object):
+    '''
+    Schedule of finite DMRG sweeps, it drives the maximum kept states, the eigensolver tolerance of each sweep,
+    and decides when to stop.
+
+    Early sweeps with small `maxN` can run in single precision(float32/complex64), the remaining sweeps are promoted
+    to double precision once the energy stalls in a single precision sweep.
+
+    Construct:
+        SweepScheduler(maxN,eigen_tol=1e-10,etol=0,trunc_tol=None,min_sweep=1,precision='double',stall_tol=1e-5)
+
+    Attributes:
+        :maxN: list, the maximum kept states for each sweep.
+        :eigen_tol: list, the tolerance of eigensolver for each sweep.
+        :etol: float, the tolerance for the energy change at the midpoint,
+            converged if abs(dE)<etol, so 0 means never stop before the last sweep.
+        :trunc_tol: float/None, the tolerance for the maximum truncation error of a sweep, None for no check.
+        :min_sweep: int, the minimum number of sweeps.
+        :precision: list, the precision('single' or 'double') for each sweep.
+        :stall_tol: float, a single precision sweep stalls if the energy decreases less than it at the midpoint.
+        :nstall: int, the number of stalled single precision sweeps.
+        :promoted_at: int/None, the sweep after which the remaining sweeps are promoted to double precision, None if not promoted.
+
+    Example:
+        SweepScheduler(maxN=[20,50,100,200,200],eigen_tol=[1e-6,1e-7,1e-8,1e-10,1e-10],etol=1e-8,trunc_tol=1e-6,
+            precision=['single','single','double','double','double'])
+    '''
+    def __init__(self,maxN,eigen_tol=1e-10,etol=0,trunc_tol=None,min_sweep=1,precision='double',stall_tol=1e-5):
+        self.maxN=list(maxN)
+        nsweep=len(self.maxN)
+        if ndim(eigen_tol)==0:
+            eigen_tol=[eigen_tol]*nsweep
+        if len(eigen_tol)!=nsweep:
+            raise ValueError('The length of eigen_tol(%s) and maxN(%s) do not match!'%(len(eigen_tol),nsweep))
+        self.eigen_tol=list(eigen_tol)
+        if isinstance(precision,str):
+            precision=[precision]*nsweep
+        if len(precision)!=nsweep:
+            raise ValueError('The length of precision(%s) and maxN(%s) do not match!'%(len(precision),nsweep))
+        for p in precision:
+            if p not in PRECISIONS:
+                raise ValueError('Precision should be one of %s, got %s.'%(PRECISIONS.keys(),p))
+        self.precision=list(precision)
+        self.etol=etol
+        self.trunc_tol=trunc_tol
+        self.min_sweep=min_sweep
+        self.stall_tol=stall_tol
+        self.nstall=0
+        self.promoted_at=None
+
+    def __str__(self):
+        return '<SweepScheduler> maxN = %s, eigen_tol = %s, etol = %s, trunc_tol = %s, precision = %s'%(self.maxN,self.eigen_tol,self.etol,self.trunc_tol,self.precision)
+
+    @property
+    def nsweep(self):
+        '''The maximum number of sweeps.'''
+        return len(self.maxN)
+
+    def get_maxN(self,isweep):
+        '''Get the maximum kept states of the `isweep`-th sweep.'''
+        return self.maxN[isweep]
+
+    def get_eigen_tol(self,isweep):
+        '''Get the eigensolver tolerance of the `isweep`-th sweep, bounded by `SINGLE_EIGEN_TOL` in single precision.'''
+        if self.precision[isweep]=='single':
+            return max(self.eigen_tol[isweep],SINGLE_EIGEN_TOL)
+        return self.eigen_tol[isweep]
+
+    def get_precision(self,isweep):
+        '''Get the precision('single' or 'double') of the `isweep`-th sweep.'''
+        return self.precision[isweep]
+
+    def check_stall(self,isweep,dE):
+        '''
+        Check the energy at the midpoint of a single precision sweep,
+        if it stalls(decreases less than `stall_tol` or increases), the remaining sweeps are promoted to double precision.
+
+        Parameters:
+            :isweep: int, the index of current sweep.
+            :dE: float/1D array, the change of energy(levels) at the midpoint compared with the last sweep.
+
+        Return:
+            bool, True if the remaining sweeps are promoted.
+        '''
+        if self.precision[isweep]!='single' or all(asarray(dE)<-self.stall_tol):
+            return False
+        self.precision[isweep+1:]=['double']*(self.nsweep-isweep-1)
+        self.nstall+=1
+        self.promoted_at=isweep
+        return True
+
+    def get_state(self):
+        '''
+        Get the run-time state(precision and stall counters), which is saved in checkpoints.
+
+        Return:
+            dict,
+        '''
+        return {'precision':list(self.precision),'nstall':self.nstall,'promoted_at':self.promoted_at}
+
+    def set_state(self,state):
+        '''
+        Restore the run-time state from `get_state`, the schedule may have more or less sweeps than the saved one.
+
+        Parameters:
+            :state: dict, the state.
+        '''
+        n=min(self.nsweep,len(state['precision']))
+        self.precision[:n]=state['precision'][:n]
+        self.nstall=state['nstall']
+        self.promoted_at=state['promoted_at']
+        if self.promoted_at is not None:
+            self.precision[self.promoted_at+1:]=['double']*max(self.nsweep-self.promoted_at-1,0)
+
+    def check_convergence(self,isweep,dE,trunc_error):
+        '''
+        Check the convergence at the midpoint of a sweep.
+
+        Parameters:
+            :isweep: int, the index of current sweep.
+            :dE: float/1D array, the change of energy(levels) at the midpoint compared with the last sweep.
+            :trunc_error: float, the maximum truncation error in this sweep.
+
+        Return:
+            bool, True if converged, single precision sweeps never converge.
+        '''
+        if isweep+1<self.min_sweep or self.precision[isweep]=='single':
+            return False
+        if not all(abs(asarray(dE))<self.etol):
+            return False
+        return self.trunc_tol is None or trunc_error<self.trunc_tol
@@ -4,18 +4,240 @@ Super Block class.
 
 from numpy import *
 import scipy.sparse as sps
+from scipy.sparse.linalg import LinearOperator
 from scipy.linalg import kron as dkron
 from numpy.linalg import norm
-import copy,time,pdb,warnings
+import copy,time,pdb,warnings,itertools,threading
+from collections import OrderedDict
 
 from tba.hgen import Z4scfg
 from tba.hgen import kron_csr as kron
 from rglib.mps import OpString,OpUnit,OpCollection
-from flib.flib import fget_subblock_dmrg
+from flib import fcount_subblock_dmrg_csr,fget_subblock_dmrg_csr
+from profiler import profiled
 
-__all__=['site_image','joint_extract_block','SuperBlock']
+__all__=['site_image','joint_extract_block','get_subblock_lookup','get_subblock_csr','SuperBlock','SuperBlockOperator',
+        'OpCache','OP_CACHE','mark_truncated','reserve_trunc_versions']
 
-def joint_extract_block(HL0,HR0,bml,bmr,bmg,bm_tot,jointinfo,target_block,pre=True,lshift=None):
+#hot kernels counted by the profiler.
+kron=profiled('kron_csr')(kron)
+fcount_subblock_dmrg_csr=profiled('fcount_subblock_dmrg_csr')(fcount_subblock_dmrg_csr)
+fget_subblock_dmrg_csr=profiled('fget_subblock_dmrg_csr')(fget_subblock_dmrg_csr)
+
+class OpCache(object):
+    '''
+    Bounded LRU cache for operator matrices of blocks, with size-based eviction.
+
+    Construct:
+        OpCache(maxsize=2**30)
+
+    Attributes:
+        :maxsize: int, the maximum total size of cached matrices in bytes.
+        :hits/misses: int, the number of cache hits and misses.
+    '''
+    def __init__(self,maxsize=2**30):
+        self.maxsize=maxsize
+        self.hits=0
+        self.misses=0
+        self._data=OrderedDict()
+        self._nbytes=0
+        self._lock=threading.Lock()
+
+    def __str__(self):
+        return '<OpCache> hits = %s, misses = %s, %s items, %.1f MB'%(self.hits,self.misses,len(self._data),self._nbytes/1024.**2)
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def nbytes(self):
+        '''The total size of cached matrices in bytes.'''
+        return self._nbytes
+
+    def get(self,key,func):
+        '''
+        Get the cached matrix, or generate it by `func` and cache it.
+
+        Parameters:
+            :key: hashable/None, the key, None to bypass this cache.
+            :func: function, generate the matrix without parameter.
+
+        Return:
+            matrix,
+        '''
+        if key is None or self.maxsize<=0:
+            return func()
+        with self._lock:
+            if key in self._data:
+                self.hits+=1
+                item=self._data.pop(key)
+                self._data[key]=item
+                return item[0]
+            self.misses+=1
+        value=func()
+        if sps.issparse(value):
+            value=value.tocsr()
+            size=value.data.nbytes+value.indices.nbytes+value.indptr.nbytes
+        else:
+            size=asarray(value).nbytes
+        with self._lock:
+            if size<=self.maxsize and key not in self._data:
+                self._data[key]=(value,size)
+                self._nbytes+=size
+                self._evict()
+        return value
+
+    def _evict(self):
+        '''Remove the least recently used items until the cache fits `maxsize`.'''
+        while self._nbytes>self.maxsize:
+            k,(v,sz)=self._data.popitem(last=False)
+            self._nbytes-=sz
+
+    def resize(self,maxsize):
+        '''
+        Change the maximum size, items are evicted if the cache is too large.
+
+        Parameters:
+            :maxsize: int, the maximum total size of cached matrices in bytes.
+        '''
+        with self._lock:
+            self.maxsize=maxsize
+            self._evict()
+
+    def clear(self):
+        '''Clear the cache and counters.'''
+        with self._lock:
+            self._data.clear()
+            self._nbytes=0
+            self.hits=self.misses=0
+
+OP_CACHE=OpCache()
+_TRUNC_COUNTER=itertools.count()
+
+def mark_truncated(hgen):
+    '''
+    Tag a hamiltonian generator with a new truncation version,
+    which identifies the block (and its operators) in <OpCache>.
+    '''
+    hgen.trunc_version=next(_TRUNC_COUNTER)
+
+def reserve_trunc_versions(version=0):
+    '''
+    Make the truncation versions of new blocks no smaller than `version`,
+    so that they do not collide with blocks restored from another process.
+
+    Return:
+        int, the next truncation version.
+    '''
+    global _TRUNC_COUNTER
+    version=max(next(_TRUNC_COUNTER),version)
+    _TRUNC_COUNTER=itertools.count(version)
+    return version
+
+def _op_key(ops):
+    '''Get the hashable key of <OpUnit>(s).'''
+    if isinstance(ops,OpString):
+        ops=ops.opunits
+    elif not isinstance(ops,(list,tuple)):
+        ops=[ops]
+    key=[]
+    for ou in ops:
+        data=ou.get_data()
+        data=data.toarray() if sps.issparse(data) else asarray(data)
+        key.append((ou.siteindex,data.dtype.str,data.shape,data.tobytes()))
+    return tuple(key)
+
+def _format_label(lb):
+    '''Format a label to hashable type.'''
+    rank=ndim(lb)
+    if rank==0:
+        return lb
+    elif rank==1:
+        return tuple(lb)
+    else:
+        raise Exception('Format error for Label %s!'%lb)
+
+class JointTable(object):
+    '''
+    Pair to slice index tables for the vectorized assembly of `joint_extract_block`.
+
+    Attributes:
+        :pair_l/pair_r: 1D array, the left/right block index of each pair.
+        :offsets: 1D array, the starting position of each pair in the target block.
+        :pair_index: 2D array, the pair index of (left block, right block), -1 if it is not in the target block.
+        :lab_l/lab_r: 1D array, the block index of each state in left/right space.
+        :loc_l/loc_r: 1D array, the position of each state inside its block.
+    '''
+    def __init__(self,bml,bmr,pairs,dims):
+        lmap=dict((_format_label(lb),i) for i,lb in enumerate(bml.labels))
+        rmap=dict((_format_label(lb),i) for i,lb in enumerate(bmr.labels))
+        self.pair_l=array([lmap[_format_label(lli)] for lli,lri in pairs],dtype='int64')
+        self.pair_r=array([rmap[_format_label(lri)] for lli,lri in pairs],dtype='int64')
+        self.offsets=append([0],cumsum(dims)).astype('int64')
+        self.pair_index=-ones([bml.nblock,bmr.nblock],dtype='int64')
+        self.pair_index[self.pair_l,self.pair_r]=arange(len(pairs))
+        self.Nr_l,self.Nr_r=asarray(bml.Nr,dtype='int64'),asarray(bmr.Nr,dtype='int64')
+        nr_l,nr_r=diff(self.Nr_l),diff(self.Nr_r)
+        self.size_r=nr_r
+        self.lab_l=repeat(arange(bml.nblock),nr_l)
+        self.lab_r=repeat(arange(bmr.nblock),nr_r)
+        self.loc_l=arange(bml.N)-self.Nr_l[self.lab_l]
+        self.loc_r=arange(bmr.N)-self.Nr_r[self.lab_r]
+
+_JOINT_TABLES={}
+
+def _get_joint_table(bml,bmr,jointinfo,target_block,pairs,dims):
+    '''Get the cached <JointTable> for (bml, bmr, target_block).'''
+    key=(id(bml),id(bmr),id(jointinfo),_format_label(target_block))
+    item=_JOINT_TABLES.get(key)
+    if item is None or item[0] is not bml or item[1] is not bmr or item[2] is not jointinfo:
+        if len(_JOINT_TABLES)>=32:
+            _JOINT_TABLES.clear()
+        item=(bml,bmr,jointinfo,JointTable(bml,bmr,pairs,dims))
+        _JOINT_TABLES[key]=item
+    return item[3]
+
+def _joint_assemble_vectorized(HL0,HR0,table,js):
+    '''
+    Assemble the target block in bulk with COO index arithmetic.
+
+    Parameters:
+        :HL0,HR0: <csr_matrix>, the blockized operators.
+        :table: <JointTable>,
+        :js: 1D array/None, the only allowed column pair for each row pair, -1 for none, None for no restriction.
+    '''
+    HL0.sum_duplicates(); HR0.sum_duplicates()
+    #the entries of row block b are contiguous in csr format.
+    startl=HL0.indptr[table.Nr_l[:-1]].astype('int64'); cntl=HL0.indptr[table.Nr_l[1:]]-startl
+    startr=HR0.indptr[table.Nr_r[:-1]].astype('int64'); cntr=HR0.indptr[table.Nr_r[1:]]-startr
+    pl,pr=table.pair_l,table.pair_r
+    npair=len(pl)
+    ndim=table.offsets[-1]
+    #all products of non-zero entries in (left row block, right row block) of each pair.
+    nprod=cntl[pl]*cntr[pr]
+    if js is not None:
+        nprod[js<0]=0
+    pidx=repeat(arange(npair),nprod)
+    k=arange(len(pidx))-repeat(append([0],cumsum(nprod)[:-1]),nprod)
+    ncr=cntr[pr][pidx]
+    il=startl[pl][pidx]+k//ncr
+    ir=startr[pr][pidx]+k%ncr
+    del k,ncr
+    rows_l=repeat(arange(HL0.shape[0]),diff(HL0.indptr))[il]
+    rows_r=repeat(arange(HR0.shape[0]),diff(HR0.indptr))[ir]
+    cols_l,cols_r=HL0.indices[il],HR0.indices[ir]
+    j=table.pair_index[table.lab_l[cols_l],table.lab_r[cols_r]]
+    mask=j>=0
+    if js is not None:
+        mask&=j==js[pidx]
+    pidx,j,il,ir=pidx[mask],j[mask],il[mask],ir[mask]
+    rows_l,rows_r,cols_l,cols_r=rows_l[mask],rows_r[mask],cols_l[mask],cols_r[mask]
+    row=table.offsets[pidx]+table.loc_l[rows_l]*table.size_r[pr[pidx]]+table.loc_r[rows_r]
+    col=table.offsets[j]+table.loc_l[cols_l]*table.size_r[pr[j]]+table.loc_r[cols_r]
+    data=HL0.data[il]*HR0.data[ir]
+    return sps.coo_matrix((data,(row,col)),shape=(ndim,ndim)).tocsr()
+
+def joint_extract_block(HL0,HR0,bml,bmr,bmg,bm_tot,jointinfo,target_block,pre=True,lshift=None,method='vectorized'):
     '''
     Extract specific blocks from the combined block.
 
@@ -27,16 +249,8 @@ def joint_extract_block(HL0,HR0,bml,bmr,bmg,bm_tot,jointinfo,target_block,pre=Tr
         target_block: tuple/int, the block to extract.
         pre: bool, True if HL0 is not permuted by bml, so as R.
         lshift: int/None, the label-shift for left operator.
+        method: 'vectorized'/'loop', assemble the block with vectorized COO index arithmetic, or pair by pair.
     '''
-    def _format_label(lb):
-        rank=ndim(lb)
-        if rank==0:
-            return lb
-        elif rank==1:
-            return tuple(lb)
-        else:
-            raise Exception('Format error for Label %s!'%lb)
-
     jnr=jointinfo.nnr
     jNr=append([0],cumsum(jnr))
     ind=bm_tot.labels.index(target_block)
@@ -53,14 +267,24 @@ def joint_extract_block(HL0,HR0,bml,bmr,bmg,bm_tot,jointinfo,target_block,pre=Tr
         js=[j.item() if len(j)!=0 else None for j in js]
     else:
         shifted_pairs=None
-    np=len(pairs)
-    Hc=ndarray((np,np),dtype='O')
-    for i,dim in enumerate(dims):
-        Hc[i,i]=sps.csr_matrix((dim,dim))
     if pre:
         #lext,rext=bml.lextract_block_pre,bmr.lextract_block_pre
         HL0=bml.blockize(HL0).tocsr()
         HR0=bmr.blockize(HR0).tocsr()
+    if method=='vectorized':
+        table=_get_joint_table(bml,bmr,jointinfo,target_block,pairs,dims)
+        if lshift is not None:
+            js=array([-1 if j is None else j for j in js],dtype='int64')
+        else:
+            js=None
+        return _joint_assemble_vectorized(sps.csr_matrix(HL0),sps.csr_matrix(HR0),table,js)
+    elif method!='loop':
+        raise ValueError('Unknown assembly method %s.'%method)
+
+    np=len(pairs)
+    Hc=ndarray((np,np),dtype='O')
+    for i,dim in enumerate(dims):
+        Hc[i,i]=sps.csr_matrix((dim,dim))
     lext,rext=bml.extract_block,bmr.extract_block
     for i,(lli,lri) in enumerate(pairs):
         if lshift is not None:
@@ -92,6 +316,47 @@ def joint_extract_block(HL0,HR0,bml,bmr,bmg,bm_tot,jointinfo,target_block,pre=Tr
     Hc=sps.bmat(Hc)
     return Hc
 
+def get_subblock_lookup(indices,N):
+    '''
+    Get the lookup table for sub-block extraction.
+
+    Parameters:
+        :indices: 2D array, the (left, right) indices of the target sub-block.
+        :N: tuple, the dimension of left and right space (nl, nr).
+
+    Return:
+        1D array, the position in target sub-block for each index of the (nl*nr) space, -1 if not in target.
+    '''
+    nl,nr=N
+    lookup=-ones(nl*nr,dtype='int32')
+    lookup[indices[:,0]*nr+indices[:,1]]=arange(len(indices),dtype='int32')
+    return lookup
+
+def get_subblock_csr(hl,hr,indices,lookup=None,is_identity=0):
+    '''
+    Get the sub-block of kron(hl,hr), both input and output are in csr format.
+
+    Parameters:
+        :hl/hr: matrix, the left and right operators.
+        :indices: 2D array, the (left, right) indices of the target sub-block.
+        :lookup: 1D array/None, the lookup table from `get_subblock_lookup`, it will be generated if None.
+        :is_identity: int, 0 -> no, 1 -> left(hl is not used), 2 -> right(hr is not used).
+
+    Return:
+        <csr_matrix>, the sub-block.
+    '''
+    hl,hr=sps.csr_matrix(hl),sps.csr_matrix(hr)
+    hl.sum_duplicates(); hr.sum_duplicates()
+    ndim=len(indices)
+    if lookup is None:
+        lookup=get_subblock_lookup(indices,(hl.shape[0],hr.shape[0]))
+    indptr=fcount_subblock_dmrg_csr(hl_indptr=hl.indptr,hl_indices=hl.indices,hr_indptr=hr.indptr,hr_indices=hr.indices,\
+            indices=indices,lookup=lookup,is_identity=is_identity)
+    data,colind=fget_subblock_dmrg_csr(hl_indptr=hl.indptr,hl_indices=hl.indices,hl_data=hl.data,\
+            hr_indptr=hr.indptr,hr_indices=hr.indices,hr_data=hr.data,\
+            indices=indices,lookup=lookup,indptr=indptr,is_identity=is_identity,nnz=indptr[-1])
+    return sps.csr_matrix((data,colind,indptr),shape=(ndim,ndim))
+
 def site_image(ops,NL,NR,care_sign=False):
     '''
     Perform imaging transformation for operator sites.
@@ -136,21 +401,30 @@ class SuperBlock(object):
     Super Block operation.
     
     Construct:
-        SuperBlock(hl,hr,order='A.B.')
+        SuperBlock(hl,hr,order='A.B.',cache=OP_CACHE)
 
     Attributes:
         :hl/hr: <ExpandGenerator>, Hamiltonian Generator for left and right blocks.
         :order: 'A.B.'/'A..B', the space ordering.
+        :cache: <OpCache>/None, the cache for link and interaction operators of blocks,
+            blocks are identified by `trunc_version`(see `mark_truncated`).
 
     Read Only Attributes:
         :nsite: integer, number of total sites(readonly).
         :hndim: integer, the dimension of a single site(readonly).
     '''
-    def __init__(self,hl,hr,order='A.B.'):
+    def __init__(self,hl,hr,order='A.B.',cache=OP_CACHE):
         self.hl=hl
         self.hr=hr
         assert(order=='A..B' or order=='A.B.')
         self.order=order
+        self.cache=cache
+
+    def _cached(self,key,func):
+        '''Get a matrix through cache.'''
+        if self.cache is None:
+            return func()
+        return self.cache.get(key,func)
 
     @property
     def nsite(self):
@@ -175,57 +449,74 @@ class SuperBlock(object):
         NL,NR=self.hl.N,self.hr.N
         return site_image(ops,NL,NR)
 
-    def get_op_onlink(self,ouA,ouB,indices=None):
+    def get_op_onlink(self,ouA,ouB,indices=None,lookup=None):
         '''
         Get the operator on the link.
         
         Parameters:
             :ouA/ouB: <OpUnit>, the opunit on left/right link site.
-            :blockinfo: dict, the information of blocks.
-                
-                * 'target_block', the target joint block.
-                * 'bmg', block marker generater.
-                * 'bml,bmr', left and right block marker.
+            :indices: 2D array/None, the (left, right) indices of the target sub-block.
+            :lookup: 1D array/None, the lookup table of target sub-block, see `get_subblock_lookup`.
 
         Return:
             matrix, the hamiltonian term.
         '''
+        mA,mB=self._get_pair_onlink(ouA,ouB)
+        return self._combine_pair(mA,mB,indices,lookup)
+
+    def _get_pair_onlink(self,ouA,ouB):
+        '''Get the left and right factors of the operator on the link.'''
         NL,NR=self.hl.N,self.hr.N
         scfg=self.hl.spaceconfig
         ndiml0=self.hl.evolutor.check_link(NL-1)
         ndimr0=self.hr.evolutor.check_link(NR-1)
+        version_r=getattr(self.hr,'trunc_version',None)
 
+        mA=self._cached(('I*O',ndiml0,_op_key(ouA)),lambda:kron(sps.identity(ndiml0),ouA.get_data(dense=False)))
         if ouA.fermionic:
             if self.order=='A.B.':
-                sgnr=self.hr.zstring(NR-1)
-                mA=kron(sps.identity(ndiml0),ouA.get_data(dense=False))
-                mB=kron(sgnr,ouB.get_data(dense=False))
+                mB=self._cached(None if version_r is None else ('Z*O',version_r,NR-1,_op_key(ouB)),\
+                        lambda:kron(self.hr.zstring(NR-1),ouB.get_data(dense=False)))
             else:
-                mA=kron(sps.identity(ndiml0),ouA.get_data(dense=False))
                 mB=kron(ouB.get_data(dense=False),sps.identity(ndimr0))
         else:
             if self.order=='A.B.':
-                mA=kron(sps.identity(ndiml0),ouA.get_data(dense=False))
-                mB=kron(sps.identity(ndimr0),ouB.get_data(dense=False))
+                mB=self._cached(('I*O',ndimr0,_op_key(ouB)),lambda:kron(sps.identity(ndimr0),ouB.get_data(dense=False)))
             else:
-                mA=kron(sps.identity(ndiml0),ouA.get_data(dense=False))
                 mB=kron(ouB.get_data(dense=False),sps.identity(ndimr0))
+        return mA,mB
+
+    def _combine_pair(self,mA,mB,indices,lookup=None):
+        '''Combine left and right factors into the full operator, or the sub-block of it.'''
         if indices is None:
-            op=kron(mA,mB)
+            return kron(mA,mB)
         else:
-            op=fget_subblock_dmrg(hl=mA.toarray(),hr=mB.toarray(),indices=indices,is_identity=0)
-        return op
+            return get_subblock_csr(hl=mA,hr=mB,indices=indices,lookup=lookup,is_identity=0)
 
-    def get_op(self,opstring,indices=None):
+    def get_op(self,opstring,indices=None,lookup=None):
         '''
         Get specific operator.
         '''
         if self.order=='A.B.':
-            return self._get_op_AdBd(opstring,indices=indices)
+            return self._get_op_AdBd(opstring,indices=indices,lookup=lookup)
         else:
             return self._get_op_AddB(opstring,indices=indices)
 
-    def _get_op_AdBd(self,opstring,indices):
+    def get_op_pair(self,opstring):
+        '''
+        Get specific operator in factorized form.
+
+        Parameters:
+            :opstring: <OpString>, the operator string.
+
+        Return:
+            tuple of (matrix, matrix), the left and right factors (mA, mB), the operator is kron(mA,mB).
+        '''
+        if self.order!='A.B.':
+            raise NotImplementedError('Factorized operator is only implemented for order A.B.!')
+        return self._get_pair_AdBd(opstring)
+
+    def _get_op_AdBd(self,opstring,indices,lookup=None):
         '''
         Get the hamiltonian from a opstring instance.
 
@@ -235,6 +526,11 @@ class SuperBlock(object):
         Return:
             matrix, the hamiltonian term.
         '''
+        mA,mB=self._get_pair_AdBd(opstring)
+        return self._combine_pair(mA,mB,indices,lookup)
+
+    def _get_pair_AdBd(self,opstring):
+        '''Get the left and right factors of an opstring instance.'''
         hndim=self.hndim
         siteindices=list(opstring.siteindex)
         nsite=self.nsite
@@ -258,24 +554,26 @@ class SuperBlock(object):
             #handle the fermionic link.
             if nll!=0 or nrr!=0:
                 raise NotImplementedError('Only nearest neighbor term is allowed for fermionic links!')
-            return self.get_op_onlink(op_ls[0],op_rs[0],indices=indices)
+            return self._get_pair_onlink(op_ls[0],op_rs[0])
 
         datas=[]
         for hgen,opn,op1,NN in [(self.hl,op_ll,op_ls,NL),(self.hr,op_rr,op_rs,NR)]:
             ndim0=hgen.evolutor.check_link(NN-1)
+            version=getattr(hgen,'trunc_version',None)
             #get the data in opn-block
             if len(opn)>0:
                 opstr=prod(opn)
                 if isinstance(opstr,OpString):
                     opstr.compactify()
-                data_n=kron(hgen.get_op(opstr,target_len=NN-1),I1)
+                data_n=self._cached(None if version is None else ('O*I',version,NN-1,_op_key(opn)),\
+                        lambda:kron(hgen.get_op(opstr,target_len=NN-1),I1))
             else:
                 data_n=None
 
             #get the data in op1-block
             if len(op1)>0:
                 ou=op1[0]
-                data_1=sps.kron(identity(ndim0),ou.get_data())
+                data_1=self._cached(('I*O',ndim0,_op_key(ou)),lambda:sps.kron(identity(ndim0),ou.get_data()))
             else:
                 data_1=None
 
@@ -286,10 +584,7 @@ class SuperBlock(object):
             else:
                 data=data_n.dot(data_1)
             datas.append(data)
-        if indices is None:
-            return kron(datas[0],datas[1])
-        else:
-            return fget_subblock_dmrg(hl=datas[0].toarray(),hr=datas[1].toarray(),indices=indices,is_identity=0)
+        return datas[0],datas[1]
 
 
     def _get_op_AddB(self,opstring):
@@ -385,3 +680,121 @@ class SuperBlock(object):
         return kron(opl,opr)
 
 
+class SuperBlockOperator(LinearOperator):
+    '''
+    Matrix-free super block hamiltonian HL*I + I*HR + sum_k A_k*B_k, restricted to a target block.
+
+    The Kronecker products are never formed, a state is reshaped into a (ndiml, ndimr) matrix X,
+    and the hamiltonian is applied as HL.X + X.HR^T + sum_k A_k.X.B_k^T.
+
+    Construct:
+        SuperBlockOperator(HL,HR,pairs,indices=None)
+
+    Attributes:
+        :HL/HR: matrix, the hamiltonian of left and right blocks.
+        :pairs: list of tuple, the (A_k, B_k) factors of the interaction terms.
+        :indices: 1D array/None, the positions of target block in the (ndiml*ndimr) space, None for the whole space.
+
+    Note:
+        `to_real` and `astype` make it work with `real_if_close` and `cast_precision` of eigsolver.
+    '''
+    def __init__(self,HL,HR,pairs,indices=None):
+        self.HL=sps.csr_matrix(HL)
+        self.HR=sps.csr_matrix(HR)
+        self.pairs=[(sps.csr_matrix(A),sps.csr_matrix(B)) for A,B in pairs]
+        self.indices=indices
+        ndiml,ndimr=self.HL.shape[0],self.HR.shape[0]
+        N=ndiml*ndimr if indices is None else len(indices)
+        dtype=result_type(self.HL.dtype,self.HR.dtype,*[m.dtype for pair in self.pairs for m in pair])
+        super(SuperBlockOperator,self).__init__(dtype=dtype,shape=(N,N))
+
+    def astype(self,dtype):
+        '''
+        Cast all matrices to a data type.
+
+        Parameters:
+            :dtype: dtype, the target data type.
+
+        Return:
+            <SuperBlockOperator>, the new operator.
+        '''
+        return SuperBlockOperator(self.HL.astype(dtype),self.HR.astype(dtype),
+                [(A.astype(dtype),B.astype(dtype)) for A,B in self.pairs],indices=self.indices)
+
+    def to_real(self,tol=1e-12):
+        '''
+        Get the real form of this operator if it is real(e.g. Sy*Sy terms with imaginary factors).
+
+        The phases of the factors A_k and B_k are moved out, the term is real if they cancel up to a sign.
+
+        Parameters:
+            :tol: float, the tolerance of imaginary parts.
+
+        Return:
+            <SuperBlockOperator>/None, the real operator, None if it is complex.
+        '''
+        def split_phase(M):
+            #M = phase*real matrix, phase is None if there is no such form.
+            if not iscomplexobj(M.data) or M.nnz==0:
+                return 1.,M.real
+            phase=exp(1j*angle(M.data[argmax(abs(M.data))]))
+            R=M*phase.conj()
+            if abs(R.data.imag).max()>=tol:
+                return None,None
+            return phase,R.real
+        for H in [self.HL,self.HR]:
+            if H.nnz>0 and abs(H.data.imag).max()>=tol:
+                return None
+        pairs=[]
+        for A,B in self.pairs:
+            (pa,RA),(pb,RB)=split_phase(A),split_phase(B)
+            if pa is None or pb is None or abs((pa*pb).imag)>=tol:
+                return None
+            pairs.append((RA*(pa*pb).real,RB))
+        return SuperBlockOperator(self.HL.real,self.HR.real,pairs,indices=self.indices)
+
+    def _apply(self,X):
+        '''Apply the hamiltonian to X with shape (ndiml, ndimr, m).'''
+        ndiml,ndimr,m=X.shape
+        def _lmul(M,Y):
+            return M.dot(Y.reshape([ndiml,-1])).reshape(Y.shape)
+        def _rmul(M,Y):
+            Yt=Y.transpose([1,0,2]).reshape([ndimr,-1])
+            return M.dot(Yt).reshape([ndimr,ndiml,m]).transpose([1,0,2])
+        Y=_lmul(self.HL,X)+_rmul(self.HR,X)
+        for A,B in self.pairs:
+            Y=Y+_lmul(A,_rmul(B,X))
+        return Y
+
+    def _matmat(self,V):
+        ndiml,ndimr=self.HL.shape[0],self.HR.shape[0]
+        m=V.shape[1]
+        dtype=result_type(self.dtype,V.dtype)
+        if self.indices is None:
+            X=asarray(V,dtype=dtype).reshape([ndiml,ndimr,m])
+        else:
+            X=zeros([ndiml*ndimr,m],dtype=dtype)
+            X[self.indices]=V
+            X=X.reshape([ndiml,ndimr,m])
+        Y=self._apply(X).reshape([ndiml*ndimr,m])
+        if self.indices is not None:
+            Y=Y[self.indices]
+        return Y
+
+    def _matvec(self,v):
+        return self._matmat(reshape(v,[-1,1])).ravel()
+
+    def diagonal(self):
+        '''The diagonal part of this operator.'''
+        dl,dr=self.HL.diagonal(),self.HR.diagonal()
+        d=(dl[:,newaxis]+dr).astype(self.dtype)
+        for A,B in self.pairs:
+            d=d+A.diagonal()[:,newaxis]*B.diagonal()
+        d=d.ravel()
+        if self.indices is not None:
+            d=d[self.indices]
+        return d
+
+    def toarray(self):
+        '''Get the dense matrix, for small blocks only.'''
+        return self._matmat(identity(self.shape[0],dtype=self.dtype))
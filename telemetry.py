@@ -0,0 +1,237 @@
+'''
+Telemetry of DMRG/VMPS runs, one record is emitted per step and per sweep.
+'''
+
+from numpy import *
+import json,time,sys,pdb
+
+__all__=['StepRecord','SweepRecord','Telemetry','ListSink','JSONLinesSink','PrintSink','EXPENSIVE_METRICS']
+
+#metrics that cost real time, they are computed only when some sink asks for them.
+EXPENSIVE_METRICS=['density','entropy','overlap']
+
+class Record(object):
+    '''
+    Base class of telemetry records.
+
+    Attributes:
+        :FIELDS: tuple, the names of fields, unset fields are None.
+    '''
+    FIELDS=()
+    KIND=None
+
+    def __init__(self,**kwargs):
+        for key in kwargs:
+            if key not in self.FIELDS:
+                raise KeyError('Unknown field %s for %s.'%(key,self.__class__.__name__))
+        for key in self.FIELDS:
+            setattr(self,key,kwargs.get(key))
+
+    def __str__(self):
+        return '<%s> %s'%(self.__class__.__name__,', '.join(['%s = %s'%(key,getattr(self,key)) for key in self.FIELDS if getattr(self,key) is not None]))
+
+    def update(self,**kwargs):
+        '''Set fields.'''
+        for key,value in kwargs.items():
+            if key not in self.FIELDS:
+                raise KeyError('Unknown field %s for %s.'%(key,self.__class__.__name__))
+            setattr(self,key,value)
+
+    def todict(self):
+        '''Convert to a dict of json serializable values.'''
+        res={'kind':self.KIND}
+        for key in self.FIELDS:
+            res[key]=_tojson(getattr(self,key))
+        return res
+
+class StepRecord(Record):
+    '''
+    Record of a single DMRG/VMPS step.
+
+    Fields:
+        :engine: str, 'dmrg' or 'vmps'.
+        :isweep: int, the index of sweep(or iteration for infinite DMRG).
+        :direction: str, '->' or '<-'.
+        :pos: int, the position of step.
+        :energy: float/1D array, the energy(levels).
+        :dE: float/1D array, the energy change compared with the last step.
+        :elapse: float, the time of this step in seconds.
+        :timings: dict, the time of each phase in seconds, e.g. 'hamiltonian', 'eigen', 'trunc'.
+        :ndim: int, the dimension of the targeted hamiltonian.
+        :nnz: int/None, the number of non-zero elements of the hamiltonian, None for matrix-free operators.
+        :density: float, the density of the hamiltonian(expensive).
+        :niter/nmatvec: int, the number of iterations/matrix-vector products of eigensolver.
+        :bond_dim: int, the number of kept states.
+        :trunc_error: float, the truncation error.
+        :entropy: float, the entanglement entropy at the cut(expensive).
+        :overlap: float, the overlap between the predicted and the solved state(expensive).
+        :memory_estimate: float, the estimated memory of this step in bytes(only with a memory budget).
+        :hbuilder: str, the builder of the hamiltonian, 'block', 'block0' or 'matfree'.
+        :precision: str, the precision of eigensolver and truncation, 'single' or 'double'.
+        :peak_rss: dict, the peak resident set size of the process in bytes at the end of each phase.
+    '''
+    KIND='step'
+    FIELDS=('engine','isweep','direction','pos','energy','dE','elapse','timings','ndim','nnz','density',
+            'niter','nmatvec','bond_dim','trunc_error','entropy','overlap','memory_estimate','peak_rss','hbuilder',
+            'precision')
+
+class SweepRecord(Record):
+    '''
+    Record of a sweep.
+
+    Fields:
+        :engine: str, 'dmrg' or 'vmps'.
+        :isweep: int, the index of sweep.
+        :energy: float/1D array, the energy(levels) at the end(or midpoint) of sweep.
+        :dE: float/1D array, the energy change compared with the last sweep.
+        :trunc_error: float, the maximum truncation error in this sweep.
+        :elapse: float, the time of this sweep in seconds.
+        :nstep: int, the number of steps.
+        :converged: bool, the sweep scheduler decides to stop.
+    '''
+    KIND='sweep'
+    FIELDS=('engine','isweep','energy','dE','trunc_error','elapse','nstep','converged')
+
+def _tojson(value):
+    '''Convert numpy types to json serializable values.'''
+    if isinstance(value,ndarray):
+        return _tojson(value.tolist())
+    elif isinstance(value,(list,tuple)):
+        return [_tojson(v) for v in value]
+    elif isinstance(value,dict):
+        return dict([(k,_tojson(v)) for k,v in value.items()])
+    elif isinstance(value,(complex,complexfloating)):
+        return [value.real,value.imag]
+    elif isinstance(value,generic):
+        return _tojson(value.item())
+    elif isinstance(value,float) and (isnan(value) or isinf(value)):
+        return None
+    return value
+
+class Sink(object):
+    '''
+    Base class of telemetry sinks.
+
+    Attributes:
+        :metrics: list, the expensive metrics(in EXPENSIVE_METRICS) this sink asks for.
+    '''
+    def __init__(self,metrics=()):
+        self.metrics=list(metrics)
+
+    def emit(self,record):
+        '''Receive a record.'''
+        raise NotImplementedError()
+
+    def close(self):
+        '''Release resources.'''
+        pass
+
+class ListSink(Sink):
+    '''
+    Keep records in memory.
+
+    Attributes:
+        :records: list, the received records.
+    '''
+    def __init__(self,metrics=()):
+        super(ListSink,self).__init__(metrics)
+        self.records=[]
+
+    def emit(self,record):
+        self.records.append(record)
+
+    def steps(self):
+        '''Get the step records.'''
+        return [r for r in self.records if isinstance(r,StepRecord)]
+
+    def sweeps(self):
+        '''Get the sweep records.'''
+        return [r for r in self.records if isinstance(r,SweepRecord)]
+
+class JSONLinesSink(Sink):
+    '''
+    Write records into a json-lines file, one record per line.
+
+    Attributes:
+        :filename: str, the target file, appended if exists.
+    '''
+    def __init__(self,filename,metrics=()):
+        super(JSONLinesSink,self).__init__(metrics)
+        self.filename=filename
+        self._file=open(filename,'a')
+
+    def emit(self,record):
+        self._file.write(json.dumps(record.todict())+'\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class PrintSink(Sink):
+    '''
+    Print records in human readable form.
+
+    Attributes:
+        :stream: file, the output stream.
+    '''
+    def __init__(self,metrics=(),stream=None):
+        super(PrintSink,self).__init__(metrics)
+        self.stream=stream
+
+    def emit(self,record):
+        stream=self.stream or sys.stdout
+        if isinstance(record,StepRecord):
+            stream.write('[%s] sweep %s%s%s: E = %s, dE = %s, Elapse -> %.2f(%s), D = %s, TruncError -> %s, nmatvec = %s\n'%(record.engine,
+                record.isweep,record.direction or '',record.pos,record.energy,record.dE,record.elapse or 0,
+                ', '.join(['%s:%.2f'%(k,v) for k,v in sorted((record.timings or {}).items())]),record.bond_dim,record.trunc_error,record.nmatvec))
+            extra=['%s = %s'%(key,getattr(record,key)) for key in EXPENSIVE_METRICS if getattr(record,key) is not None]
+            if len(extra)>0:
+                stream.write('    %s\n'%(', '.join(extra)))
+        else:
+            stream.write('[%s] SWEEP SUMMARY %s: E = %s, dE = %s, TruncError -> %s, Elapse -> %.2f%s\n'%(record.engine,
+                record.isweep,record.energy,record.dE,record.trunc_error,record.elapse or 0,', converged' if record.converged else ''))
+
+class Telemetry(object):
+    '''
+    Dispatch records to registered sinks, no sink is registered by default.
+
+    Attributes:
+        :sinks: list, the registered sinks.
+    '''
+    def __init__(self,sinks=()):
+        self.sinks=list(sinks)
+
+    def __getstate__(self):
+        #sinks may hold files and streams, they are not pickled.
+        return {'sinks':[]}
+
+    def add_sink(self,sink):
+        '''Register a sink.'''
+        self.sinks.append(sink)
+        return sink
+
+    def remove_sink(self,sink):
+        '''Unregister a sink.'''
+        self.sinks.remove(sink)
+
+    @property
+    def enabled(self):
+        '''True if any sink is registered.'''
+        return len(self.sinks)>0
+
+    def wants(self,metric):
+        '''
+        Check whether an expensive metric is asked for by any sink.
+
+        Parameters:
+            :metric: str, the name of metric.
+
+        Return:
+            bool.
+        '''
+        return any([metric in sink.metrics for sink in self.sinks])
+
+    def emit(self,record):
+        '''Send a record to all sinks.'''
+        for sink in self.sinks:
+            sink.emit(record)
@@ -0,0 +1,68 @@
+'''
+Tests for out-of-core block storage.
+'''
+from numpy import *
+from numpy.testing import dec,assert_,assert_raises,assert_almost_equal,assert_allclose
+import scipy.sparse as sps
+import pdb,time,copy,sys,cPickle,tempfile,shutil,os
+sys.path.insert(0,'../')
+
+from blockstorage import BlockStorage,get_nbytes
+
+class DummyBlock(object):
+    def __init__(self,N):
+        self.N=N
+        self.ops={'H':sps.random(300,300,density=0.2,format='csr')}
+        self.U=random.random([100,100])
+
+class TestBlockStorage(object):
+    def test_spill(self):
+        '''test for spilling and loading blocks.'''
+        blocks=[DummyBlock(i) for i in xrange(6)]
+        storage=BlockStorage(budget=3*get_nbytes(blocks[0]),nactive=2)
+        for block in blocks:
+            storage[block.N]=block
+        assert_(len(storage)==6 and len(storage._spilled)>0)
+        assert_(storage.nbytes<=storage.budget)
+        storage.prefetch(0)
+        for block in blocks:
+            b=storage[block.N]
+            assert_(b.N==block.N)
+            assert_allclose(b.U,block.U)
+            assert_allclose(b.ops['H'].toarray(),block.ops['H'].toarray())
+
+    def test_pickle(self):
+        '''test for pickling as a dict.'''
+        storage=BlockStorage(budget=0)
+        for i in xrange(3):
+            storage[i]=DummyBlock(i)
+        data=cPickle.loads(cPickle.dumps(storage,cPickle.HIGHEST_PROTOCOL))
+        assert_(isinstance(data,dict) and sorted(data.keys())==[0,1,2])
+
+    def test_link(self):
+        '''test for moving spilled blocks by files without loading them.'''
+        blocks=[DummyBlock(i) for i in xrange(4)]
+        storage=BlockStorage(budget=0,nactive=1)
+        for block in blocks:
+            storage[block.N]=block
+        directory=tempfile.mkdtemp()
+        try:
+            data,files=storage.link_spilled(directory)
+            assert_(data.keys()==[3] and sorted(files.keys())==[0,1,2])
+            assert_(all([os.path.exists(os.path.join(directory,fname)) for fname,npyfiles in files.values()]))
+            del storage
+            storage=BlockStorage(data,budget=0,nactive=1)
+            storage.add_spilled(directory,files)
+            for block in blocks:
+                assert_allclose(storage[block.N].U,block.U)
+            #the files in the storage are removed once loaded, those in `directory` are kept.
+            assert_(all([os.path.exists(os.path.join(directory,fname)) for fname,npyfiles in files.values()]))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_all(self):
+        self.test_spill()
+        self.test_pickle()
+        self.test_link()
+
+TestBlockStorage().test_all()
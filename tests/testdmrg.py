@@ -5,14 +5,18 @@ from numpy import *
 from matplotlib.pyplot import *
 from numpy.testing import dec,assert_,assert_raises,assert_almost_equal,assert_allclose
 from scipy.sparse.linalg import eigsh
-import pdb,time,copy,sys
+import pdb,time,copy,sys,tempfile,shutil,os,warnings
 sys.path.insert(0,'../')
 
 from tba.hgen import SpinSpaceConfig
 from rglib.mps import WL2OPC,OpUnitI,opunit_Sz,opunit_Sp,opunit_Sm,opunit_Sx,opunit_Sy,MPS
 from rglib.hexpand import ExpandGenerator
 from rglib.hexpand import MaskedEvolutor,NullEvolutor,Evolutor
-from dmrg import DMRGEngine
+from dmrg import DMRGEngine,_get_kpmask,estimate_memory,estimate_build_cost,calibrate_hbuilder
+from scheduler import SweepScheduler
+from telemetry import ListSink
+from superblock import OP_CACHE
+import flib
 from lanczos import get_H,get_H_bm
 
 class HeisenbergModel(object):
@@ -130,15 +134,252 @@ class DMRGTest():
         EG2=dmrgegn.run_finite(endpoint=(5,'<-',0),maxN=[10,20,40,40,40],tol=0)[0]
         assert_almost_equal(EG1,EG2,decimal=4)
 
+    def test_checkpoint(self):
+        '''test for resuming finite dmrg from checkpoints.'''
+        nsite=10
+        model=self.get_model(nsite,1)
+        directory=tempfile.mkdtemp()
+        try:
+            hgen=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+            dmrgegn=DMRGEngine(hgen=hgen,tol=0,reflect=True)
+            dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+            EG1=dmrgegn.run_finite(endpoint=(3,'<-',0),maxN=[10,20,40],tol=0,checkpoint=directory,checkpoint_interval=0)[0]
+            hgen=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+            dmrgegn=DMRGEngine(hgen=hgen,tol=0,reflect=True)
+            dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+            EG2=dmrgegn.run_finite(endpoint=(4,'<-',0),maxN=[10,20,40,40],tol=0,checkpoint=directory,resume=True)[0]
+            assert_almost_equal(EG1,EG2,decimal=4)
+            #spilled blocks are checkpointed by their files, the recycled subspace is kept.
+            shutil.rmtree(directory)
+            hgen=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+            dmrgegn=DMRGEngine(hgen=hgen,tol=0,reflect=True)
+            dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+            dmrgegn.use_out_of_core(budget=0)
+            dmrgegn.use_recycling(2)
+            dmrgegn.run_finite(endpoint=(3,'<-',0),maxN=[10,20,40],tol=0,checkpoint=directory,checkpoint_interval=0)
+            blockdirs=[fname for fname in os.listdir(directory) if fname.startswith('blocks_')]
+            assert_(len(blockdirs)==1 and len(os.listdir(os.path.join(directory,blockdirs[0])))>0)
+            hgen=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+            dmrgegn=DMRGEngine(hgen=hgen,tol=0,reflect=True)
+            dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+            dmrgegn.use_out_of_core(budget=0)
+            dmrgegn.load_checkpoint(directory)
+            assert_(len(dmrgegn._subspace)>0 and len(dmrgegn.LPART._spilled)>0)
+            EG3=dmrgegn.run_finite(endpoint=(4,'<-',0),maxN=[10,20,40,40],tol=0,checkpoint=directory,resume=True)[0]
+            assert_almost_equal(EG1,EG3,decimal=4)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_scheduler(self):
+        '''test for finite dmrg driven by a sweep scheduler with early stopping.'''
+        nsite=10
+        model=self.get_model(nsite,1)
+        hgen1=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='null')
+        hgen2=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+        H=get_H(hgen1)
+        EG1=eigsh(H,k=1,which='SA')[0]
+        dmrgegn=DMRGEngine(hgen=hgen2,tol=0,reflect=True)
+        dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+        scheduler=SweepScheduler(maxN=[10,20,40,40,40,40,40,40],eigen_tol=[1e-6,1e-8]+[1e-10]*6,etol=1e-8,min_sweep=3)
+        sink=dmrgegn.telemetry.add_sink(ListSink(metrics=['entropy']))
+        EG2=dmrgegn.run_finite(endpoint=(8,'<-',0),scheduler=scheduler)[0]
+        assert_almost_equal(EG1,EG2,decimal=4)
+        assert_(sink.sweeps()[-1].converged and sink.steps()[-1].entropy>0)
+
+    def test_precision(self):
+        '''test for single precision warm-up sweeps and the promotion to double precision.'''
+        scheduler=SweepScheduler(maxN=[10,20,40],precision=['single','single','double'],eigen_tol=1e-10,etol=1)
+        assert_(scheduler.get_eigen_tol(0)>1e-10 and scheduler.get_eigen_tol(2)==1e-10)
+        assert_(not scheduler.check_convergence(0,0,0) and not scheduler.check_stall(0,-1.))
+        assert_(scheduler.check_stall(0,1e-7) and scheduler.precision==['single','double','double'])
+        assert_raises(ValueError,SweepScheduler,maxN=[10,20],precision=['half','double'])
+        #the state saved in checkpoints, a resumed schedule keeps the promotion.
+        scheduler2=SweepScheduler(maxN=[10,20,40,40],precision=['single','single','single','double'])
+        scheduler2.set_state(scheduler.get_state())
+        assert_(scheduler2.precision==['single','double','double','double'] and scheduler2.nstall==1 and scheduler2.promoted_at==0)
+        nsite=10
+        model=self.get_model(nsite,1)
+        hgen1=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='null')
+        hgen2=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+        H=get_H(hgen1)
+        EG1=eigsh(H,k=1,which='SA')[0]
+        dmrgegn=DMRGEngine(hgen=hgen2,tol=0,reflect=True)
+        dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+        sink=dmrgegn.telemetry.add_sink(ListSink())
+        EG2=dmrgegn.run_finite(endpoint=(4,'<-',0),maxN=[10,20,40,40],tol=0,precision=['single','single','double','double'])[0]
+        assert_almost_equal(EG1,EG2,decimal=4)
+        precisions=[record.precision for record in sink.steps()]
+        assert_(precisions[0]=='single' and precisions[-1]=='double')
+
+    def test_sectors(self):
+        '''test for targeting multiple blocks at once.'''
+        nsite=10
+        model=self.get_model(nsite,1)
+        hgen1=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='normal')
+        hgen2=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+        H,bm=get_H_bm(hgen=hgen1,bstr='M')
+        #the ground state sector and the lowest sector with positive M.
+        labels=[zeros(1),min([label for label in bm.labels if label[0]>0],key=lambda label:label[0])]
+        EG1=[eigsh(bm.extract_block(H,(label,label),uselabel=True),k=1,which='SA')[0][0] for label in labels]
+        dmrgegn=DMRGEngine(hgen=hgen2,tol=0,reflect=True)
+        dmrgegn.use_U1_symmetry('M',target_block=array(labels),weights=[0.7,0.3],nworker=2)
+        assert_(len(dmrgegn.target_blocks)==2 and all(dmrgegn.target_block==labels[0]))
+        EG2=dmrgegn.run_finite(endpoint=(4,'<-',0),maxN=[10,20,40,40],tol=0)[0]
+        assert_allclose(EG2,EG1,atol=1e-4)
+
+    def test_recycling(self):
+        '''test for finite dmrg with recycled Ritz subspace.'''
+        nsite=10
+        model=self.get_model(nsite,1)
+        hgen1=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='null')
+        hgen2=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+        H=get_H(hgen1)
+        EG1=eigsh(H,k=1,which='SA')[0]
+        dmrgegn=DMRGEngine(hgen=hgen2,tol=0,reflect=True)
+        dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            dmrgegn.use_recycling(nextra=2)
+            assert_(len(w)==1 and dmrgegn.eigen_solver=='BD')
+        EG2=dmrgegn.run_finite(endpoint=(4,'<-',0),maxN=[10,20,40,40],tol=0)[0]
+        assert_almost_equal(EG1,EG2,decimal=4)
+        assert_(dmrgegn.eigen_info['solver']=='BD')
+
+    def test_block_levels(self):
+        '''test for the opt-in block Davidson solver of multi-level steps.'''
+        model=self.get_model(10,1)
+        ELS,solvers=[],[]
+        for block_levels in [False,True]:
+            hgen=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+            dmrgegn=DMRGEngine(hgen=hgen,tol=0,reflect=True)
+            dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+            dmrgegn.use_block_levels(block_levels)
+            ELS.append(dmrgegn.run_finite(endpoint=(3,'<-',0),maxN=[10,20,40],tol=0,nlevel=2)[0])
+            solvers.append(dmrgegn.eigen_info['solver'])
+        assert_allclose(ELS[0],ELS[1],atol=1e-6)
+        assert_(solvers==['LC','BD'])
+
+    def test_memory_budget(self):
+        '''test for memory estimation and budget.'''
+        mem=estimate_memory(400,400,40000,nnz_row=30)
+        mem2=estimate_memory(400,400,40000,nnz_row=30,hbuilder='matfree')
+        assert_(mem['total']>mem2['total'] and mem['hamiltonian']>0 and mem2['hamiltonian']==0)
+        svds=[estimate_memory(4000,400,40000,nnz_row=30,svd_backend=backend,maxN=20)['svd'] for backend in ['full','thin','randomized']]
+        assert_(svds[0]>svds[1]>svds[2])
+        model=self.get_model(10,1)
+        hgen=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+        dmrgegn=DMRGEngine(hgen=hgen,tol=0,reflect=True)
+        dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+        dmrgegn.use_memory_budget(1024)
+        assert_(OP_CACHE.maxsize<=102)
+        assert_raises(MemoryError,dmrgegn.run_finite,endpoint=(2,'<-',0),maxN=[10,20],tol=0)
+        OP_CACHE.resize(2**30)
+
+    def test_hbuilder(self):
+        '''test for hamiltonian builders and the automatic selection.'''
+        costs=estimate_build_cost(400,400,40000,nnz_l=4000,nnz_r=4000,interop_nnz=[(400,400)]*3)
+        costs2=estimate_build_cost(400,400,40000,nnz_l=4000,nnz_r=4000,interop_nnz=[(400,400)]*3,nmatvec=300)
+        assert_(all([costs2[key]>costs[key] for key in costs]))
+        #the calibration is only cached in an explicit file.
+        directory=tempfile.mkdtemp()
+        try:
+            filename=os.path.join(directory,'calibration.json')
+            costs=dict(calibrate_hbuilder(filename))
+            assert_(os.path.isfile(filename) and calibrate_hbuilder(filename)==costs)
+        finally:
+            shutil.rmtree(directory)
+        model=self.get_model(10,1)
+        ELS=[]
+        for hbuilder in ['block','block0','matfree','auto']:
+            hgen=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+            dmrgegn=DMRGEngine(hgen=hgen,tol=0,reflect=True,hbuilder=hbuilder)
+            dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+            sink=dmrgegn.telemetry.add_sink(ListSink())
+            #the data types of the hamiltonian and the starting vector passed to the eigensolver.
+            dtypes=[]
+            eigsh0=dmrgegn._eigsh
+            def _eigsh(H,v0,*args,**kwargs):
+                dtypes.append((H.dtype,None if v0 is None else v0.dtype))
+                return eigsh0(H,v0,*args,**kwargs)
+            dmrgegn._eigsh=_eigsh
+            EG=dmrgegn.run_finite(endpoint=(3,'<-',0),maxN=[10,20,30],tol=0)[0]
+            ELS.append(EG)
+            assert_(all([r.hbuilder in ['block','block0','matfree'] for r in sink.steps()]))
+            #the Heisenberg model is real, so are the matrix-free hamiltonians.
+            assert_(all([dtype==float64 and dtype0 in (None,float64) for dtype,dtype0 in dtypes]))
+        assert_allclose(ELS,ELS[0],atol=1e-8)
+        assert_raises(ValueError,DMRGEngine,hgen=hgen,hbuilder='dense')
+
+    def test_concurrent_terms(self):
+        '''test for building interop terms concurrently, with next-nearest neighbor terms.'''
+        model=self.get_model(10,2)
+        ELS=[]
+        backend=flib.BACKEND
+        for hbuilder,nworker,kernel in [('block',1,backend),('block',4,backend),('block0',4,backend),('block',4,'numpy')]:
+            flib.set_backend(kernel)
+            hgen=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+            dmrgegn=DMRGEngine(hgen=hgen,tol=0,reflect=True,hbuilder=hbuilder)
+            dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+            dmrgegn.use_concurrent_terms(nworker)
+            ELS.append(dmrgegn.run_finite(endpoint=(3,'<-',0),maxN=[10,20,30],tol=0)[0])
+        flib.set_backend(backend)
+        assert_allclose(ELS,ELS[0],atol=1e-8)
+
+    def test_svd_backend(self):
+        '''test for thin and randomized svd backends of truncation.'''
+        model=self.get_model(10,1)
+        ELS=[]
+        for backend in ['full','thin','randomized']:
+            hgen=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+            dmrgegn=DMRGEngine(hgen=hgen,tol=0,reflect=True)
+            dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+            dmrgegn.use_svd_backend(backend,nworker=2)
+            ELS.append(dmrgegn.run_finite(endpoint=(3,'<-',0),maxN=[4,8,8],tol=0)[0])
+        assert_allclose(ELS,ELS[0],atol=1e-6)
+        assert_raises(ValueError,dmrgegn.use_svd_backend,'lanczos')
+
+    def test_1site(self):
+        '''test for single-site steps with density matrix perturbation.'''
+        nsite=10
+        model=self.get_model(nsite,2)
+        hgen1=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='null')
+        hgen2=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+        EG1=eigsh(get_H(hgen1),k=1,which='SA')[0]
+        dmrgegn=DMRGEngine(hgen=hgen2,tol=0,reflect=True)
+        dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+        sink=dmrgegn.telemetry.add_sink(ListSink())
+        EG2=dmrgegn.run_finite(endpoint=(5,'<-',0),maxN=[10,20,40,40,40],tol=0,mode='1site',alpha=1e-3)[0]
+        assert_almost_equal(EG1,EG2,decimal=4)
+        assert_(any([record.hbuilder=='1site' for record in sink.steps()]))
+        assert_raises(ValueError,dmrgegn.run_finite,mode='0site')
+
+    def test_truncation(self):
+        '''test for truncation by discarded weight.'''
+        spec=array([0.01,0.5,0.04,0.3,0.15,0])
+        assert_allclose(_get_kpmask(spec,maxN=10,tol=0),[1,1,1,1,1,0])
+        assert_allclose(_get_kpmask(spec,maxN=10,tol=0.02),[0,1,1,1,1,0])
+        assert_allclose(_get_kpmask(spec,maxN=2,tol=0.02),[0,1,0,1,0,0])
+        assert_allclose(_get_kpmask(spec,maxN=10,tol=1.),[0,1,0,0,0,0])
+
     def test_dmrg_infinite(self):
         '''test for infinite dmrg.'''
-        maxiter=100
+        maxiter,maxN=100,20
         model=self.get_model(maxiter+2,1)
-        hgen=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
-        dmrgegn=DMRGEngine(hgen=hgen,tol=0,reflect=True,iprint=10)
-        dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
-        EG=dmrgegn.run_infinite(maxiter=maxiter,maxN=20,tol=0)[0]
-        assert_almost_equal(EG,0.25-log(2),decimal=2)
+        nmatvecs=[]
+        for predict in [False,True]:
+            hgen=ExpandGenerator(spaceconfig=SpinSpaceConfig([1,2]),H=model.H_serial,evolutor_type='masked')
+            #the block davidson solver counts matrix-vector products for small superblocks as well.
+            dmrgegn=DMRGEngine(hgen=hgen,tol=0,reflect=True,iprint=10,eigen_solver='BD')
+            dmrgegn.use_U1_symmetry('M',target_block=zeros(1))
+            sink=dmrgegn.telemetry.add_sink(ListSink())
+            EG=dmrgegn.run_infinite(maxiter=maxiter,maxN=maxN,tol=0,predict=predict)[0]
+            assert_almost_equal(EG,0.25-log(2),decimal=2)
+            #only the iterations with truncated bonds(smaller than the full block dimension).
+            steps=[record for record in sink.steps() if record.bond_dim==maxN]
+            assert_(len(steps)>maxiter/2)
+            nmatvecs.append(sum([record.nmatvec or 0 for record in steps]))
+        #the prediction should save matrix-vector products.
+        assert_(nmatvecs[0]>0 and nmatvecs[1]<0.5*nmatvecs[0])
 
     def test_lanczos(self):
         '''test for directly construct and solve the ground state energy.'''
@@ -154,5 +395,17 @@ class DMRGTest():
         assert_almost_equal(Emin,Emin2)
 
 DMRGTest().test_dmrg_finite()
+DMRGTest().test_checkpoint()
+DMRGTest().test_scheduler()
+DMRGTest().test_truncation()
+DMRGTest().test_svd_backend()
+DMRGTest().test_1site()
+DMRGTest().test_memory_budget()
+DMRGTest().test_hbuilder()
+DMRGTest().test_concurrent_terms()
+DMRGTest().test_recycling()
+DMRGTest().test_block_levels()
+DMRGTest().test_sectors()
+DMRGTest().test_precision()
 DMRGTest().test_lanczos()
 DMRGTest().test_dmrg_infinite()
@@ -0,0 +1,66 @@
+'''
+Tests for block Davidson eigensolver.
+'''
+from numpy import *
+from numpy.testing import dec,assert_,assert_raises,assert_almost_equal,assert_allclose
+from scipy.sparse.linalg import aslinearoperator
+import scipy.sparse as sps
+import pdb,time,copy,sys
+sys.path.insert(0,'../')
+
+from eigsolver import block_davidson,real_if_close,cast_precision
+
+class TestEigSolver(object):
+    def get_H(self,N,dtype='float64'):
+        H=sps.random(N,N,density=0.02,format='csr')+sps.diags(0.1*arange(N),0)
+        if dtype=='complex128':
+            H=H+1j*sps.random(N,N,density=0.02,format='csr')
+        return (H+H.T.conj())/2.
+
+    def test_davidson(self):
+        '''test for the lowest levels of real and complex matrices.'''
+        for dtype in ['float64','complex128']:
+            H=self.get_H(500,dtype)
+            E0=linalg.eigvalsh(H.toarray())[:4]
+            e,v=block_davidson(H,k=4,tol=1e-9)
+            assert_allclose(e,E0,atol=1e-8)
+            assert_allclose(v.T.conj().dot(v),identity(4),atol=1e-10)
+            assert_allclose(H.dot(v),v*e,atol=1e-8)
+
+    def test_start_block(self):
+        '''test for starting from a block of good guesses on a <LinearOperator>.'''
+        H=self.get_H(500)
+        E,V=linalg.eigh(H.toarray())
+        v0=V[:,:3]+1e-3*random.random([500,3])
+        e,v=block_davidson(aslinearoperator(H),v0=v0,k=3,tol=1e-9)
+        assert_allclose(e,E[:3],atol=1e-8)
+
+    def test_real_if_close(self):
+        '''test for dropping vanishing imaginary parts.'''
+        H=self.get_H(100)
+        v0=1j*random.random(100)
+        H1,v1=real_if_close(H.astype('complex128'),v0)
+        assert_(H1.dtype==float64 and v1.dtype==float64)
+        assert_allclose(v1,v0.imag)
+        H2,v2=real_if_close(self.get_H(100,'complex128'),v0)
+        assert_(H2.dtype==complex128 and v2 is v0)
+        assert_(real_if_close(H.toarray()+0j)[0].dtype==float64)
+
+    def test_single(self):
+        '''test for single precision matrices.'''
+        H=self.get_H(300)
+        H1,v1=cast_precision(H,random.random(300),'single')
+        assert_(H1.dtype==float32 and v1.dtype==float32)
+        assert_(cast_precision(H.astype('complex128'),precision='single')[0].dtype==complex64)
+        e,v=block_davidson(H1,v0=v1,k=2,tol=1e-4)
+        assert_(v.dtype==float32)
+        E=linalg.eigvalsh(H.toarray())
+        assert_allclose(e,E[:2],atol=1e-4)
+
+    def test_all(self):
+        self.test_davidson()
+        self.test_start_block()
+        self.test_real_if_close()
+        self.test_single()
+
+TestEigSolver().test_all()
@@ -17,62 +17,12 @@ from rglib.mps import op2collection
 from rglib.hexpand import ExpandGenerator,NullEvolutor,MaskedEvolutor,Evolutor
 from lanczos import get_H,get_H_bm
 from dmrg import *
+from toymodel import ChainN,chorder
 
 swap_axis=True
 if swap_axis:
     SpaceConfig.SPACE_TOKENS=['nambu','atom','spin','orbit']
 
-def chorder(l):
-    '''change the order of config.'''
-    if swap_axis:
-        l[-3],l[-2]=l[-2],l[-3]
-    return l
-
-class ChainN(object):
-    '''This is a tight-binding model for a chain.'''
-    def __init__(self,t,t2=0,U=0,mu=0.,occ=True,nsite=6):
-        self.t,self.t2,self.U,self.mu=t,t2,U,mu
-        self.occ=occ
-        self.nsite=nsite
-
-        #occupation representation will use <SuperSpaceConfig>, otherwise <SpaceConfig>.
-        if self.occ:
-            spaceconfig=SuperSpaceConfig(chorder([nsite,2,1]))
-        else:
-            spaceconfig=SpaceConfig(chorder([1,2,nsite,1]),kspace=False)
-            if abs(U)>0: warnings.warn('U is ignored in non-occupation representation.')
-        hgen=RHGenerator(spaceconfig=spaceconfig)
-
-        #define the operator of the system
-        hgen.register_params({
-            't1':self.t,
-            't2':self.t2,
-            'U':self.U,
-            '-mu':-self.mu,
-            })
-
-        #define a structure and initialize bonds.
-        rlattice=Chain(N=nsite)
-        hgen.uselattice(rlattice)
-
-        b1s=rlattice.getbonds(1)  #the nearest neighbor
-        b2s=rlattice.getbonds(2)  #the nearest neighbor
-
-        #add the hopping term.
-        op_t1=op_simple_hopping(label='hop1',spaceconfig=spaceconfig,bonds=b1s)
-        hgen.register_operator(op_t1,param='t1')
-        op_t2=op_simple_hopping(label='hop2',spaceconfig=spaceconfig,bonds=b2s)
-        hgen.register_operator(op_t2,param='t2')
-        op_n=op_simple_onsite(label='n',spaceconfig=spaceconfig)
-        hgen.register_operator(op_n,param='-mu')
-
-        #add the hubbard interaction term if it is in the occupation number representation.
-        if self.occ:
-            op_ninj=op_U(label='ninj',spaceconfig=spaceconfig)
-            hgen.register_operator(op_ninj,param='U')
-
-        self.hgen=hgen
-
 class TestFH(object):
     '''
     Test for fermionic dmrg.
@@ -146,6 +96,32 @@ class TestFH(object):
         print (Vmin2.state/Vmin1)[abs(Vmin1)>1e-2]
         pdb.set_trace()
 
+    def test_1site(self):
+        '''test for single-site steps with fermionic links.'''
+        spaceconfig=self.spaceconfig1
+        self.set_params(U=0.,t=1.,mu=0.2,t2=0.,nsite=6)
+        E_excit=eigvalsh(self.model_exact.hgen.H())
+        Emin_exact=sum(E_excit[E_excit<0])
+        H_serial=op2collection(op=self.model_occ.hgen.get_opH())
+        expander=ExpandGenerator(spaceconfig=spaceconfig,H=H_serial,evolutor_type='masked',use_zstring=True)
+        dmrgegn=DMRGEngine(hgen=expander,tol=0,reflect=False)
+        dmrgegn.use_U1_symmetry('QM',target_block=(0,0))
+        EG=dmrgegn.run_finite(endpoint=(5,'<-',0),maxN=[10,30,60,100,100],tol=0,mode='1site',alpha=1e-3)[0]
+        assert_almost_equal(Emin_exact,EG,decimal=4)
+
+    def test_infinite(self):
+        '''test for the prediction of infinite dmrg with fermionic links.'''
+        spaceconfig=self.spaceconfig1
+        self.set_params(U=0.,t=1.,mu=0.2,t2=0.,nsite=40)
+        H_serial=op2collection(op=self.model_occ.hgen.get_opH())
+        EGs=[]
+        for predict in [False,True]:
+            expander=ExpandGenerator(spaceconfig=spaceconfig,H=H_serial,evolutor_type='masked',use_zstring=True)
+            dmrgegn=DMRGEngine(hgen=expander,tol=0,reflect=True)
+            dmrgegn.use_U1_symmetry('QM',target_block=(0,0))
+            EGs.append(dmrgegn.run_infinite(maxiter=19,maxN=40,tol=0,predict=predict)[0])
+        assert_almost_equal(EGs[0],EGs[1],decimal=6)
+
     def test_site_image(self):
         H_serial=op2collection(op=self.model_occ.hgen.get_opH())
         H_serial.insert_Zs(spaceconfig=self.spaceconfig1)
@@ -156,6 +132,8 @@ class TestFH(object):
     def test_all(self):
         self.test_disc_symm(20)
         self.test_nonint()
+        self.test_1site()
+        self.test_infinite()
         self.test_site_image()
 
 
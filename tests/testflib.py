@@ -0,0 +1,142 @@
+'''
+Tests for sub-block kernels.
+'''
+from numpy import *
+from numpy.testing import dec,assert_,assert_raises,assert_almost_equal,assert_allclose
+import scipy.sparse as sps
+import pdb,time,copy,sys
+from multiprocessing.pool import ThreadPool
+sys.path.insert(0,'../')
+
+import flib
+from flib import fget_subblock2a,fget_subblock2b,fget_subblock1,fget_subblock_dmrg,fcount_subblock_dmrg_csr,fget_subblock_dmrg_csr
+from flib import pyflib
+
+class TestFlib(object):
+    def __init__(self):
+        nl,nr,nh,hndim=6,5,3,2
+        self.fl=random.random([nl,nh,nl])+1j*random.random([nl,nh,nl])
+        self.fr=random.random([nr,nh,nr])+1j*random.random([nr,nh,nr])
+        self.o1=random.random([nh,hndim,hndim,nh])
+        self.o2=random.random([nh,hndim,hndim,nh])+1j*random.random([nh,hndim,hndim,nh])
+        self.hl=asfortranarray(random.random([40,40])+1j*random.random([40,40]))
+        self.hr=asfortranarray(random.random([30,30]))
+        self.shape2=(nl,hndim,hndim,nr)
+        self.shape1=(nl,hndim,nr)
+
+    def get_indices(self,shape,ndim):
+        flat=sort(random.choice(prod(shape),ndim,replace=False))
+        return asarray(transpose(unravel_index(flat,shape)),dtype='int32',order='F'),flat
+
+    def test_kernels(self):
+        '''test for sub-blocks against dense contractions.'''
+        fl,o1,o2,fr=self.fl,self.o1,self.o2,self.fr
+        indices,flat=self.get_indices(self.shape2,100)
+        D=prod(self.shape2)
+        full=einsum('iaj,akmb,bpqc,rcs->ikprjmqs',fl,o1,o2,fr).reshape([D,D])[ix_(flat,flat)]
+        assert_allclose(fget_subblock2a(fl,o1,o2,fr,indices),full)
+        assert_allclose(fget_subblock2b(fl,o1,o2,fr,indices),full)
+        indices,flat=self.get_indices(self.shape1,50)
+        D=prod(self.shape1)
+        full=einsum('iaj,akmb,rbs->ikrjms',fl,o1,fr).reshape([D,D])[ix_(flat,flat)]
+        assert_allclose(fget_subblock1(fl,o1,fr,indices),full)
+        indices,flat=self.get_indices((40,30),200)
+        for is_identity in [0,1,2]:
+            hl=identity(40) if is_identity==1 else self.hl
+            hr=identity(30) if is_identity==2 else self.hr
+            res=fget_subblock_dmrg(asfortranarray(hl),asfortranarray(hr),indices,is_identity)
+            assert_allclose(res,kron(hl,hr)[ix_(flat,flat)])
+
+    def test_numpy(self):
+        '''test for the numpy backend against the default backend.'''
+        fl,o1,o2,fr=self.fl,self.o1,self.o2,self.fr
+        indices,flat=self.get_indices(self.shape2,100)
+        for suffix,cast in [('',lambda a:a),('_real',lambda a:asfortranarray(a.real))]:
+            args=[cast(a) for a in [fl,o1,o2,fr]]
+            assert_allclose(getattr(pyflib,'fget_subblock2a'+suffix)(*(args+[indices])),fget_subblock2a(*(args+[indices])))
+            assert_allclose(getattr(pyflib,'fget_subblock2b'+suffix)(*(args+[indices])),fget_subblock2b(*(args+[indices])))
+        indices,flat=self.get_indices(self.shape1,50)
+        assert_allclose(pyflib.fget_subblock1(fl,o1,fr,indices),fget_subblock1(fl,o1,fr,indices))
+        indices,flat=self.get_indices((40,30),200)
+        hl,hr=sps.csr_matrix(self.hl*(random.random(self.hl.shape)<0.2)),sps.csr_matrix(self.hr*(random.random(self.hr.shape)<0.2))
+        lookup=-ones(40*30,dtype='int32')
+        lookup[flat]=arange(len(flat),dtype='int32')
+        for is_identity in [0,1,2]:
+            assert_allclose(pyflib.fget_subblock_dmrg(self.hl,self.hr,indices,is_identity),
+                    fget_subblock_dmrg(self.hl,self.hr,indices,is_identity))
+            kwargs=dict(hl_indptr=hl.indptr,hl_indices=hl.indices,hr_indptr=hr.indptr,hr_indices=hr.indices,
+                    indices=indices,lookup=lookup,is_identity=is_identity)
+            indptr=pyflib.fcount_subblock_dmrg_csr(**kwargs)
+            assert_(array_equal(indptr,fcount_subblock_dmrg_csr(**kwargs)))
+            kwargs.update(hl_data=hl.data,hr_data=hr.data,indptr=indptr,nnz=indptr[-1])
+            data,colind=pyflib.fget_subblock_dmrg_csr(**kwargs)
+            data2,colind2=fget_subblock_dmrg_csr(**kwargs)
+            assert_(array_equal(colind,colind2))
+            assert_allclose(data,data2)
+            assert_(pyflib.fget_subblock_dmrg_csr_real(**dict(kwargs,hl_data=hl.data.real))[0].dtype==float64)
+
+    def test_numpy_threads(self):
+        '''test for the numpy backend called from concurrent threads, as in concurrent interop terms.'''
+        indices,flat=self.get_indices((40,30),300)
+        lookup=-ones(40*30,dtype='int32')
+        lookup[flat]=arange(len(flat),dtype='int32')
+        pairs=[(sps.csr_matrix(self.hl*(random.random(self.hl.shape)<0.2)),sps.csr_matrix(self.hr*(random.random(self.hr.shape)<p)))
+                for p in [0.1,0.2,0.3,0.4]*4]
+        def get_csr(args):
+            (hl,hr),is_identity=args
+            kwargs=dict(hl_indptr=hl.indptr,hl_indices=hl.indices,hr_indptr=hr.indptr,hr_indices=hr.indices,
+                    indices=indices,lookup=lookup,is_identity=is_identity)
+            indptr=pyflib.fcount_subblock_dmrg_csr(**kwargs)
+            time.sleep(0.001)
+            data,colind=pyflib.fget_subblock_dmrg_csr(hl_data=hl.data,hr_data=hr.data,indptr=indptr,nnz=indptr[-1],**kwargs)
+            return indptr,data,colind
+        items=[(pair,i%3) for i,pair in enumerate(pairs)]
+        pool=ThreadPool(4)
+        res=pool.map(get_csr,items)
+        pool.close()
+        for item,(indptr,data,colind) in zip(items,res):
+            indptr2,data2,colind2=get_csr(item)
+            assert_(array_equal(indptr,indptr2) and array_equal(colind,colind2))
+            assert_allclose(data,data2)
+
+    def test_threads(self):
+        '''test for the threaded build, results should be identical to the serial build.'''
+        if not flib.THREADED:
+            print 'The threaded build(flibomp) is not available, skip.'
+            return
+        from flib import flib as serial
+        nthread=flib.get_num_threads()
+        indices,flat=self.get_indices((40,30),500)
+        indices2,flat2=self.get_indices(self.shape2,100)
+        lookup=-ones(40*30,dtype='int32')
+        lookup[flat]=arange(len(flat),dtype='int32')
+        hl,hr=sps.csr_matrix(self.hl*(random.random(self.hl.shape)<0.2)),sps.csr_matrix(self.hr*(random.random(self.hr.shape)<0.2))
+        csr_results=[]
+        for n in [1,2,4]:
+            flib.set_num_threads(n)
+            for is_identity in [0,1,2]:
+                assert_(array_equal(fget_subblock_dmrg(self.hl,self.hr,indices,is_identity),
+                    serial.fget_subblock_dmrg(self.hl,self.hr,indices,is_identity)))
+            assert_(array_equal(fget_subblock2b(self.fl,self.o1,self.o2,self.fr,indices2),
+                serial.fget_subblock2b(self.fl,self.o1,self.o2,self.fr,indices2)))
+            res=[]
+            for is_identity in [0,1,2]:
+                kwargs=dict(hl_indptr=hl.indptr,hl_indices=hl.indices,hr_indptr=hr.indptr,hr_indices=hr.indices,
+                        indices=indices,lookup=lookup,is_identity=is_identity)
+                indptr=fcount_subblock_dmrg_csr(**kwargs)
+                kwargs.update(indptr=indptr,nnz=indptr[-1])
+                for hl_data in [hl.data,hl.data.real]:
+                    data,colind=fget_subblock_dmrg_csr(hl_data=hl_data,hr_data=hr.data,**kwargs)
+                    res.extend([indptr,data,colind])
+            csr_results.append(res)
+        for res in csr_results[1:]:
+            assert_(all([array_equal(a,b) for a,b in zip(res,csr_results[0])]))
+        flib.set_num_threads(nthread)
+
+    def test_all(self):
+        self.test_kernels()
+        self.test_numpy()
+        self.test_numpy_threads()
+        self.test_threads()
+
+TestFlib().test_all()
@@ -0,0 +1,47 @@
+'''
+Tests for kernel profiler.
+'''
+from numpy import *
+from numpy.testing import dec,assert_,assert_raises,assert_almost_equal,assert_allclose
+import pdb,time,copy,sys
+from StringIO import StringIO
+sys.path.insert(0,'../')
+
+from profiler import PROFILER,profiled,profiling
+
+@profiled('test.sleep')
+def sleep(t):
+    time.sleep(t)
+    return t
+
+class TestProfiler(object):
+    def test_disabled(self):
+        '''test for no counting when disabled.'''
+        enabled=PROFILER.enabled
+        PROFILER.enabled=False
+        PROFILER.reset()
+        assert_(sleep(0)==0)
+        assert_(len(PROFILER.counters)==0)
+        PROFILER.enabled=enabled
+
+    def test_profiling(self):
+        '''test for counters and the per-sweep table.'''
+        with profiling() as prof:
+            for isweep in xrange(2):
+                for i in xrange(isweep+1):
+                    sleep(0.01)
+                with prof.timer('test.section'):
+                    pass
+                prof.mark_sweep(isweep)
+        ncall,wall,cpu=prof.counters['test.sleep']
+        assert_(ncall==3 and wall>=0.03)
+        assert_(prof.sweeps[1][1]['test.sleep'][0]==2)
+        stream=StringIO()
+        prof.dump(stream)
+        assert_('test.section' in stream.getvalue() and 'sweep 1' in stream.getvalue())
+
+    def test_all(self):
+        self.test_disabled()
+        self.test_profiling()
+
+TestProfiler().test_all()
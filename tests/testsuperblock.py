@@ -0,0 +1,88 @@
+'''
+Tests for super block utilities.
+'''
+from numpy import *
+from numpy.testing import dec,assert_,assert_raises,assert_almost_equal,assert_allclose
+import scipy.sparse as sps
+import pdb,time,copy,sys
+sys.path.insert(0,'../')
+
+from superblock import SuperBlockOperator,OpCache,get_subblock_csr,get_subblock_lookup
+from eigsolver import real_if_close,cast_precision
+
+class TestSuperBlock(object):
+    def __init__(self):
+        nl,nr=7,9
+        self.HL=sps.random(nl,nl,density=0.3,format='csr')+1j*sps.random(nl,nl,density=0.3,format='csr')
+        self.HR=sps.random(nr,nr,density=0.3,format='csr')
+        self.pairs=[(sps.random(nl,nl,density=0.3),sps.random(nr,nr,density=0.3)) for i in xrange(3)]
+        self.indices=sort(random.choice(nl*nr,30,replace=False))
+        self.cinds=array(unravel_index(self.indices,(nl,nr))).T.astype('int32')
+
+    def test_subblock_csr(self):
+        '''test for sparse sub-block extraction.'''
+        nl,nr=self.HL.shape[0],self.HR.shape[0]
+        ind=self.indices
+        lookup=get_subblock_lookup(self.cinds,(nl,nr))
+        for is_identity in [0,1,2]:
+            hl=sps.identity(nl) if is_identity==1 else self.HL
+            hr=sps.identity(nr) if is_identity==2 else self.HR
+            res=get_subblock_csr(hl,hr,self.cinds,lookup=lookup,is_identity=is_identity)
+            assert_allclose(res.toarray(),sps.kron(hl,hr).tocsr()[ind][:,ind].toarray())
+        #real operators use the real kernel.
+        hl=self.HL.real
+        res=get_subblock_csr(hl,self.HR,self.cinds,lookup=lookup)
+        assert_(res.dtype==float64)
+        assert_allclose(res.toarray(),sps.kron(hl,self.HR).tocsr()[ind][:,ind].toarray())
+
+    def test_operator(self):
+        '''test for the matrix-free super block hamiltonian.'''
+        nl,nr=self.HL.shape[0],self.HR.shape[0]
+        ind=self.indices
+        H=sps.kron(self.HL,sps.identity(nr))+sps.kron(sps.identity(nl),self.HR)+sum([sps.kron(A,B) for A,B in self.pairs])
+        Hc=H.tocsr()[ind][:,ind]
+        op=SuperBlockOperator(self.HL,self.HR,self.pairs,indices=ind)
+        v=random.random([len(ind),2])
+        assert_allclose(op.dot(v),Hc.dot(v))
+        assert_allclose(op.dot(v[:,0]),Hc.dot(v[:,0]))
+        assert_allclose(op.diagonal(),Hc.diagonal())
+        assert_allclose(SuperBlockOperator(self.HL,self.HR,self.pairs).toarray(),H.toarray())
+
+    def test_operator_cast(self):
+        '''test for the real form and the precision of the matrix-free super block hamiltonian.'''
+        nl,nr=self.HL.shape[0],self.HR.shape[0]
+        ind=self.indices
+        #real hamiltonians with imaginary factors, like Sy*Sy.
+        HL,HR=self.HL+self.HL.T.conj(),self.HR
+        HL=HL.real+0j
+        pairs=[(1j*A,1j*B) for A,B in self.pairs]+[(self.pairs[0][0]*(1+1j)/sqrt(2),self.pairs[0][1]*(1-1j)/sqrt(2))]
+        op=SuperBlockOperator(HL,HR,pairs,indices=ind)
+        v0=random.random(len(ind))+0j
+        op2,v=real_if_close(op,v0)
+        assert_(op.dtype==complex128 and op2.dtype==float64 and v.dtype==float64)
+        assert_allclose(op2.toarray(),op.toarray().real,atol=1e-12)
+        assert_allclose(op.toarray().imag,0,atol=1e-12)
+        op3,v=cast_precision(op2,v,'single')
+        assert_(op3.dtype==float32 and v.dtype==float32 and op3.dot(v).dtype==float32)
+        #complex hamiltonians stay complex.
+        op4=SuperBlockOperator(self.HL,HR,pairs,indices=ind)
+        assert_(real_if_close(op4,v0)[0] is op4)
+
+    def test_cache(self):
+        '''test for the size-bounded operator cache.'''
+        cache=OpCache(maxsize=10000)
+        for i in xrange(4):
+            cache.get(i,lambda:random.random([20,20]))
+        assert_(len(cache)==3 and cache.nbytes==3*3200 and cache.misses==4)
+        cache.get(3,None)
+        assert_(cache.hits==1)
+        cache.resize(5000)
+        assert_(len(cache)==1 and cache.nbytes<=cache.maxsize and 3 in cache._data)
+
+    def test_all(self):
+        self.test_subblock_csr()
+        self.test_operator()
+        self.test_operator_cast()
+        self.test_cache()
+
+TestSuperBlock().test_all()
@@ -0,0 +1,57 @@
+'''
+Tests for telemetry records and sinks.
+'''
+from numpy import *
+from numpy.testing import dec,assert_,assert_raises,assert_almost_equal,assert_allclose
+import pdb,time,copy,sys,json,os,tempfile,cPickle
+from StringIO import StringIO
+sys.path.insert(0,'../')
+
+from telemetry import Telemetry,StepRecord,SweepRecord,ListSink,JSONLinesSink,PrintSink
+
+class TestTelemetry(object):
+    def get_records(self):
+        step=StepRecord(engine='dmrg',isweep=0,direction='->',pos=3,energy=array([-4.2]),dE=Inf,
+                elapse=0.5,timings={'eigen':0.3},ndim=100,nnz=int64(500),bond_dim=20,trunc_error=float64(1e-8))
+        sweep=SweepRecord(engine='dmrg',isweep=0,energy=-4.2,dE=1e-5,trunc_error=1e-8,elapse=2.,nstep=8,converged=False)
+        return step,sweep
+
+    def test_record(self):
+        '''test for typed records.'''
+        step,sweep=self.get_records()
+        assert_(step.entropy is None and step.pos==3)
+        assert_raises(KeyError,StepRecord,foo=1)
+        assert_raises(KeyError,sweep.update,pos=1)
+        d=step.todict()
+        assert_(d['kind']=='step' and d['dE'] is None and d['energy']==[-4.2])
+        json.dumps(d)
+
+    def test_sinks(self):
+        '''test for dispatching to sinks.'''
+        step,sweep=self.get_records()
+        telemetry=Telemetry()
+        assert_(not telemetry.enabled and not telemetry.wants('entropy'))
+        lsink=telemetry.add_sink(ListSink(metrics=['entropy']))
+        stream=StringIO()
+        telemetry.add_sink(PrintSink(stream=stream))
+        filename=tempfile.mktemp(suffix='.jsonl')
+        jsink=telemetry.add_sink(JSONLinesSink(filename))
+        try:
+            assert_(telemetry.wants('entropy') and not telemetry.wants('density'))
+            telemetry.emit(step)
+            telemetry.emit(sweep)
+            jsink.close()
+            assert_(len(lsink.steps())==1 and len(lsink.sweeps())==1)
+            assert_(len(stream.getvalue().splitlines())==2)
+            lines=open(filename).read().splitlines()
+            assert_(len(lines)==2 and json.loads(lines[1])['nstep']==8)
+            #sinks are not pickled.
+            assert_(len(cPickle.loads(cPickle.dumps(telemetry)).sinks)==0)
+        finally:
+            os.remove(filename)
+
+    def test_all(self):
+        self.test_record()
+        self.test_sinks()
+
+TestTelemetry().test_all()
@@ -12,16 +12,26 @@ import time,pdb
 
 from pymps import contract,Tensor,check_validity_mps,BLabel,check_flow_mpx,get_sweeper
 from contractor import Contractor
+from telemetry import Telemetry,StepRecord,SweepRecord,PrintSink
 from pymps.mps import _autoset_bms
 from blockmatrix import trunc_bm
 from pydavidson import JDh
 from tba.hgen import ind2c,kron_csr
-from flib.flib import fget_subblock2a,fget_subblock2b,fget_subblock1
+from eigsolver import real_if_close,cast_precision
+from scheduler import SweepScheduler
+from flib import fget_subblock2a,fget_subblock2b,fget_subblock1
+from profiler import PROFILER,profiled
 
 __all__=['VMPSEngine']
 
 ZERO_REF=1e-12
 
+#hot kernels counted by the profiler.
+kron_csr=profiled('kron_csr')(kron_csr)
+fget_subblock2a,fget_subblock2b,fget_subblock1=profiled('fget_subblock2a')(fget_subblock2a),\
+        profiled('fget_subblock2b')(fget_subblock2b),profiled('fget_subblock1')(fget_subblock1)
+
+@profiled('vmps._eigsh')
 def _eigsh(H,v0,projector=None,tol=1e-10,sigma=None,lc_search_space=1,k=1,iprint=0,which='SA',eigen_solver='LC'):
     '''
     solve eigenvalue problem.
@@ -35,7 +45,7 @@ def _eigsh(H,v0,projector=None,tol=1e-10,sigma=None,lc_search_space=1,k=1,iprint
         #get the eigenvector with maximum overlap
         overlap=abs(reshape(v0,[1,-1]).dot(V).ravel())
         ind=argmax(overlap)
-        print 'Match Overlap = %s'%overlap[ind]
+        if iprint>0: print 'Match Overlap = %s'%overlap[ind]
         return E[ind],V[:,ind:ind+1]
     if eigen_solver=='LC':
         k=max(lc_search_space,k)
@@ -108,7 +118,8 @@ class VMPSEngine(object):
         :eigen_solver: str, eigenvalue solver.
             *'JD', Jacobi-Davidson method.
             *'LC', Lanczos, method.
-        :iprint: int, print information level.
+        :iprint: int, print information level, step and sweep records are printed if it is larger than 1.
+        :telemetry: <Telemetry>, one <StepRecord> per update and one <SweepRecord> per sweep are emitted to its sinks.
     '''
     def __init__(self,H,k0,labels=['s','m','a','b','c'],nsite_update=2,eigen_solver='JD',iprint=2):
         self.eigen_solver=eigen_solver
@@ -118,6 +129,8 @@ class VMPSEngine(object):
         ket<<ket.l-1  #right normalize the ket to the first bond, where we start our update
         nsite=ket.nsite
         self.iprint=iprint
+        self.telemetry=Telemetry()
+        if iprint>1: self.telemetry.add_sink(PrintSink())
 
         #unify labels
         self.labels=labels
@@ -193,7 +206,7 @@ class VMPSEngine(object):
     def run(self,nsweep,*args,**kwargs):
         self.sweep(start=(0,'->',self.con.ket.l-1),stop=(nsweep-1,'<-',0),*args,**kwargs)
 
-    def sweep(self,start,stop,maxN=50,tol=0,which='SA',iprint=1):
+    def sweep(self,start,stop,maxN=50,tol=0,which='SA',iprint=1,precision='double',stall_tol=1e-5):
         '''
         Run this application.
 
@@ -203,6 +216,9 @@ class VMPSEngine(object):
             :maxN: list/int, the maximum kept dimension.
             :tol: float, the tolerence.
             :which: str, string that specify the <MPS> desired, 'SL'(most similar to k0) or 'SA'(smallest)
+            :precision: list/str, the precision('single' or 'double') of each sweep,
+                single precision sweeps are promoted to double precision once the energy stalls.
+            :stall_tol: float, a single precision sweep stalls if the energy decreases less than it.
 
         Return:
             (E, <MPS>)
@@ -215,9 +231,11 @@ class VMPSEngine(object):
         use_bm=hasattr(ket,'bmg')
         if use_bm: bmg=ket.bmg
         if isinstance(maxN,int): maxN=[maxN]*(stop[0]+1)
+        scheduler=SweepScheduler(maxN,eigen_tol=1e-10,precision=precision,stall_tol=stall_tol)
         iprint=self.iprint
 
         elist=[]
+        t_sweep,nstep,terr=time.time(),0,0
         iterator=get_sweeper(start,stop,nsite=nsite-nsite_update,iprint=self.iprint)
         for iiter,direction,l in iterator:
             self.con.initialize_env()
@@ -263,7 +281,8 @@ class VMPSEngine(object):
                     #TcL(as;mc;b), TcR(b;as;mc)
                     Tci=kron_csr(csr_matrix(TcL[:,:,i]),csr_matrix(TcR[i,:,:]),takerows=indices)
                     t11=time.time()
-                    Tc=Tc+Tci.tocsc()[:,indices]
+                    with PROFILER.timer('VMPSEngine.sweep:accumulate_Tc'):
+                        Tc=Tc+Tci.tocsc()[:,indices]
                     t22=time.time()
                     tk+=t11-t00
                     tp+=t22-t11
@@ -285,30 +304,39 @@ class VMPSEngine(object):
                 v0c=v0[indices]
             else:
                 v0c=v0
+            Tc,v0c=real_if_close(Tc,v0c,tol=ZERO_REF)
+            Tc,v0c=cast_precision(Tc,v0c,scheduler.get_precision(iiter))
             if which=='SA':
-                E,Vc=_eigsh(Tc,v0=v0c,projector=None,tol=1e-10,sigma=None,lc_search_space=1,k=1,eigen_solver=self.eigen_solver)
+                E,Vc=_eigsh(Tc,v0=v0c,projector=None,tol=scheduler.get_eigen_tol(iiter),sigma=None,lc_search_space=1,k=1,eigen_solver=self.eigen_solver)
             elif which=='SL':
                 E,Vc=_eigsh(Tc.todense(),v0=v0c,which='SL',eigen_solver=self.eigen_solver)
             else:
                 raise ValueError()
 
             if use_bm:
-                V=zeros(bmd.N,dtype='complex128')
+                V=zeros(bmd.N,dtype=Vc.dtype)
                 V[indices]=Vc
             else:
                 V=Vc
-            overlap=v0.dot(V)
             t2=time.time()
+            record=StepRecord(engine='vmps',isweep=iiter,direction=direction,pos=l,ndim=Tc.shape[0],nnz=Tc.nnz,trunc_error=0,
+                    precision=scheduler.get_precision(iiter))
+            if self.telemetry.wants('overlap'):
+                record.overlap=abs(v0.dot(V))
+            if self.telemetry.wants('density'):
+                record.density=1.*Tc.nnz/Tc.shape[0]**2
 
             #update our ket,
             if nsite_update==2:
                 #if 2 site update, perform svd and truncate.
                 Vm=Tensor(V.reshape(K0s[0].shape[:2]+K0s[1].shape[1:]),labels=K0s[0].labels[:2]+K0s[1].labels[1:])
-                K1,S,K2=Vm.svd(cbond=2,cbond_str='%s_%s'%(self.labels[-1],l+1),signs=[1,1,-1,1],bmg=bmg)
+                with PROFILER.timer('Tensor.svd'):
+                    K1,S,K2=Vm.svd(cbond=2,cbond_str='%s_%s'%(self.labels[-1],l+1),signs=[1,1,-1,1],bmg=bmg)
                 #do the truncation
                 if len(S)>maxN[iiter]:
                     Smin=sort(S)[-maxN[iiter]]
                     kpmask=S>=Smin
+                    record.trunc_error=sum(S[~kpmask]**2)/sum(S**2)
                     K1,S,K2=K1.take(kpmask,axis=-1),S[kpmask],K2.take(kpmask,axis=0)
                 K1.eliminate_zeros(ZERO_REF)
                 K2.eliminate_zeros(ZERO_REF)
@@ -339,9 +367,14 @@ class VMPSEngine(object):
             #schedular check
             elist.append(E)
             diff=Inf if len(elist)<=1 else elist[-1]-elist[-2]
-            if iprint>1:
-                print 'Get E = %.12f, tol = %s, Elapse -> %s, %s states kept, nnz= %s, overlap %s.'%(E,'[-]' if diff==Inf else diff,t3-t0,bdim,Tc.nnz,overlap)
-                print 'Time: get Tc(%s), eigen(%s), svd(%s)'%(t1-t0,t2-t1,t3-t2)
+            record.update(energy=E,dE=diff,elapse=t3-t0,timings={'hamiltonian':t1-t0,'eigen':t2-t1,'trunc':t3-t2},bond_dim=bdim)
+            if self.telemetry.wants('entropy'):
+                spec=ket.S[ket.S>0]**2
+                spec=spec/sum(spec)
+                record.entropy=-sum(spec*log(spec))
+            self.telemetry.emit(record)
+            nstep+=1
+            terr=max(terr,record.trunc_error)
             if iiter==stop[0] and direction==stop[1] and l==stop[2]:
                 if iprint>1:
                     print 'RUN COMPLETE!'
@@ -353,14 +386,25 @@ class VMPSEngine(object):
                     E_last=Inf
                 diff=E_last-E
                 E_last=E
-                if iprint>0:
-                    print 'ITERATION SUMMARY: E/site = %s, tol = %s'%(E,'[-]' if diff==Inf else diff)
+                if scheduler.check_stall(iiter,-diff) and iprint>1:
+                    print 'Energy stalls in single precision, the remaining sweeps are promoted to double precision.'
+                PROFILER.mark_sweep(iiter)
+                self.telemetry.emit(SweepRecord(engine='vmps',isweep=iiter,energy=E,dE=diff,trunc_error=terr,elapse=time.time()-t_sweep,nstep=nstep))
+                t_sweep,nstep,terr=time.time(),0,0
+
+    def warmup(self,maxiter=10,precision='double'):
+        '''
+        Initialize the state.
 
-    def warmup(self,maxiter=10):
-        '''Initialize the state.'''
+        Parameters:
+            :maxiter: int, the number of sweeps.
+            :precision: str, 'single' to run the sweeps with maxN 3 and 8 in single precision.
+        '''
         run10=run5=maxiter/3
         run20=maxiter-run10-run5
-        self.run(maxiter,maxN=[3]*run5+[8]*run10+[16]*run20,which='SA')
+        if precision=='single':
+            precision=['single']*(run5+run10)+['double']*run20
+        self.run(maxiter,maxN=[3]*run5+[8]*run10+[16]*run20,which='SA',precision=precision)
 
     def generative_run(self,HP,ngen,niter_inner,S_pre=None,trunc_mps=False,*args,**kwargs):
         '''